@@ -0,0 +1,104 @@
+# Compares the k-nearest selection strategies used by the RRT planners:
+# the recursive Heap shipped before the indexed rewrite (kept below as
+# LegacyHeap), the indexed Heap, argpartition-based KSmallestIndices and
+# a full argsort.
+import sys
+import os
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'toppso3'))
+import Heap
+
+
+class LegacyHeap():
+    def __init__(self, datalist):
+        self.data = datalist
+        self.size = len(datalist)
+        self.nlevels = int(np.floor(np.log2(self.size))) + 1
+        self.indices = list(range(self.size))
+        for i in reversed(range(self.nlevels - 1)):
+            for j in range(int(2**i)):
+                self.Heapify(int(2**i - 1 + j))
+
+    def ExtractMin(self):
+        self.Swap(0, self.size - 1)
+        minelement = self.data[self.indices[self.size - 1]]
+        index = self.indices.pop()
+        self.size -= 1
+        if(self.size > 0):
+            self.Heapify(0)
+        return [index, minelement]
+
+    def Heapify(self, i):
+        lc = 2*i + 1
+        rc = 2*i + 2
+        smallest = i
+        if lc < self.size:
+            if self.data[self.indices[lc]] < self.data[self.indices[smallest]]:
+                smallest = lc
+        if rc < self.size:
+            if self.data[self.indices[rc]] < self.data[self.indices[smallest]]:
+                smallest = rc
+        if smallest != i:
+            self.Swap(i, smallest)
+            self.Heapify(smallest)
+
+    def Swap(self, i, j):
+        temp = self.indices[i]
+        self.indices[i] = self.indices[j]
+        self.indices[j] = temp
+
+
+def Legacy(distances, k):
+    heap = LegacyHeap(list(distances))
+    return [heap.ExtractMin()[0] for i in range(k)]
+
+
+def Indexed(distances, k):
+    heap = Heap.Heap(distances)
+    return [heap.ExtractMin()[0] for i in range(k)]
+
+
+def Partition(distances, k):
+    return Heap.KSmallestIndices(distances, k)
+
+
+def Argsort(distances, k):
+    return np.argsort(distances)[:k]
+
+
+def TimeIt(func, distances, k, nrepeats):
+    t_begin = time.time()
+    for i in range(nrepeats):
+        func(distances, k)
+    return (time.time() - t_begin)/nrepeats
+
+
+def DecreaseKeyCheck(n):
+    """DecreaseKeyCheck runs a Dijkstra-like workload of n random key
+    decreases and returns the elapsed time.
+    """
+    rng = np.random.RandomState(0)
+    heap = Heap.Heap(rng.rand(n) + 1)
+    t_begin = time.time()
+    for index in rng.randint(0, n, n):
+        heap.DecreaseKey(index, heap.data[index]*rng.rand())
+    keys = [heap.ExtractMin()[1] for i in range(n)]
+    assert(keys == sorted(keys))
+    return time.time() - t_begin
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    print "%8s %8s %12s %12s %12s %12s" % ('n', 'k', 'legacy', 'indexed',
+                                           'argpartition', 'argsort')
+    for n in [100, 1000, 10000]:
+        distances = rng.rand(n)
+        nrepeats = max(1, 20000 // n)
+        for k in [1, 10, n]:
+            assert(list(Legacy(distances, k)) == list(Partition(distances, k)))
+            row = [TimeIt(f, distances, k, nrepeats)*1e3
+                   for f in [Legacy, Indexed, Partition, Argsort]]
+            print "%8d %8d %10.4fms %10.4fms %10.4fms %10.4fms" % tuple([n, k] + row)
+    print "DecreaseKey + ExtractMin, n = 10000: %.4f sec." % DecreaseKeyCheck(10000)
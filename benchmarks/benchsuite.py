@@ -0,0 +1,272 @@
+# Headless benchmark suite for the hot paths of toppso3: Lie kernels,
+# interpolation, constraint generation, nearest-neighbour queries,
+# collision sweeps and end-to-end planning + shortcutting. Collisions are
+# checked against a synthetic Collision.SphereWorld so that no viewer or
+# environment file is needed. Every random draw is seeded and the
+# results are written as JSON, e.g.
+#
+#     python benchsuite.py --output results.json
+#     python benchsuite.py --quick --only lie,constraints
+import sys
+import os
+import time
+import json
+import random
+import argparse
+import platform
+import StringIO
+import traceback
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'toppso3'))
+import lie as Lie
+import LieKernels
+import Utils
+import Collision
+import ConstraintGrid
+import SO3Map
+import PolyTraj
+import SO3RRT
+import SE3RRT
+
+from openravepy import rotationMatrixFromQuat
+
+
+def TimeIt(func, nrepeats, ncalls=1):
+    """TimeIt runs func nrepeats times and returns the timings (per call
+    of func, and per elementary operation if func performs ncalls of
+    them).
+    """
+    timings = []
+    for i in range(nrepeats):
+        t_begin = time.time()
+        func()
+        timings.append(time.time() - t_begin)
+    timings = np.array(timings)
+    return {'nrepeats': nrepeats, 'ncalls': ncalls,
+            'best': float(timings.min()), 'mean': float(timings.mean()),
+            'percall': float(timings.min())/ncalls}
+
+
+class Silence():
+    """Silence swallows whatever the planners print while timed."""
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+
+    def __exit__(self, *args):
+        sys.stdout = self.stdout
+
+
+def RandomRotationTraj(rng, duration=2.0):
+    R0 = rotationMatrixFromQuat(RandomQuat(rng))
+    R1 = rotationMatrixFromQuat(RandomQuat(rng))
+    return R0, Lie.InterpolateSO3(R0, R1, rng.randn(3), rng.randn(3), duration)
+
+
+def RandomQuat(rng):
+    q = rng.randn(4)
+    return q/np.linalg.norm(q)
+
+
+def SyntheticWorld():
+    """SyntheticWorld returns a rod-shaped robot (a row of spheres along
+    its x-axis) at the center of a ring of spherical obstacles and a
+    floor box.
+    """
+    robotcenters = [[x, 0, 0] for x in np.linspace(-0.6, 0.6, 5)]
+    robotradii = [0.12]*5
+    angles = np.linspace(0, 2*np.pi, 8, endpoint=False) + np.pi/8
+    obstaclecenters = [[0.75*np.cos(a), 0.75*np.sin(a), 0.3] for a in angles]
+    obstacleradii = [0.15]*len(angles)
+    boxes = [[[-2, -2, -2], [2, 2, -0.75]]]
+    return Collision.SphereWorld(robotcenters, robotradii, obstaclecenters,
+                                 obstacleradii, boxes), 0.72
+
+
+############################## benchmarks ##############################
+def BenchLie(rng, quick, results):
+    n = 200 if quick else 2000
+    rs = rng.randn(n, 3)
+    rds = rng.randn(n, 3)
+    Rs = [Lie.expmat(r) for r in rs]
+    results['expmat'] = TimeIt(lambda: [Lie.expmat(r) for r in rs], 5, n)
+    results['logvect'] = TimeIt(lambda: [Lie.logvect(R) for R in Rs], 5, n)
+    results['Amat'] = TimeIt(lambda: [Lie.Amat(r) for r in rs], 5, n)
+    results['Ctensor'] = TimeIt(lambda: [Lie.Ctensor(r) for r in rs], 5, n)
+    results['expmatbatch'] = TimeIt(lambda: Lie.expmatbatch(rs), 5, n)
+    results['Ctermbatch'] = TimeIt(lambda: Lie.Ctermbatch(rs, rds), 5, n)
+    results['LieKernels.logvect'] = TimeIt(lambda: LieKernels.logvect(Rs), 5, n)
+    results['LieKernels.omegaalpha'] = TimeIt\
+    (lambda: LieKernels.omegaalpha(rs, rds, rds), 5, n)
+
+
+def BenchInterpolation(rng, quick, results):
+    n = 50 if quick else 500
+    args = [(rotationMatrixFromQuat(RandomQuat(rng)), rotationMatrixFromQuat(RandomQuat(rng)),
+             rng.randn(3), rng.randn(3), 0.5) for i in range(n)]
+    results['InterpolateSO3'] = TimeIt(lambda: [Lie.InterpolateSO3(*a) for a in args], 3, n)
+    batchargs = [np.array(column) for column in zip(*args)]
+    results['InterpolateSO3Batch'] = TimeIt(lambda: Lie.InterpolateSO3Batch(*batchargs), 3, n)
+    results['Interpolate3rdDegree'] = TimeIt\
+    (lambda: [PolyTraj.Interpolate3rdDegree(a[2], a[3], a[2], a[3], 0.5) for a in args], 3, n)
+
+
+def BenchConstraints(rng, quick, results):
+    duration = 2.0 if quick else 10.0
+    discrtimestep = 1e-2
+    taumax = np.ones(3)
+    fmax = np.ones(3)
+    R0, rtraj = RandomRotationTraj(rng, duration)
+    transtraj = PolyTraj.Interpolate3rdDegree(rng.randn(3), rng.randn(3),
+                                              rng.randn(3), rng.randn(3), duration)
+    se3traj = PolyTraj.PolyTraj.Stack([transtraj, PolyTraj.PolyTraj.FromTOPP(rtraj)])
+    ngridpoints = int(duration/discrtimestep) + 1
+    results['ComputeSO3Constraints'] = TimeIt\
+    (lambda: Lie.ComputeSO3Constraints(rtraj, taumax, discrtimestep, np.eye(3)), 5, ngridpoints)
+    results['ComputeSE3Constraints'] = TimeIt\
+    (lambda: Utils.ComputeSE3Constraints(se3traj, taumax, fmax, discrtimestep), 5, ngridpoints)
+    results['ConstraintGrid/cold'] = TimeIt\
+    (lambda: ConstraintGrid.ConstraintGrid(discrtimestep, taumax, np.eye(3)).Compute(rtraj),
+     5, ngridpoints)
+    grid = ConstraintGrid.ConstraintGrid(discrtimestep, taumax, np.eye(3))
+    grid.Compute(rtraj)
+    results['ConstraintGrid/warm'] = TimeIt(lambda: grid.Compute(rtraj), 5, ngridpoints)
+
+
+def BenchNearestNeighbor(rng, quick, results):
+    sizes = [100, 1000] if quick else [100, 1000, 5000, 20000]
+    nqueries = 50 if quick else 200
+    for (name, module) in [('SO3', SO3RRT), ('SE3', SE3RRT)]:
+        for size in sizes:
+            if name == 'SO3':
+                config = lambda: SO3RRT.Config(RandomQuat(rng))
+            else:
+                config = lambda: SE3RRT.Config(RandomQuat(rng), rng.rand(3)*2 - 1)
+            planner = module.RRTPlanner(module.Vertex(config(), module.FW),
+                                        module.Vertex(config(), module.BW), None)
+            root = planner.treestart.verticeslist[0]
+            for i in range(size - 1):
+                vertex = module.Vertex(config(), module.FW)
+                planner.treestart.AddVertex(root, vertex, planner.INTERPOLATIONDURATION)
+            queries = [config() for i in range(nqueries)]
+            planner.nn = 10
+            results['{0}/n={1}'.format(name, size)] = TimeIt\
+            (lambda: [planner.NearestNeighborIndices(c, module.FW) for c in queries], 3, nqueries)
+
+
+def BenchCollision(rng, quick, results):
+    world, robotradius = SyntheticWorld()
+    ntrajs = 20 if quick else 200
+    dt = 1e-3
+    sweeps = []
+    for i in range(ntrajs):
+        R0, rtraj = RandomRotationTraj(rng, 0.5)
+        transformations = Collision.TrajectoryTransformations\
+        (R0, rtraj, np.arange(0, rtraj.duration, dt))
+        sweeps.append((transformations, Collision.SweepLipschitz(dt, robotradius, rtraj)))
+    results['CheckPose'] = TimeIt\
+    (lambda: [world.CheckPose(T) for T in sweeps[0][0]], 3, len(sweeps[0][0]))
+    results['CheckPoses'] = TimeIt\
+    (lambda: world.CheckPoses(sweeps[0][0]), 3, len(sweeps[0][0]))
+    ## the sweeps are pure rotations about the origin
+    so3map = SO3Map.SO3Map.Build(world, 4 if quick else 5, robotradius)
+    mapbackend = SO3Map.SO3MapBackend(so3map, world)
+    results['SO3MapBackend/CheckPoses'] = TimeIt\
+    (lambda: mapbackend.CheckPoses(sweeps[0][0]), 3, len(sweeps[0][0]))
+    results['SO3MapBackend/hitrate'] = mapbackend.HitRate()
+    results['TrajectoryTransformations'] = TimeIt\
+    (lambda: Collision.TrajectoryTransformations(R0, rtraj, np.arange(0, rtraj.duration, dt)),
+     5, 1)
+    for mode in ['dense', 'bisection']:
+        results['sweep/' + mode] = TimeIt\
+        (lambda: [Collision.SweepIsInCollision(world, T, mode, None) for (T, L) in sweeps],
+         3, ntrajs)
+    results['sweep/bisection+lipschitz'] = TimeIt\
+    (lambda: [Collision.SweepIsInCollision(world, T, 'bisection', L) for (T, L) in sweeps],
+     3, ntrajs)
+
+
+def BenchEndToEnd(rng, quick, results):
+    world, robotradius = SyntheticWorld()
+    allottedtime = 30 if quick else 300
+    maxiter = 20 if quick else 200
+    q0 = np.array([1., 0, 0, 0])
+    q1 = np.array([np.cos(np.pi/4), 0, 0, np.sin(np.pi/4)])
+    planner = SO3RRT.RRTPlanner(SO3RRT.Vertex(SO3RRT.Config(q0), SO3RRT.FW),
+                                SO3RRT.Vertex(SO3RRT.Config(q1), SO3RRT.BW),
+                                None)
+    planner.collisionchecker = world
+    planner.RANDOM_NUMBER_GENERATOR = random.Random(rng.randint(2**31))
+    t_begin = time.time()
+    with Silence():
+        found = planner.Run(allottedtime)
+    results['RRTPlanner.Run'] = {'best': time.time() - t_begin, 'found': bool(found),
+                                 'iterations': planner.iterations,
+                                 'nvertices': len(planner.treestart) + len(planner.treeend)}
+    if not found:
+        return
+    lietraj = Lie.LieTraj(planner.GenFinalRotationMatrixList(), planner.GenFinalTrajList())
+    Utils.SetRandomSeed(rng.randint(2**31))
+    try:
+        t_begin = time.time()
+        with Silence():
+            newlietraj = Utils.Shortcut(None, np.ones(3), np.ones(3), lietraj, maxiter,
+                                        inertia=np.eye(3), checker=world)
+        results['Shortcut'] = {'best': time.time() - t_begin, 'maxiter': maxiter,
+                               'duration': lietraj.duration,
+                               'shortcutduration': newlietraj.duration}
+    finally:
+        Utils.SetRandomSeed(None)
+
+
+BENCHMARKS = [('lie', BenchLie),
+              ('interpolation', BenchInterpolation),
+              ('constraints', BenchConstraints),
+              ('nearestneighbor', BenchNearestNeighbor),
+              ('collision', BenchCollision),
+              ('endtoend', BenchEndToEnd)]
+
+
+def RunSuite(seed=0, quick=False, only=None):
+    report = {'seed': seed, 'quick': quick, 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'python': platform.python_version(), 'numpy': np.__version__,
+              'results': {}}
+    for (name, bench) in BENCHMARKS:
+        if (only is not None) and (name not in only):
+            continue
+        ## every benchmark gets its own seeded generators so that running
+        ## a subset does not change the inputs of the others
+        rng = np.random.RandomState(seed)
+        np.random.seed(seed) # used by lie.RandomQuat
+        print "running", name
+        ## benchmarks fill in their results as they go, so that a failure
+        ## (e.g. TOPP missing) keeps what was measured before it
+        results = report['results'][name] = {}
+        try:
+            bench(rng, quick, results)
+        except Exception:
+            results['error'] = traceback.format_exc()
+            print results['error']
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='toppso3 benchmark suite')
+    parser.add_argument('--output', default='benchsuite.json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('--only', default=None,
+                        help='comma-separated subset of: ' +
+                        ', '.join([name for (name, bench) in BENCHMARKS]))
+    args = parser.parse_args()
+    only = None if args.only is None else args.only.split(',')
+    report = RunSuite(args.seed, args.quick, only)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print "results written to", args.output
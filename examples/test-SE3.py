@@ -62,7 +62,7 @@ Rlist = biRRTinstance.GenFinalRotationMatrixList()
 TrajRotlist = biRRTinstance.GenFinalTrajList()
 lietraj = lie.LieTraj(Rlist,TrajRotlist)
 
-transtraj = Trajectory.PiecewisePolynomialTrajectory.FromString(biRRTinstance.GenFinalTrajTranString())
+transtraj = biRRTinstance.GenFinalTransTraj().ToTOPP()
 
 
 ion()
@@ -0,0 +1,187 @@
+"""Binary trajectory archives.
+
+An archive holds a list of rotation matrices (Rlist) and a list of
+piecewise-polynomial segments (the trajlist of a LieTraj, or the single
+trajectory of an SE(3) path). The file is a fixed header followed by raw
+little-endian arrays, so that it can be opened with np.memmap and any
+segment read without parsing the rest of the file:
+
+    header          8 bytes magic + 8 int64 (see HEADERFIELDS)
+    Rlist           float64 (nrotations, 3, 3)
+    segmentoffsets  int64   (nsegments + 1), index of each segment's first chunk
+    durations       float64 (nchunks)
+    coefficients    float64 (nchunks, ndof, degree + 1), weak-term-first
+"""
+
+import numpy as np
+
+import lie as Lie
+import PolyTraj
+import Utils
+
+MAGIC = 'TOPPSO3A'
+VERSION = 1
+HEADERFIELDS = ['version', 'kind', 'nrotations', 'nsegments', 'nchunks',
+                'ndof', 'degree', 'reserved']
+HEADERSIZE = len(MAGIC) + 8*len(HEADERFIELDS)
+
+## kinds of archived trajectories
+LIETRAJ = 0
+SE3TRAJ = 1
+
+
+class TrajArchive():
+    """TrajArchive gives read-only, memory-mapped access to an archive
+       written by SaveLieTraj or SaveSE3Traj. Nothing but the header is
+       read when the archive is opened.
+       Attributes:
+           filename       -- path of the archive
+           data           -- the whole file, memory-mapped as bytes
+           kind           -- LIETRAJ or SE3TRAJ
+           Rlist          -- (nrotations, 3, 3) memory-mapped rotation matrices
+           segmentoffsets -- (nsegments + 1) chunk offsets of the segments
+           durations      -- (nchunks) memory-mapped chunk durations
+           coefficients   -- (nchunks, ndof, degree + 1) memory-mapped
+                             polynomial coefficients
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = np.memmap(filename, dtype='u1', mode='r')
+        if self.data[:len(MAGIC)].tostring() != MAGIC:
+            raise ValueError("{0} is not a trajectory archive".format(filename))
+        header = self.MapArray('<i8', (len(HEADERFIELDS),), len(MAGIC))
+        header = dict(zip(HEADERFIELDS, [int(x) for x in header]))
+        if header['version'] != VERSION:
+            raise ValueError("unsupported archive version {0}".format(header['version']))
+        self.kind = header['kind']
+        ndof = header['ndof']
+        degree = header['degree']
+        nchunks = header['nchunks']
+
+        offset = HEADERSIZE
+        self.Rlist = self.MapArray('<f8', (header['nrotations'], 3, 3), offset)
+        offset += 8*9*header['nrotations']
+        self.segmentoffsets = self.MapArray('<i8', (header['nsegments'] + 1,), offset)
+        offset += 8*(header['nsegments'] + 1)
+        self.durations = self.MapArray('<f8', (nchunks,), offset)
+        offset += 8*nchunks
+        self.coefficients = self.MapArray('<f8', (nchunks, ndof, degree + 1), offset)
+
+
+    def MapArray(self, dtype, shape, offset):
+        """MapArray returns a read-only view of shape and dtype on the file
+        starting at byte offset.
+        """
+        return np.ndarray(shape, dtype=dtype, buffer=self.data, offset=offset)
+
+
+    def NSegments(self):
+        return len(self.segmentoffsets) - 1
+
+
+    def Segment(self, i):
+        """Segment returns segment i as a PolyTraj whose coefficients are a
+        view on the memory-mapped file.
+        """
+        i0 = self.segmentoffsets[i]
+        i1 = self.segmentoffsets[i + 1]
+        return PolyTraj.PolyTraj.FromDurations(self.coefficients[i0:i1],
+                                               self.durations[i0:i1])
+
+
+    def SegmentDurations(self):
+        cumulateddurations = np.append(0, np.cumsum(self.durations))
+        return np.diff(cumulateddurations[self.segmentoffsets])
+
+
+    def LieTraj(self):
+        """LieTraj loads the archive (of kind LIETRAJ) as a LieTraj of TOPP
+        trajectories.
+        """
+        assert(self.kind == LIETRAJ)
+        Rlist = [np.array(R) for R in self.Rlist]
+        trajlist = [self.Segment(i).ToTOPP() for i in range(self.NSegments())]
+        return Lie.LieTraj(Rlist, trajlist)
+
+
+    def SE3Traj(self):
+        """SE3Traj loads the archive (of kind SE3TRAJ) and returns the TOPP
+        SE(3) trajectory and the list of rotation matrices, as
+        Utils.ReadSE3TrajFiles.
+        """
+        assert(self.kind == SE3TRAJ)
+        rlist = [np.array(R) for R in self.Rlist]
+        se3traj = PolyTraj.PolyTraj.Concatenate\
+        ([self.Segment(i) for i in range(self.NSegments())]).ToTOPP()
+        return se3traj, rlist
+
+
+############################## writing ##############################
+def SaveArchive(filename, kind, Rlist, segments):
+    """SaveArchive writes an archive of Rlist and segments (a list of
+    PolyTraj with the same number of dofs).
+    """
+    degree = max([segment.degree for segment in segments])
+    ndof = segments[0].dimension
+    segmentoffsets = np.append(0, np.cumsum([segment.nchunks for segment in segments]))
+    durations = np.concatenate([segment.Durations() for segment in segments])
+    coefficients = np.concatenate([PolyTraj.PadCoefficients(segment.coefficients, degree)
+                                   for segment in segments])
+    Rlist = np.asarray(Rlist, dtype=float).reshape(-1, 3, 3)
+    header = [VERSION, kind, len(Rlist), len(segments), len(durations),
+              ndof, degree, 0]
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.asarray(header, dtype='<i8').tostring())
+        f.write(Rlist.astype('<f8').tostring())
+        f.write(segmentoffsets.astype('<i8').tostring())
+        f.write(durations.astype('<f8').tostring())
+        f.write(coefficients.astype('<f8').tostring())
+    return True
+
+
+def SaveLieTraj(lietraj, filename):
+    segments = [PolyTraj.PolyTraj.FromTOPP(traj) for traj in lietraj.trajlist]
+    return SaveArchive(filename, LIETRAJ, lietraj.Rlist, segments)
+
+
+def SaveSE3Traj(se3traj, rlist, filename):
+    return SaveArchive(filename, SE3TRAJ, rlist, [PolyTraj.PolyTraj.FromTOPP(se3traj)])
+
+
+def LoadLieTraj(filename):
+    return TrajArchive(filename).LieTraj()
+
+
+def LoadSE3Traj(filename):
+    return TrajArchive(filename).SE3Traj()
+
+
+############################## text converters ##############################
+def LieTrajTextToArchive(Rlistfilename, trajlistfilename, filename):
+    """LieTrajTextToArchive converts the text files written by
+    Utils.SaveLietrajAsTextFiles into an archive.
+    """
+    return SaveLieTraj(Utils.ReadLieTrajFiles(Rlistfilename, trajlistfilename),
+                       filename)
+
+
+def SE3TrajTextToArchive(rlistfilename, se3trajfilename, filename):
+    """SE3TrajTextToArchive converts the text files written by
+    Utils.SaveSE3trajAsTextFiles into an archive.
+    """
+    se3traj, rlist = Utils.ReadSE3TrajFiles(rlistfilename, se3trajfilename)
+    return SaveSE3Traj(se3traj, rlist, filename)
+
+
+def ArchiveToText(filename, Rlistfilename, trajlistfilename):
+    """ArchiveToText writes an archive back as the text files of
+    Utils.SaveLietrajAsTextFiles or Utils.SaveSE3trajAsTextFiles.
+    """
+    archive = TrajArchive(filename)
+    if archive.kind == LIETRAJ:
+        return Utils.SaveLietrajAsTextFiles(archive.LieTraj(), Rlistfilename,
+                                            trajlistfilename)
+    se3traj, rlist = archive.SE3Traj()
+    return Utils.SaveSE3trajAsTextFiles(se3traj, rlist, Rlistfilename, trajlistfilename)
@@ -0,0 +1,612 @@
+import multiprocessing
+import collections
+import numpy as np
+
+import lie as Lie
+import Metrics
+
+
+class CollisionBackend():
+    """Base class for collision checkers. A backend answers whether the
+       robot is in collision at a given 4x4 transformation (CheckPose) or
+       at each of an (N,4,4) array of them (CheckPoses).
+    """
+    ## number of transformations FindFirstCollision and
+    ## FindCollisionBisection hand to CheckPoses at once; backends with a
+    ## vectorized CheckPoses raise it
+    BLOCKSIZE = 1
+
+    def CheckPose(self, transformation):
+        """CheckPose returns True if the robot is IN-COLLISION at
+        transformation.
+        """
+        raise NotImplementedError
+
+
+    def CheckPoses(self, transformations):
+        """CheckPoses returns the boolean array of the CheckPose verdicts
+        at every transformation.
+        """
+        return np.array([bool(self.CheckPose(transformation))
+                         for transformation in transformations], dtype=bool)
+
+
+    def FindFirstCollision(self, transformations):
+        """FindFirstCollision returns the index of the first
+        transformation at which the robot is in collision, or -1.
+        """
+        if self.BLOCKSIZE <= 1:
+            for (i, transformation) in enumerate(transformations):
+                if self.CheckPose(transformation):
+                    return i
+            return -1
+        for start in range(0, len(transformations), self.BLOCKSIZE):
+            colliding = np.flatnonzero(self.CheckPoses\
+                                       (transformations[start:start + self.BLOCKSIZE]))
+            if len(colliding) > 0:
+                return start + colliding[0]
+        return -1
+
+
+    def HasClearance(self):
+        """HasClearance tells whether the backend implements Clearance.
+        """
+        return False
+
+
+    def EnvironmentStamp(self):
+        """EnvironmentStamp returns a value which changes whenever the
+        obstacles do, so that outcomes remembered from earlier queries
+        can be dropped (see EdgeMemo). By default, the environment is
+        assumed static.
+        """
+        return None
+
+
+    def Clearance(self, transformation):
+        """Clearance returns a lower bound on the distance between the
+        robot at transformation and the obstacles; it is negative if and
+        only if CheckPose reports a collision.
+        """
+        raise NotImplementedError
+
+
+    def Clearances(self, transformations):
+        """Clearances returns the array of the Clearance at every
+        transformation.
+        """
+        return np.array([self.Clearance(transformation)
+                         for transformation in transformations], dtype=float)
+
+
+    def FindCollisionBisection(self, transformations, lipschitz=None):
+        """FindCollisionBisection visits the transformations in
+        BisectionOrder and returns the index of a colliding one, or -1.
+        The verdict is the same as FindFirstCollision's but collisions in
+        the middle of a sweep are found much sooner. If lipschitz (an
+        upper bound on the displacement of any point of the robot between
+        two consecutive samples) is given and the backend has Clearance,
+        the samples within the clearance of a free sample are certified
+        free without being checked. Backends with a vectorized CheckPoses
+        check each level of BisectionLevels in batches.
+        """
+        n = len(transformations)
+        useclearance = (lipschitz is not None) and (lipschitz > 0) and self.HasClearance()
+        certified = np.zeros(n, dtype=bool)
+        if self.BLOCKSIZE > 1:
+            return self._FindCollisionBisectionBlocks(transformations, lipschitz,
+                                                      useclearance, certified)
+        for i in BisectionOrder(n):
+            if certified[i]:
+                continue
+            if useclearance:
+                clearance = self.Clearance(transformations[i])
+                if clearance < 0:
+                    return i
+                ## |j - i|*lipschitz < clearance for all certified j
+                r = int(np.ceil(clearance/lipschitz)) - 1
+                if r > 0:
+                    certified[max(0, i - r):i + r + 1] = True
+            elif self.CheckPose(transformations[i]):
+                return i
+        return -1
+
+
+    def _FindCollisionBisectionBlocks(self, transformations, lipschitz, useclearance,
+                                      certified):
+        """_FindCollisionBisectionBlocks is FindCollisionBisection for
+        backends with a vectorized CheckPoses: every level of
+        BisectionLevels is checked in batches of at most BLOCKSIZE samples
+        (CheckPoses, or Clearances when certifying).
+        """
+        transformations = np.asarray(transformations)
+        n = len(transformations)
+        for level in BisectionLevels(n):
+            for start in range(0, len(level), self.BLOCKSIZE):
+                block = level[start:start + self.BLOCKSIZE]
+                block = block[~certified[block]]
+                if len(block) == 0:
+                    continue
+                if useclearance:
+                    clearances = self.Clearances(transformations[block])
+                    colliding = np.flatnonzero(clearances < 0)
+                    if len(colliding) > 0:
+                        return block[colliding[0]]
+                    ## |j - i|*lipschitz < clearance for all certified j
+                    r = np.ceil(clearances/lipschitz).astype(int) - 1
+                    i, r = block[r > 0], r[r > 0]
+                    bounds = np.zeros(n + 1, dtype=int)
+                    np.add.at(bounds, np.maximum(i - r, 0), 1)
+                    np.add.at(bounds, np.minimum(i + r + 1, n), -1)
+                    certified |= np.cumsum(bounds[:n]) > 0
+                else:
+                    colliding = np.flatnonzero(self.CheckPoses(transformations[block]))
+                    if len(colliding) > 0:
+                        return block[colliding[0]]
+        return -1
+
+
+class OpenRAVEBackend(CollisionBackend):
+    """OpenRAVEBackend checks collision of an OpenRAVE robot against its
+       environment.
+    """
+
+    def __init__(self, robot):
+        import openravepy as orpy
+        self._CollisionReport = orpy.CollisionReport
+        self.robot = robot
+        self.env = robot.GetEnv()
+
+
+    def CheckPose(self, transformation):
+        with self.robot:
+            self.robot.SetTransform(transformation)
+            return bool(self.env.CheckCollision(self.robot, self._CollisionReport()))
+
+
+    def CheckPoses(self, transformations):
+        ## the robot's state is saved and restored once for all the poses
+        verdicts = np.zeros(len(transformations), dtype=bool)
+        report = self._CollisionReport()
+        with self.robot:
+            for (i, transformation) in enumerate(transformations):
+                self.robot.SetTransform(transformation)
+                verdicts[i] = self.env.CheckCollision(self.robot, report)
+        return verdicts
+
+
+    def EnvironmentStamp(self):
+        ## the update stamp of a body changes with its links' transforms
+        return tuple([(body.GetName(), body.GetUpdateStamp())
+                      for body in self.env.GetBodies() if body != self.robot])
+
+
+    def FindFirstCollision(self, transformations):
+        report = self._CollisionReport()
+        with self.robot:
+            for (i, transformation) in enumerate(transformations):
+                self.robot.SetTransform(transformation)
+                if self.env.CheckCollision(self.robot, report):
+                    return i
+        return -1
+
+
+class OpenRAVEBackendFactory():
+    """OpenRAVEBackendFactory is a picklable callable that loads an
+       environment file in a fresh OpenRAVE environment and returns an
+       OpenRAVEBackend for one of its bodies (the first one by default, as
+       in the examples). It is meant to be handed to
+       ParallelCollisionChecker, since environments cannot be sent to
+       other processes.
+    """
+
+    def __init__(self, envfilename, bodyname=None):
+        self.envfilename = envfilename
+        self.bodyname = bodyname
+
+
+    def __call__(self):
+        import openravepy as orpy
+        env = orpy.Environment()
+        env.Load(self.envfilename)
+        if self.bodyname is None:
+            robot = env.GetBodies()[0]
+        else:
+            robot = env.GetKinBody(self.bodyname)
+        return OpenRAVEBackend(robot)
+
+
+class SphereWorld(CollisionBackend):
+    """SphereWorld is a stand-in checker which needs no OpenRAVE: the
+       robot is a set of spheres attached to its frame and the obstacles
+       are spheres and axis-aligned boxes in the world frame. Clearances
+       and CheckPoses are vectorized over the poses.
+       Attributes:
+           robotcenters    -- (n,3) sphere centers in the robot frame
+           robotradii      -- (n,) sphere radii
+           obstaclecenters -- (m,3) obstacle sphere centers
+           obstacleradii   -- (m,) obstacle sphere radii
+           boxes           -- (l,2,3) lower and upper corners of the boxes
+    """
+
+    def __init__(self, robotcenters, robotradii, obstaclecenters=[],
+                 obstacleradii=[], boxes=[]):
+        self.robotcenters = np.reshape(np.asarray(robotcenters, dtype=float), (-1, 3))
+        self.robotradii = np.asarray(robotradii, dtype=float).ravel()
+        self.obstaclecenters = np.reshape(np.asarray(obstaclecenters, dtype=float), (-1, 3))
+        self.obstacleradii = np.asarray(obstacleradii, dtype=float).ravel()
+        self.boxes = np.reshape(np.asarray(boxes, dtype=float), (-1, 2, 3))
+
+
+    BLOCKSIZE = 64
+
+    def CheckPose(self, transformation):
+        return self.Clearance(transformation) < 0
+
+
+    def CheckPoses(self, transformations):
+        return self.Clearances(transformations) < 0
+
+
+    def HasClearance(self):
+        return True
+
+
+    def Clearance(self, transformation):
+        return self.Clearances(np.asarray(transformation)[None])[0]
+
+
+    def Clearances(self, transformations):
+        """Clearances returns the (N,) clearances of the robot at the
+        (N,4,4) transformations.
+        """
+        transformations = np.asarray(transformations, dtype=float)
+        ## (N,n,3) centers of the robot spheres
+        centers = np.einsum('nij,kj->nki', transformations[:, :3, :3], self.robotcenters)
+        centers += transformations[:, None, :3, 3]
+        clearances = np.empty(len(transformations))
+        clearances.fill(np.inf)
+        if len(self.obstaclecenters) > 0:
+            diff = centers[:, :, None, :] - self.obstaclecenters[None, None, :, :]
+            dist = np.sqrt(np.sum(diff*diff, axis=3))
+            dist -= self.robotradii[None, :, None] + self.obstacleradii[None, None, :]
+            clearances = np.minimum(clearances, np.min(dist, axis=(1, 2)))
+        if len(self.boxes) > 0:
+            lo = self.boxes[None, None, :, 0, :]
+            hi = self.boxes[None, None, :, 1, :]
+            c = centers[:, :, None, :]
+            diff = np.maximum(np.maximum(lo - c, c - hi), 0)
+            dist = np.sqrt(np.sum(diff*diff, axis=3)) - self.robotradii[None, :, None]
+            clearances = np.minimum(clearances, np.min(dist, axis=(1, 2)))
+        return clearances
+
+
+    def EnvironmentStamp(self):
+        return (self.obstaclecenters.tostring(), self.obstacleradii.tostring(),
+                self.boxes.tostring())
+
+
+    def BoundingRadius(self):
+        """BoundingRadius returns the radius of the smallest ball centered
+        at the robot's origin that contains all its spheres.
+        """
+        return np.max(np.sqrt(np.sum(self.robotcenters**2, axis=1)) + self.robotradii)
+
+
+class CachedCollisionBackend(CollisionBackend):
+    """CachedCollisionBackend keeps a bounded (LRU) cache of the verdicts
+       of another backend, keyed by the robot pose quantized at a given
+       resolution: the quaternion (with a non-negative first component)
+       and the translation are rounded to multiples of
+       rotationresolution and translationresolution. All poses falling
+       in the same cell share the verdict of the first one checked, so the
+       cache is only exact up to that resolution and is opt-in. The
+       environment must not change while the cache is in use (see
+       Clear).
+       Attributes:
+           backend               -- the wrapped CollisionBackend
+           maxsize               -- maximum number of cached verdicts
+           rotationresolution    -- quantization step of the quaternion
+           translationresolution -- quantization step of the translation
+           nhits, nmisses        -- cache statistics
+    """
+
+    def __init__(self, backend, maxsize=100000, rotationresolution=1e-3,
+                 translationresolution=1e-3):
+        self.backend = backend
+        self.maxsize = maxsize
+        self.rotationresolution = rotationresolution
+        self.translationresolution = translationresolution
+        self.nhits = 0
+        self.nmisses = 0
+        self._cache = collections.OrderedDict()
+
+
+    def Key(self, transformation):
+        q = Lie.quatfromrotation(transformation[:3, :3])
+        qkey = np.round(q/self.rotationresolution).astype(int)
+        tkey = np.round(transformation[:3, 3]/self.translationresolution).astype(int)
+        return tuple(qkey) + tuple(tkey)
+
+
+    def Lookup(self, key):
+        """Lookup returns the cached verdict for key, or None.
+        """
+        verdict = self._cache.pop(key, None)
+        if verdict is None:
+            self.nmisses += 1
+            return None
+        self._cache[key] = verdict # most recently used
+        self.nhits += 1
+        return verdict
+
+
+    def Store(self, key, verdict):
+        self._cache[key] = verdict
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+
+    def CheckPose(self, transformation):
+        key = self.Key(transformation)
+        verdict = self.Lookup(key)
+        if verdict is None:
+            verdict = bool(self.backend.CheckPose(transformation))
+            self.Store(key, verdict)
+        return verdict
+
+
+    def CheckPoses(self, transformations):
+        keys = [self.Key(transformation) for transformation in transformations]
+        verdicts = np.zeros(len(keys), dtype=bool)
+        uncached = []
+        for (i, key) in enumerate(keys):
+            verdict = self.Lookup(key)
+            if verdict is None:
+                uncached.append(i)
+            else:
+                verdicts[i] = verdict
+        if len(uncached) > 0:
+            verdicts[uncached] = self.backend.CheckPoses(transformations[uncached])
+            for i in uncached:
+                self.Store(keys[i], bool(verdicts[i]))
+        return verdicts
+
+
+    def FindFirstCollision(self, transformations):
+        ## the uncached samples are handed to the wrapped backend in one
+        ## call so that, e.g., a ParallelCollisionChecker stays parallel
+        keys = [self.Key(transformation) for transformation in transformations]
+        uncached = []
+        for (i, key) in enumerate(keys):
+            verdict = self.Lookup(key)
+            if verdict is None:
+                uncached.append(i)
+            elif verdict:
+                break
+        else:
+            i = -1
+        if len(uncached) == 0:
+            return i
+        j = self.backend.FindFirstCollision(transformations[uncached])
+        if j < 0:
+            for k in uncached:
+                self.Store(keys[k], False)
+            return i
+        for k in uncached[:j]:
+            self.Store(keys[k], False)
+        self.Store(keys[uncached[j]], True)
+        return uncached[j]
+
+
+    def Clear(self):
+        """Clear empties the cache, e.g. after the environment changed.
+        """
+        self._cache.clear()
+
+
+    def EnvironmentStamp(self):
+        return self.backend.EnvironmentStamp()
+
+
+    def HitRate(self):
+        nqueries = self.nhits + self.nmisses
+        if nqueries == 0:
+            return 0.0
+        return float(self.nhits)/nqueries
+
+
+    def Stats(self):
+        return {'size': len(self._cache), 'hits': self.nhits,
+                'misses': self.nmisses, 'hitrate': self.HitRate()}
+
+
+################## parallel collision checking ##################################
+## state of a worker process of ParallelCollisionChecker
+_WORKERBACKEND = None
+_FIRSTCOLLISION = None
+
+def _InitWorker(backendfactory, firstcollision):
+    global _WORKERBACKEND, _FIRSTCOLLISION
+    _WORKERBACKEND = backendfactory()
+    _FIRSTCOLLISION = firstcollision
+
+
+def _CheckChunk(args):
+    start, transformations = args
+    for (i, transformation) in enumerate(transformations):
+        if start + i >= _FIRSTCOLLISION.value:
+            ## an earlier collision has already been found
+            return -1
+        if _WORKERBACKEND.CheckPose(transformation):
+            with _FIRSTCOLLISION.get_lock():
+                if start + i < _FIRSTCOLLISION.value:
+                    _FIRSTCOLLISION.value = start + i
+            return start + i
+    return -1
+
+
+def _CheckPosesChunk(transformations):
+    return _WORKERBACKEND.CheckPoses(transformations)
+
+
+class ParallelCollisionChecker(CollisionBackend):
+    """ParallelCollisionChecker splits a sweep of transformations into
+       contiguous chunks and checks them in a pool of worker processes,
+       each owning its own backend (e.g. a cloned OpenRAVE environment)
+       built by backendfactory. Workers stop as soon as a collision is
+       known at an earlier sample, so FindFirstCollision still returns the
+       first colliding index.
+       Attributes:
+           backendfactory -- picklable callable returning a CollisionBackend
+           nworkers       -- number of worker processes
+           nchunks        -- number of chunks a sweep is split into
+    """
+
+    def __init__(self, backendfactory, nworkers=None, nchunks=None):
+        if nworkers is None:
+            nworkers = multiprocessing.cpu_count()
+        if nchunks is None:
+            nchunks = 4*nworkers
+        self.backendfactory = backendfactory
+        self.nworkers = nworkers
+        self.nchunks = nchunks
+        self._backend = None # local backend for single poses
+        self._firstcollision = multiprocessing.Value('l', 0)
+        self._pool = multiprocessing.Pool(nworkers, _InitWorker,
+                                          (backendfactory, self._firstcollision))
+
+
+    def LocalBackend(self):
+        """LocalBackend returns the backend used in this process for
+        single queries.
+        """
+        if self._backend is None:
+            self._backend = self.backendfactory()
+        return self._backend
+
+
+    def CheckPose(self, transformation):
+        return self.LocalBackend().CheckPose(transformation)
+
+
+    def CheckPoses(self, transformations):
+        n = len(transformations)
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+        bounds = np.linspace(0, n, min(self.nchunks, n) + 1).astype(int)
+        return np.concatenate(self._pool.map\
+                              (_CheckPosesChunk, [transformations[bounds[i]:bounds[i + 1]]
+                                                  for i in range(len(bounds) - 1)], 1))
+
+
+    def HasClearance(self):
+        return self.LocalBackend().HasClearance()
+
+
+    def Clearance(self, transformation):
+        return self.LocalBackend().Clearance(transformation)
+
+
+    def Clearances(self, transformations):
+        return self.LocalBackend().Clearances(transformations)
+
+
+    def EnvironmentStamp(self):
+        return self.LocalBackend().EnvironmentStamp()
+
+
+    def FindFirstCollision(self, transformations):
+        n = len(transformations)
+        if n == 0:
+            return -1
+        self._firstcollision.value = n
+        bounds = np.linspace(0, n, min(self.nchunks, n) + 1).astype(int)
+        args = [(bounds[i], transformations[bounds[i]:bounds[i + 1]])
+                for i in range(len(bounds) - 1)]
+        self._pool.map(_CheckChunk, args, 1)
+        first = self._firstcollision.value
+        if first >= n:
+            return -1
+        return first
+
+
+    def Close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+
+################## sweeps #######################################################
+def BisectionLevels(n):
+    """BisectionLevels returns the indices 0, ..., n - 1 grouped by level
+    of van der Corput (coarse-to-fine) order: both ends, then the
+    midpoint, then the midpoints of both halves, and so on. It takes O(n)
+    time, one level of midpoints at a time.
+    """
+    if n <= 2:
+        return [np.arange(n)]
+    levels = [np.array([0, n - 1])]
+    lo = np.array([0])
+    hi = np.array([n - 1])
+    while len(lo) > 0:
+        mid = (lo + hi) // 2
+        inner = (mid != lo) & (mid != hi)
+        lo, mid, hi = lo[inner], mid[inner], hi[inner]
+        if len(mid) > 0:
+            levels.append(mid)
+        ## the halves (lo, mid) and (mid, hi) of each interval, in order
+        lo = np.vstack([lo, mid]).T.ravel()
+        hi = np.vstack([mid, hi]).T.ravel()
+    return levels
+
+
+def BisectionOrder(n):
+    """BisectionOrder returns the indices 0, ..., n - 1 in the order of
+    BisectionLevels.
+    """
+    return np.concatenate(BisectionLevels(n))
+
+
+def SweepLipschitz(checkcollisiontimestep, robotradius, rtraj, transtraj=None):
+    """SweepLipschitz returns an upper bound on the displacement of any
+    point of the robot between two consecutive samples of a sweep, given
+    the radius of a ball centered at the robot's origin containing the
+    robot. It returns None if robotradius is None.
+    """
+    if robotradius is None:
+        return None
+    speed = robotradius*Lie.SpeedBound(rtraj)
+    if transtraj is not None:
+        speed += Lie.SpeedBound(transtraj)
+    return speed*checkcollisiontimestep
+
+
+def SweepIsInCollision(checker, transformations, sweepmode='dense', lipschitz=None):
+    """SweepIsInCollision returns True if the robot is IN-COLLISION at
+    any of transformations. sweepmode is either 'dense' (chronological
+    order) or 'bisection' (see CollisionBackend.FindCollisionBisection).
+    """
+    Metrics.Count('collision.sweeps')
+    Metrics.Count('collision.samples', len(transformations))
+    with Metrics.Timer('collision.sweep'):
+        if sweepmode == 'dense':
+            return checker.FindFirstCollision(transformations) >= 0
+        elif sweepmode == 'bisection':
+            return checker.FindCollisionBisection(transformations, lipschitz) >= 0
+    raise ValueError("unknown sweep mode: {0}".format(sweepmode))
+
+
+def TrajectoryTransformations(R_beg, rtraj, svect, transtraj=None):
+    """TrajectoryTransformations returns the (N,4,4) transformations
+    of the robot at every time in svect along rtraj (started at R_beg)
+    and, optionally, transtraj.
+    """
+    transformations = np.zeros((len(svect), 4, 4))
+    transformations[:, 3, 3] = 1
+    if len(svect) == 0:
+        return transformations
+    with Metrics.Timer('collision.transformations'):
+        transformations[:, :3, :3] = Lie.EvalRotationBatch(R_beg, rtraj, svect)
+        if transtraj is not None:
+            transformations[:, :3, 3] = Lie.EvalTrajBatch(transtraj, svect)[0]
+    return transformations
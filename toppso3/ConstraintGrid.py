@@ -0,0 +1,280 @@
+"""Cached TOPP constraint grids.
+
+TOPP takes the constraints a*sdd + b*sd^2 + c <= 0 sampled on the
+uniform grid k*discrtimestep of the whole trajectory. The rows of a, b
+and c at the grid points falling in a chunk only depend on the chunk's
+polynomials, on where the grid falls in the chunk (its phase) and on the
+limits, so a ConstraintGrid computes them chunk by chunk and keeps them
+in an LRU cache. Recomputing the constraints of a trajectory of which
+only some chunks changed (e.g. the final TOPP pass after shortcutting,
+whose chunks before the first shortcut are those of the first pass)
+then only evaluates the new chunks.
+
+Since TOPP's grid is uniform, it cannot be given samples that are dense
+only where the constraints bend; ChooseDiscrTimeStep rather picks the
+coarsest uniform step within a tolerance of the constraints.
+"""
+
+import collections
+import numpy as np
+
+import lie as Lie
+import PolyTraj
+
+
+class ConstraintGrid():
+    """ConstraintGrid computes the constraints of lie.ComputeSO3Constraints
+       (3-dof trajectories) or Utils.ComputeSE3Constraints (6-dof
+       trajectories, translation first) and caches their rows per chunk.
+       Attributes:
+           discrtimestep -- TOPP's discretization time step
+           taumax        -- torque limits
+           inertia       -- inertia matrix (None for identity)
+           fmax          -- force limits (SE(3) trajectories only)
+           mass          -- mass (None for 1, SE(3) trajectories only)
+           maxsize       -- maximum number of cached chunks
+           rows          -- OrderedDict, key -> (a rows, b rows), in LRU order
+           nhits         -- number of chunks whose rows were found in the cache
+           nmisses       -- number of chunks whose rows were computed
+    """
+
+    def __init__(self, discrtimestep, taumax, inertia=None, fmax=None, mass=None,
+                 maxsize=10000):
+        self.discrtimestep = discrtimestep
+        self.taumax = np.asarray(taumax, dtype=float)
+        self.inertia = inertia
+        self.fmax = fmax
+        self.mass = mass
+        self.maxsize = maxsize
+        self.rows = collections.OrderedDict()
+        ## coefficient key -> keys of the cached rows of that chunk (one
+        ## per phase of the grid in the chunk)
+        self.chunkkeys = {}
+        self.nhits = 0
+        self.nmisses = 0
+
+
+    def LimitsKey(self):
+        """LimitsKey returns the part of the cache keys that depends on the
+        limits, so that changing them does not reuse stale rows.
+        """
+        inertia = None if self.inertia is None else np.asarray(self.inertia, dtype=float)
+        fmax = None if self.fmax is None else np.asarray(self.fmax, dtype=float)
+        return repr((self.discrtimestep, self.taumax.tolist(),
+                     None if inertia is None else inertia.tolist(),
+                     None if fmax is None else fmax.tolist(), self.mass))
+
+
+    def Compute(self, traj):
+        """Compute returns a, b and c for traj (a TOPP trajectory or a
+        PolyTraj), the same as lie.ComputeSO3Constraints or
+        Utils.ComputeSE3Constraints.
+        """
+        traj = AsPolyTraj(traj)
+        ndiscrsteps = int((traj.duration + 1e-10) / self.discrtimestep) + 1
+        tvect = np.arange(ndiscrsteps) * self.discrtimestep
+        indices, remainders = ChunkIndices(traj, tvect)
+        limitskey = self.LimitsKey()
+
+        ncols = 2*traj.dimension
+        a = np.zeros((ndiscrsteps, ncols))
+        b = np.zeros((ndiscrsteps, ncols))
+        bounds = np.searchsorted(indices, np.arange(traj.nchunks + 1))
+        missing = []
+        for i in range(traj.nchunks):
+            i0, i1 = bounds[i], bounds[i + 1]
+            if i1 == i0:
+                continue
+            coeffkey = CoefficientsKey(traj.coefficients[i])
+            key = (coeffkey, i1 - i0, round(remainders[i0], 12), limitskey)
+            if key in self.rows:
+                self.nhits += 1
+                arows, brows = self.rows.pop(key)
+                self.rows[key] = (arows, brows)
+                a[i0:i1] = arows
+                b[i0:i1] = brows
+            else:
+                self.nmisses += 1
+                missing.append((i0, i1, coeffkey, key))
+
+        if len(missing) > 0:
+            ## the missing chunks are evaluated in one batch
+            points = np.concatenate([np.arange(i0, i1) for (i0, i1, coeffkey, key) in missing])
+            coeffs = traj.coefficients[indices[points]]
+            q = PolyTraj.EvalCoefficients(coeffs, remainders[points], 0)
+            qd = PolyTraj.EvalCoefficients(coeffs, remainders[points], 1)
+            qdd = PolyTraj.EvalCoefficients(coeffs, remainders[points], 2)
+            a[points], b[points] = self.Rows(q, qd, qdd)
+            for (i0, i1, coeffkey, key) in missing:
+                self.Store(key, coeffkey, a[i0:i1].copy(), b[i0:i1].copy())
+
+        c = np.zeros((ndiscrsteps, ncols))
+        c[:] = -self.Limits(traj.dimension)
+        return a, b, c
+
+
+    def EvalRows(self, traj, tvect):
+        """EvalRows returns a, b and c at the times tvect (not necessarily
+        uniform), without caching.
+        """
+        traj = AsPolyTraj(traj)
+        indices, remainders = ChunkIndices(traj, tvect)
+        coeffs = traj.coefficients[indices]
+        a, b = self.Rows(PolyTraj.EvalCoefficients(coeffs, remainders, 0),
+                         PolyTraj.EvalCoefficients(coeffs, remainders, 1),
+                         PolyTraj.EvalCoefficients(coeffs, remainders, 2))
+        c = np.zeros(a.shape)
+        c[:] = -self.Limits(traj.dimension)
+        return a, b, c
+
+
+    def Rows(self, q, qd, qdd):
+        """Rows returns the rows of a and b at the samples q, qd and qdd of
+        shape (N,3) (rotation) or (N,6) (translation then rotation).
+        """
+        dimension = q.shape[1]
+        a = np.zeros((len(q), 2*dimension))
+        b = np.zeros((len(q), 2*dimension))
+        at, bt = Lie.SO3ConstraintTerms(q[:, -3:], qd[:, -3:], qdd[:, -3:], self.inertia)
+        a[:, dimension - 3:dimension] = at
+        a[:, -3:] = -at
+        b[:, dimension - 3:dimension] = bt
+        b[:, -3:] = -bt
+        if dimension == 6:
+            m = 1 if self.mass is None else self.mass
+            a[:, :3] = m*qd[:, :3]
+            a[:, 6:9] = -m*qd[:, :3]
+            b[:, :3] = m*qdd[:, :3]
+            b[:, 6:9] = -m*qdd[:, :3]
+        return a, b
+
+
+    ##################### discretization step ######################
+    def ReferenceRows(self, traj, mindt):
+        """ReferenceRows returns the reference times (the uniform grid of
+        step mindt plus the chunk breakpoints, at which the rows jump) and
+        the rows of a and b there, scaled by the limits.
+        """
+        traj = AsPolyTraj(traj)
+        ndiscrsteps = int((traj.duration + 1e-10) / mindt) + 1
+        tvect = np.union1d(np.arange(ndiscrsteps) * mindt, traj.breakpoints)
+        tvect = tvect[tvect <= traj.duration]
+        a, b, c = self.EvalRows(traj, tvect)
+        scale = -c[0]
+        return tvect, np.hstack([a/scale, b/scale])
+
+
+    def ChooseDiscrTimeStep(self, traj, tolerance, mindt=1e-3, maxdt=0.1):
+        """ChooseDiscrTimeStep returns the largest uniform step (for TOPP's
+        discrtimestep, between mindt and maxdt) such that the linear
+        interpolation of the rows of a and b between the grid points is
+        within tolerance of them. It uses the bound h^2/8*max|f''| on the
+        interpolation error of f, with f'' estimated by finite differences
+        on the grid of step mindt; the jumps at the chunk breakpoints,
+        where no grid resolves the rows, are left out.
+        """
+        traj = AsPolyTraj(traj)
+        tvect, rows = self.ReferenceRows(traj, mindt)
+        dt = np.diff(tvect)
+        slopes = np.diff(rows, axis=0)/dt[:, None]
+        curvatures = 2*np.abs(np.diff(slopes, axis=0))/(dt[1:] + dt[:-1])[:, None]
+        ## second differences whose stencil contains a breakpoint
+        inner = np.ones(len(curvatures), dtype=bool)
+        for t in traj.breakpoints[1:-1]:
+            k = np.searchsorted(tvect, t)
+            inner[max(k - 2, 0):k + 1] = False
+        if not np.any(inner):
+            return maxdt
+        maxcurvature = curvatures[inner].max()
+        if maxcurvature == 0:
+            return maxdt
+        return min(max(np.sqrt(8*tolerance/maxcurvature), mindt), maxdt)
+
+
+    def Limits(self, dimension):
+        if dimension == 3:
+            return np.hstack([self.taumax, self.taumax])
+        return np.hstack([self.fmax, self.taumax, self.fmax, self.taumax])
+
+
+    def Store(self, key, coeffkey, arows, brows):
+        self.rows[key] = (arows, brows)
+        self.chunkkeys.setdefault(coeffkey, set()).add(key)
+        while len(self.rows) > self.maxsize:
+            (oldkey, value) = self.rows.popitem(last=False)
+            self.DiscardKey(oldkey)
+
+
+    def DiscardKey(self, key):
+        keys = self.chunkkeys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if len(keys) == 0:
+                del self.chunkkeys[key[0]]
+
+
+    def EvictChunks(self, coefficients):
+        """EvictChunks drops the rows of the chunks whose polynomials are
+        coefficients, an array of shape (nchunks, ndof, degree + 1).
+        """
+        for chunk in coefficients:
+            for key in self.chunkkeys.pop(CoefficientsKey(chunk), set()):
+                self.rows.pop(key, None)
+
+
+    def EvictInterval(self, traj, t0, t1):
+        """EvictInterval drops the rows of the chunks of traj (a TOPP
+        trajectory, a PolyTraj, a LieTraj or a LieRope) overlapping (t0,
+        t1), i.e. the chunks that a shortcut between t0 and t1 replaces.
+        """
+        if hasattr(traj, 'ChunkCoefficients'):
+            ## LieRope
+            self.EvictChunks(traj.ChunkCoefficients(t0, t1))
+            return
+        if hasattr(traj, 'trajlist'):
+            traj = PolyTraj.PolyTraj.Concatenate([PolyTraj.PolyTraj.FromTOPP(t)
+                                                  for t in traj.trajlist])
+        elif not isinstance(traj, PolyTraj.PolyTraj):
+            traj = PolyTraj.PolyTraj.FromTOPP(traj)
+        i0 = max(np.searchsorted(traj.breakpoints, t0, 'right') - 1, 0)
+        i1 = np.searchsorted(traj.breakpoints, t1, 'left')
+        self.EvictChunks(traj.coefficients[i0:i1])
+
+
+    def Clear(self):
+        self.rows.clear()
+        self.chunkkeys.clear()
+
+
+    def HitRate(self):
+        nlookups = self.nhits + self.nmisses
+        if nlookups == 0:
+            return 0.0
+        return float(self.nhits)/nlookups
+
+
+def AsPolyTraj(traj):
+    if isinstance(traj, PolyTraj.PolyTraj):
+        return traj
+    return PolyTraj.PolyTraj.FromTOPP(traj)
+
+
+def ChunkIndices(traj, tvect):
+    """ChunkIndices returns the chunk indices and remainders of tvect in
+    traj, with the same chunk assignment as lie.EvalTrajBatch.
+    """
+    svect = np.where(tvect == 0, 1e-10, tvect)
+    starts = traj.breakpoints[:-1]
+    indices = np.clip(np.searchsorted(starts, svect, 'left') - 1, 0, len(starts) - 1)
+    return indices, svect - starts[indices]
+
+
+def CoefficientsKey(chunkcoefficients):
+    """CoefficientsKey returns a hashable key of the polynomials of one
+    chunk that ignores zero-padding to a higher degree.
+    """
+    chunkcoefficients = np.asarray(chunkcoefficients, dtype=float)
+    nonzero = np.nonzero(np.any(chunkcoefficients != 0, axis=0))[0]
+    ncoeffs = nonzero[-1] + 1 if len(nonzero) > 0 else 1
+    return (chunkcoefficients.shape[0],
+            np.ascontiguousarray(chunkcoefficients[:, :ncoeffs]).tostring())
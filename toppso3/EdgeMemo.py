@@ -0,0 +1,123 @@
+"""Memo of the outcomes of the connections swept by the RRT planners.
+
+Connect joins a vertex of one tree to a vertex of the other one; the
+outcome of the sweep of such an edge only depends on its two vertices,
+the boundary velocities and the interpolation duration, as long as the
+environment does not change. Connect always starts from the newest
+vertex, so its candidate edges are new; in lazy mode, however, the
+connection is only swept by ValidatePath, and the same connection can be
+validated again (e.g. SE3RRT.Run first tries to connect the two trees as
+they are, at every call). ValidatePath looks the connection up before
+sweeping it and stores the outcome.
+"""
+
+import collections
+
+import numpy as np
+
+
+class EdgeMemo():
+    """EdgeMemo keeps a bounded (LRU) memo of edge outcomes. Vertices are
+       compared by identity (the memo holds references to them, so that
+       an edge is only found again between the very same vertices). The
+       memo is emptied when the stamp passed to Validate changes (see
+       Collision.CollisionBackend.EnvironmentStamp), and the outcomes of the
+       edges of vertices removed from their tree are dropped by
+       DiscardVertices.
+       Attributes:
+           maxsize        -- maximum number of remembered outcomes
+           stamp          -- environment stamp the outcomes hold for
+           vertexkeys     -- vertex -> keys of the stored edges it ends
+           nhits, nmisses -- lookup statistics
+           nclears        -- number of times the environment changed
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.stamp = None
+        self.nhits = 0
+        self.nmisses = 0
+        self.nclears = 0
+        self.vertexkeys = {}
+        self._memo = collections.OrderedDict()
+
+
+    def __len__(self):
+        return len(self._memo)
+
+
+    def Key(self, vstart, vend, velocities, duration):
+        """Key returns the key of the edge from vstart to vend, velocities
+        being the boundary velocities used to interpolate it.
+        """
+        return (vstart, vend, tuple(np.hstack(velocities)), duration)
+
+
+    def Lookup(self, key):
+        """Lookup returns the outcome stored for key, or None.
+        """
+        outcome = self._memo.pop(key, None)
+        if outcome is None:
+            self.nmisses += 1
+            return None
+        self._memo[key] = outcome # most recently used
+        self.nhits += 1
+        return outcome
+
+
+    def Store(self, key, outcome):
+        self._memo[key] = outcome
+        for vertex in key[:2]:
+            self.vertexkeys.setdefault(vertex, set()).add(key)
+        if len(self._memo) > self.maxsize:
+            (oldkey, oldoutcome) = self._memo.popitem(last=False)
+            self.DiscardKey(oldkey)
+
+
+    def DiscardKey(self, key):
+        for vertex in key[:2]:
+            keys = self.vertexkeys.get(vertex)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.vertexkeys[vertex]
+
+
+    def DiscardVertices(self, vertices):
+        """DiscardVertices drops the outcomes of the edges ending at any of
+        vertices (e.g. removed by Tree.RemoveSubtree), so that the memo no
+        longer holds on to them.
+        """
+        for vertex in vertices:
+            for key in list(self.vertexkeys.get(vertex, ())):
+                self._memo.pop(key, None)
+                self.DiscardKey(key)
+
+
+    def Validate(self, stamp):
+        """Validate empties the memo if stamp differs from the stamp of
+        the environment the outcomes were found in.
+        """
+        if stamp != self.stamp:
+            if len(self._memo) > 0:
+                self.nclears += 1
+            self.Clear()
+            self.stamp = stamp
+
+
+    def Clear(self):
+        self._memo.clear()
+        self.vertexkeys.clear()
+
+
+    def HitRate(self):
+        nqueries = self.nhits + self.nmisses
+        if nqueries == 0:
+            return 0.0
+        return float(self.nhits)/nqueries
+
+
+    def Stats(self):
+        return {'size': len(self._memo), 'hits': self.nhits,
+                'misses': self.nmisses, 'hitrate': self.HitRate(),
+                'clears': self.nclears}
@@ -1,29 +1,37 @@
 import numpy as np
 
 class Heap():
-    """Heap is a class of binary min. heap.
+    """Heap is a class of indexed binary min. heap.
        Attributes:
-           data    -- a list of data
-           size    -- the number of data in the list
-           nlevels -- level of the heap
-           indices -- a list of indices of each member in the heap
+           data      -- a list of data (keys)
+           size      -- the number of data in the heap
+           nlevels   -- level of the heap
+           indices   -- a list of indices of each member in the heap
+           positions -- positions[i] is the position of data index i in
+                        indices (-1 once it has been extracted)
     """
-    
+
     def __init__(self, datalist):
-        self.data = datalist
-        self.size = len(datalist)
-        self.nlevels = int(np.floor(np.log2(self.size))) + 1
-        self.indices = range(self.size)
+        self.data = list(datalist)
+        self.size = len(self.data)
+        self.nlevels = self.NLevels()
+        self.indices = list(range(self.size))
+        self.positions = list(range(self.size))
         self.BuildHeap()
 
 
+    def NLevels(self):
+        if (self.size == 0):
+            return 0
+        return int(np.floor(np.log2(self.size))) + 1
+
+
     def BuildHeap(self):
         """
-        BuildHeap heapifies from the second lowest level of the heap
+        BuildHeap heapifies from the last internal node up to the root
         """
-        for i in reversed(range(self.nlevels - 1)):
-            for j in range(int(2**i)):
-                self.Heapify(int(2**i - 1 + j))
+        for i in reversed(range(self.size // 2)):
+            self.Heapify(i)
 
 
     def ExtractMin(self):
@@ -31,52 +39,89 @@ class Heap():
             self.Swap(0, self.size - 1)
             minelement = self.data[self.indices[self.size - 1]]
             index = self.indices.pop()
+            self.positions[index] = -1
             self.size -= 1
-            if(self.size == 0):
-                self.nlevels = 0
-            else:
-                self.nlevels = int(np.floor(np.log2(self.size))) + 1
+            self.nlevels = self.NLevels()
+            if(self.size > 0):
                 self.Heapify(0)
             return [index, minelement]
         else:
             print "The heap is empty."
-            
 
-    def DecreaseKey():
-        pass
+
+    def Insert(self, key):
+        """Insert adds key to the heap and returns its data index.
+        """
+        index = len(self.data)
+        self.data.append(key)
+        self.indices.append(index)
+        self.positions.append(self.size)
+        self.size += 1
+        self.nlevels = self.NLevels()
+        self.SiftUp(self.size - 1)
+        return index
+
+
+    def DecreaseKey(self, index, key):
+        """DecreaseKey lowers the key of data index to key. The index must
+        still be in the heap and key must not be greater than its current
+        key.
+        """
+        i = self.positions[index]
+        assert(i >= 0)
+        assert(key <= self.data[index])
+        self.data[index] = key
+        self.SiftUp(i)
+
+
+    def Contains(self, index):
+        return (index < len(self.positions)) and (self.positions[index] >= 0)
 
 
     def Heapify(self, i):
-        lc = self.LeftChild(i)
-        rc = self.RightChild(i)
-        smallest = i
-        if lc < self.size:
-            if self.data[self.indices[lc]] < self.data[self.indices[smallest]]:
-                smallest = lc
-        if rc < self.size:
-            if self.data[self.indices[rc]] < self.data[self.indices[smallest]]:
-                smallest = rc
-        if smallest != i:
-            self.Swap(i, smallest)            
-            self.Heapify(smallest)
-    
+        while True:
+            lc = self.LeftChild(i)
+            rc = self.RightChild(i)
+            smallest = i
+            if lc < self.size:
+                if self.data[self.indices[lc]] < self.data[self.indices[smallest]]:
+                    smallest = lc
+            if rc < self.size:
+                if self.data[self.indices[rc]] < self.data[self.indices[smallest]]:
+                    smallest = rc
+            if smallest == i:
+                return
+            self.Swap(i, smallest)
+            i = smallest
+
+
+    def SiftUp(self, i):
+        while i > 0:
+            parent = self.Parent(i)
+            if not (self.data[self.indices[i]] < self.data[self.indices[parent]]):
+                return
+            self.Swap(i, parent)
+            i = parent
+
 
     def Parent(self, i):
-        return int(i - 1)/2
+        return (i - 1) // 2
 
 
     def LeftChild(self, i):
         return int(2*i) + 1
-    
+
 
     def RightChild(self, i):
         return int(2*i) + 2
-        
+
 
     def Swap(self, i, j):
         temp = self.indices[i]
         self.indices[i] = self.indices[j]
         self.indices[j] = temp
+        self.positions[self.indices[i]] = i
+        self.positions[self.indices[j]] = j
 
 
     def PrintHeap(self):
@@ -92,3 +137,20 @@ class Heap():
                     break
             print string
             print "\n"
+
+
+def KSmallestIndices(values, k):
+    """KSmallestIndices returns the indices of the k smallest values in
+    order of increasing value. It selects the k candidates with
+    argpartition and only sorts those (ties by index).
+    """
+    values = np.asarray(values)
+    n = len(values)
+    k = min(k, n)
+    if (k <= 0):
+        return np.zeros(0, dtype=int)
+    if (k == n):
+        return np.argsort(values, kind='mergesort')
+    candidates = np.argpartition(values, k - 1)[:k]
+    order = np.lexsort((candidates, values[candidates]))
+    return candidates[order]
@@ -0,0 +1,232 @@
+"""Batched kernels of the exponential map of SO(3) and of its derivatives.
+
+All functions take arrays of rotation vectors r (and their derivatives)
+of shape (N,3) and work directly on the coefficients of the closed-form
+expressions
+
+    expmat(r) = I + a [r] + b [r]^2
+    Amat(r)   = I - b [r] + c [r]^2                (omega = Amat(r) rd)
+    Cterm     = c rd x (r x rd) + d (r.rd) r x rd + e (r.rd) r x (r x rd)
+    alpha     = Amat(r) rdd + Cterm                (= Bmat(r) rdd + C(rd, rd))
+
+with, theta = |r|,
+
+    a = sin(theta)/theta
+    b = (1 - cos(theta))/theta^2
+    c = (theta - sin(theta))/theta^3
+    d = -(2 cos(theta) + theta sin(theta) - 2)/theta^4
+    e = (3 sin(theta) - theta cos(theta) - 2 theta)/theta^5
+
+[r]^2 is never formed: [r]^2 v = r x (r x v) = r (r.v) - theta^2 v. Below
+SERIESTHRESHOLD the coefficients are evaluated from their Taylor series,
+since the closed forms cancel catastrophically at small angles and are
+undefined at theta = 0.
+"""
+
+import math
+import numpy as np
+
+## the relative error of the closed form of e grows as eps/theta^4, while
+## the series truncated to NSERIESTERMS terms are exact to rounding below
+## SERIESTHRESHOLD
+SERIESTHRESHOLD = 1.0
+NSERIESTERMS = 10
+## below this angle from pi, logvect extracts the axis from the
+## symmetric part of R (the skew part vanishes at pi)
+NEARPITHRESHOLD = 0.5
+
+## Taylor coefficients of a, ..., e in theta^2
+_SERIES = {'a': [(-1.)**k/math.factorial(2*k + 1) for k in range(NSERIESTERMS)],
+           'b': [(-1.)**k/math.factorial(2*k + 2) for k in range(NSERIESTERMS)],
+           'c': [(-1.)**k/math.factorial(2*k + 3) for k in range(NSERIESTERMS)],
+           'd': [(-1.)**k*(2*k + 2)/math.factorial(2*k + 4) for k in range(NSERIESTERMS)],
+           'e': [(-1.)**(k + 1)*(2*k + 2)/math.factorial(2*k + 5) for k in range(NSERIESTERMS)]}
+
+
+def _series(name, theta2):
+    coeffs = _SERIES[name]
+    res = coeffs[-1]
+    for k in coeffs[-2::-1]:
+        res = res*theta2 + k
+    return res
+
+
+def _closedforms(names, t, s, co):
+    t2 = t*t
+    res = []
+    for name in names:
+        if name == 'a':
+            res.append(s/t)
+        elif name == 'b':
+            res.append((1 - co)/t2)
+        elif name == 'c':
+            res.append((t - s)/(t2*t))
+        elif name == 'd':
+            res.append(-(2*co + t*s - 2)/(t2*t2))
+        else:
+            res.append((3*s - t*co - 2*t)/(t2*t2*t))
+    return res
+
+
+def coefficients(theta, names='abcde'):
+    """coefficients returns the coefficients (see the module docstring)
+    listed in names, evaluated at the angles theta (array or scalar).
+    """
+    if np.ndim(theta) == 0:
+        ## scalar path (used by the scalar functions of lie)
+        theta = float(theta)
+        if theta < SERIESTHRESHOLD:
+            return [_series(name, theta*theta) for name in names]
+        return _closedforms(names, theta, math.sin(theta), math.cos(theta))
+    theta = np.asarray(theta, dtype=float)
+    small = theta < SERIESTHRESHOLD
+    t = np.where(small, 1, theta) # avoids divisions by zero
+    closedforms = _closedforms(names, t, np.sin(t), np.cos(t))
+    theta2 = theta*theta
+    return [np.where(small, _series(name, theta2), closedform)
+            for (name, closedform) in zip(names, closedforms)]
+
+
+def _rowdot(u, v):
+    return np.einsum('ni,ni->n', u, v)
+
+
+def expmat(rs):
+    """expmat returns the (N,3,3) rotation matrices exp([r]).
+    """
+    rs = np.asarray(rs, dtype=float)
+    theta2 = _rowdot(rs, rs)
+    a, b = coefficients(np.sqrt(theta2), 'ab')
+    Rs = b[:,None,None]*rs[:,:,None]*rs[:,None,:]
+    diag = 1 - b*theta2
+    Rs[:,0,0] += diag
+    Rs[:,1,1] += diag
+    Rs[:,2,2] += diag
+    ar = a[:,None]*rs
+    Rs[:,0,1] -= ar[:,2]
+    Rs[:,0,2] += ar[:,1]
+    Rs[:,1,0] += ar[:,2]
+    Rs[:,1,2] -= ar[:,0]
+    Rs[:,2,0] -= ar[:,1]
+    Rs[:,2,1] += ar[:,0]
+    return Rs
+
+
+def logvect(Rs):
+    """logvect returns the (N,3) rotation vectors of the rotation matrices
+    Rs, with angles in [0, pi]. Near pi, the axis is extracted in closed
+    form from the symmetric part of R.
+    """
+    Rs = np.asarray(Rs, dtype=float)
+    w = np.array([Rs[:,2,1] - Rs[:,1,2], Rs[:,0,2] - Rs[:,2,0],
+                  Rs[:,1,0] - Rs[:,0,1]]).T # 2 sin(theta) n
+    sintheta = 0.5*np.sqrt(_rowdot(w, w))
+    costheta = 0.5*(Rs[:,0,0] + Rs[:,1,1] + Rs[:,2,2] - 1)
+    theta = np.arctan2(sintheta, costheta)
+
+    ## away from pi: r = theta/(2 sin(theta)) w, where theta/sin(theta)
+    ## has no cancellation but is 0/0 at theta = 0
+    small = theta < 1e-4
+    s = np.where(small, 1, sintheta)
+    l = np.where(small, 0.5 + theta*theta/12, theta/(2*s))
+    rs = l[:,None]*w
+
+    nearpi = np.nonzero(theta > np.pi - NEARPITHRESHOLD)[0]
+    if len(nearpi) > 0:
+        ## (R + R^T)/2 - cos(theta) I = (1 - cos(theta)) n n^T
+        S = 0.5*(Rs[nearpi] + np.transpose(Rs[nearpi], (0,2,1)))
+        k = 1 - costheta[nearpi]
+        diag = np.array([S[:,0,0], S[:,1,1], S[:,2,2]]).T - costheta[nearpi][:,None]
+        i = np.argmax(diag, axis=1)
+        rows = np.arange(len(nearpi))
+        ni = np.sqrt(np.maximum(diag[rows,i], 0)/k)
+        n = S[rows,i,:]/(k*ni)[:,None]
+        n[rows,i] = ni
+        ## the sign of the axis is that of the skew part (either sign is
+        ## valid at exactly pi)
+        sign = np.where(_rowdot(n, w[nearpi]) < 0, -1, 1)
+        rs[nearpi] = (sign*theta[nearpi])[:,None]*n
+    return rs
+
+
+def Amat(rs):
+    """Amat returns the (N,3,3) matrices such that omega = Amat(r) rd.
+    """
+    rs = np.asarray(rs, dtype=float)
+    theta2 = _rowdot(rs, rs)
+    b, c = coefficients(np.sqrt(theta2), 'bc')
+    As = c[:,None,None]*rs[:,:,None]*rs[:,None,:]
+    diag = 1 - c*theta2
+    As[:,0,0] += diag
+    As[:,1,1] += diag
+    As[:,2,2] += diag
+    br = b[:,None]*rs
+    As[:,0,1] += br[:,2]
+    As[:,0,2] -= br[:,1]
+    As[:,1,0] -= br[:,2]
+    As[:,1,2] += br[:,0]
+    As[:,2,0] += br[:,1]
+    As[:,2,1] -= br[:,0]
+    return As
+
+
+Bmat = Amat
+
+
+def _applyA(rs, vs, theta2, b, c):
+    ## Amat(r) v = v - b r x v + c (r (r.v) - theta^2 v)
+    return ((1 - c*theta2)[:,None]*vs - b[:,None]*np.cross(rs, vs)
+            + (c*_rowdot(rs, vs))[:,None]*rs)
+
+
+def omega(rs, rds):
+    """omega returns the (N,3) angular velocities Amat(r) rd.
+    """
+    rs = np.asarray(rs, dtype=float)
+    rds = np.asarray(rds, dtype=float)
+    theta2 = _rowdot(rs, rs)
+    b, c = coefficients(np.sqrt(theta2), 'bc')
+    return _applyA(rs, rds, theta2, b, c)
+
+
+def Cterm(rs, rds):
+    """Cterm returns the (N,3) velocity-dependent part of the angular
+    accelerations, C(r)(rd, rd).
+    """
+    rs = np.asarray(rs, dtype=float)
+    rds = np.asarray(rds, dtype=float)
+    theta2 = _rowdot(rs, rs)
+    c, d, e = coefficients(np.sqrt(theta2), 'cde')
+    return _Cterm(rs, rds, c, d, e)
+
+
+def _Cterm(rs, rds, c, d, e):
+    rcrd = np.cross(rs, rds)
+    rdrd = _rowdot(rs, rds)
+    return (c[:,None]*np.cross(rds, rcrd) + (d*rdrd)[:,None]*rcrd
+            + (e*rdrd)[:,None]*np.cross(rs, rcrd))
+
+
+def alpha(rs, rds, rdds):
+    """alpha returns the (N,3) angular accelerations
+    Bmat(r) rdd + C(r)(rd, rd).
+    """
+    rs = np.asarray(rs, dtype=float)
+    rds = np.asarray(rds, dtype=float)
+    rdds = np.asarray(rdds, dtype=float)
+    theta2 = _rowdot(rs, rs)
+    b, c, d, e = coefficients(np.sqrt(theta2), 'bcde')
+    return _applyA(rs, rdds, theta2, b, c) + _Cterm(rs, rds, c, d, e)
+
+
+def omegaalpha(rs, rds, rdds):
+    """omegaalpha returns both omega(r, rd) and alpha(r, rd, rdd), sharing
+    the evaluation of the coefficients.
+    """
+    rs = np.asarray(rs, dtype=float)
+    rds = np.asarray(rds, dtype=float)
+    rdds = np.asarray(rdds, dtype=float)
+    theta2 = _rowdot(rs, rs)
+    b, c, d, e = coefficients(np.sqrt(theta2), 'bcde')
+    return (_applyA(rs, rds, theta2, b, c),
+            _applyA(rs, rdds, theta2, b, c) + _Cterm(rs, rds, c, d, e))
@@ -0,0 +1,333 @@
+"""Persistent, balanced-tree LieTraj.
+
+A LieRope is the sequence of pieces (R, r) of a LieTraj, each being a
+rotation R and a range of chunks of a PolyTraj r, so that the rotation
+at time s in the piece is dot(R, expmat(r(s))). The pieces are kept in a
+treap ordered by time whose nodes store the total duration of their
+subtree, so that looking up a time, splitting at a time and splicing a
+new segment in are O(log n) in the number of pieces. Nodes are never
+modified: Replace and Split return new ropes sharing everything but the
+O(log n) nodes on the modified paths, the original one staying valid.
+A piece cut in the middle of a chunk is re-expanded about the cut with
+PolyTraj.TaylorShift (exact binomial coefficients).
+"""
+
+import random
+
+import numpy as np
+
+import lie as Lie
+import LieKernels
+import PolyTraj
+
+_RNG = random.Random()
+
+
+class RopePiece(object):
+    """RopePiece is the part of a LieTraj segment made of chunks i0 to
+       i1 - 1 of traj (shared with the other pieces of the segment).
+       Attributes:
+           R        -- rotation at the beginning of the segment
+           traj     -- PolyTraj in so(3)
+           i0, i1   -- range of chunks of traj
+           start    -- time of the piece's beginning in traj
+           duration -- duration of the piece
+    """
+    __slots__ = ('R', 'traj', 'i0', 'i1', 'start', 'duration')
+
+    def __init__(self, R, traj, i0=0, i1=None):
+        if i1 is None:
+            i1 = traj.nchunks
+        self.R = R
+        self.traj = traj
+        self.i0 = i0
+        self.i1 = i1
+        self.start = traj.breakpoints[i0]
+        self.duration = traj.breakpoints[i1] - self.start
+
+
+    def FindChunk(self, s):
+        """FindChunk returns the chunk index of s (a breakpoint belongs to
+        the chunk that ends there) and the remainder.
+        """
+        bp = self.traj.breakpoints
+        k = self.i0 + int(np.searchsorted(bp[self.i0 + 1:self.i1], self.start + s, 'left'))
+        return k, self.start + s - bp[k]
+
+
+    def EvalOrder(self, s, order):
+        k, remainder = self.FindChunk(s)
+        return PolyTraj.EvalCoefficients(self.traj.coefficients[k:k + 1],
+                                         [remainder], order)[0]
+
+
+    def Split(self, s):
+        """Split returns the lists of pieces before and after s, 0 < s <
+        duration.
+        """
+        k, remainder = self.FindChunk(s)
+        bp = self.traj.breakpoints
+        chunkduration = bp[k + 1] - bp[k]
+        left = []
+        right = []
+        if remainder >= chunkduration:
+            left.append(RopePiece(self.R, self.traj, self.i0, k + 1))
+            if k + 1 < self.i1:
+                right.append(RopePiece(self.R, self.traj, k + 1, self.i1))
+            return left, right
+        if k > self.i0:
+            left.append(RopePiece(self.R, self.traj, self.i0, k))
+        coeffs = self.traj.coefficients[k:k + 1]
+        left.append(RopePiece(self.R, PolyTraj.PolyTraj(coeffs, [0, remainder])))
+        right.append(RopePiece(self.R, PolyTraj.PolyTraj
+                               (PolyTraj.TaylorShift(coeffs, remainder),
+                                [0, chunkduration - remainder])))
+        if k + 1 < self.i1:
+            right.append(RopePiece(self.R, self.traj, k + 1, self.i1))
+        return left, right
+
+
+class RopeNode(object):
+    __slots__ = ('piece', 'left', 'right', 'priority', 'duration', 'count')
+
+    def __init__(self, piece, left=None, right=None, priority=None):
+        self.piece = piece
+        self.left = left
+        self.right = right
+        self.priority = _RNG.random() if priority is None else priority
+        self.duration = piece.duration + Duration(left) + Duration(right)
+        self.count = 1 + Count(left) + Count(right)
+
+
+    def With(self, left, right):
+        return RopeNode(self.piece, left, right, self.priority)
+
+
+def Duration(node):
+    return 0 if node is None else node.duration
+
+
+def Count(node):
+    return 0 if node is None else node.count
+
+
+def Merge(a, b):
+    """Merge returns the treap of the pieces of a followed by those of b.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        return a.With(a.left, Merge(a.right, b))
+    return b.With(Merge(a, b.left), b.right)
+
+
+def SplitNode(node, t):
+    """SplitNode returns the treaps of the pieces before and after time t,
+    cutting the piece containing t.
+    """
+    if node is None:
+        return None, None
+    dleft = Duration(node.left)
+    if t <= dleft:
+        a, b = SplitNode(node.left, t)
+        return a, node.With(b, node.right)
+    if t >= dleft + node.piece.duration:
+        a, b = SplitNode(node.right, t - dleft - node.piece.duration)
+        return node.With(node.left, a), b
+    leftpieces, rightpieces = node.piece.Split(t - dleft)
+    a = node.left
+    for piece in leftpieces:
+        a = Merge(a, RopeNode(piece))
+    b = node.right
+    for piece in reversed(rightpieces):
+        b = Merge(RopeNode(piece), b)
+    return a, b
+
+
+class LieRope():
+    """LieRope is a persistent LieTraj (see the module docstring) with the
+       evaluation functions of LieTraj.
+       Attributes:
+           root     -- root RopeNode (None if empty)
+           duration -- total duration
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self.duration = Duration(root)
+
+
+    @staticmethod
+    def FromLieTraj(lietraj):
+        root = None
+        for (R, traj) in zip(lietraj.Rlist, lietraj.trajlist):
+            root = Merge(root, RopeNode(RopePiece(R, PolyTraj.PolyTraj.FromTOPP(traj))))
+        return LieRope(root)
+
+
+    def __len__(self):
+        return Count(self.root)
+
+
+    def Pieces(self):
+        """Pieces returns the pieces in time order.
+        """
+        pieces = []
+        stack = []
+        node = self.root
+        while (node is not None) or (len(stack) > 0):
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            pieces.append(node.piece)
+            node = node.right
+        return pieces
+
+
+    def ToLieTraj(self):
+        """ToLieTraj returns the LieTraj of TOPP trajectories of the rope,
+        joining back the consecutive pieces of a same segment.
+        """
+        Rlist = []
+        trajlist = []
+        groups = []
+        for piece in self.Pieces():
+            if (len(groups) > 0) and (groups[-1][-1].traj is piece.traj) and \
+               (groups[-1][-1].i1 == piece.i0):
+                groups[-1].append(piece)
+            else:
+                groups.append([piece])
+        for group in groups:
+            Rlist.append(group[0].R)
+            trajlist.append(group[0].traj.Slice(group[0].i0, group[-1].i1).ToTOPP())
+        return Lie.LieTraj(Rlist, trajlist)
+
+
+    ############################## edition ##############################
+    def Split(self, t):
+        """Split returns the ropes before and after time t.
+        """
+        a, b = SplitNode(self.root, t)
+        return LieRope(a), LieRope(b)
+
+
+    def Replace(self, t0, t1, R, traj):
+        """Replace returns the rope whose segment (t0, t1) is replaced by the
+        segment (R, traj), traj being a PolyTraj or a TOPP trajectory (see
+        Utils.ReplaceTrajectorySegment).
+        """
+        assert(t1 > t0)
+        if not isinstance(traj, PolyTraj.PolyTraj):
+            traj = PolyTraj.PolyTraj.FromTOPP(traj)
+        a, rest = SplitNode(self.root, t0)
+        middle, b = SplitNode(rest, t1 - t0)
+        return LieRope(Merge(Merge(a, RopeNode(RopePiece(R, traj))), b))
+
+
+    def ChunkCoefficients(self, t0, t1):
+        """ChunkCoefficients returns the coefficients of the chunks
+        overlapping (t0, t1) (see ConstraintGrid.EvictInterval).
+        """
+        middle = LieRope(SplitNode(SplitNode(self.root, t0)[1], t1 - t0)[0])
+        coefficients = [piece.traj.coefficients[piece.i0:piece.i1]
+                        for piece in middle.Pieces()]
+        ## the cut chunks, as they were before the cut
+        for t in [t0, t1]:
+            piece, s = self.FindPiece(t)
+            k, remainder = piece.FindChunk(s)
+            coefficients.append(piece.traj.coefficients[k:k + 1])
+        return np.concatenate(coefficients)
+
+
+    ############################## evaluation ##############################
+    def FindPiece(self, s):
+        """FindPiece returns the piece containing time s and the time in the
+        piece. As in LieTraj, a time at the end of a piece belongs to it.
+        """
+        node = self.root
+        while True:
+            dleft = Duration(node.left)
+            if (s <= dleft) and (node.left is not None):
+                node = node.left
+            elif (s > dleft + node.piece.duration) and (node.right is not None):
+                s -= dleft + node.piece.duration
+                node = node.right
+            else:
+                return node.piece, min(max(s - dleft, 0), node.piece.duration)
+
+
+    def Eval(self, s):
+        """Eval returns R, r, rd and rdd at time s.
+        """
+        piece, s = self.FindPiece(s)
+        return (piece.R, piece.EvalOrder(s, 0), piece.EvalOrder(s, 1),
+                piece.EvalOrder(s, 2))
+
+
+    def EvalRotation(self, s):
+        piece, s = self.FindPiece(s)
+        return np.dot(piece.R, Lie.expmat(piece.EvalOrder(s, 0)))
+
+
+    def EvalOmega(self, s):
+        piece, s = self.FindPiece(s)
+        return Lie.omega(piece.EvalOrder(s, 0), piece.EvalOrder(s, 1))
+
+
+    def EvalAlpha(self, s):
+        R, r, rd, rdd = self.Eval(s)
+        return Lie.alpha(r, rd, rdd)
+
+
+    def EvalTorques(self, s, I):
+        R, r, rd, rdd = self.Eval(s)
+        return Lie.tau(r, rd, rdd, I)
+
+
+    def EvalBatch(self, svect):
+        """EvalBatch returns the rotations R of the pieces and r, rd, rdd,
+        evaluated at every time in svect (a single traversal of the rope).
+        """
+        svect = np.asarray(svect, dtype=float)
+        pieces = self.Pieces()
+        starts = np.cumsum([0] + [piece.duration for piece in pieces[:-1]])
+        indices = np.clip(np.searchsorted(starts, svect, 'left') - 1, 0, len(pieces) - 1)
+        Rs = np.zeros((len(svect), 3, 3))
+        q = [np.zeros((len(svect), 3)) for order in range(3)]
+        for i in np.unique(indices):
+            mask = (indices == i)
+            piece = pieces[i]
+            local = np.clip(svect[mask] - starts[i], 0, piece.duration)
+            ks = piece.i0 + np.searchsorted(piece.traj.breakpoints[piece.i0 + 1:piece.i1],
+                                            piece.start + local, 'left')
+            remainders = piece.start + local - piece.traj.breakpoints[ks]
+            for order in range(3):
+                q[order][mask] = PolyTraj.EvalCoefficients(piece.traj.coefficients[ks],
+                                                           remainders, order)
+            Rs[mask] = piece.R
+        return Rs, q[0], q[1], q[2]
+
+
+    def EvalRotationBatch(self, svect):
+        Rs, r, rd, rdd = self.EvalBatch(svect)
+        return np.einsum('nij,njk->nik', Rs, LieKernels.expmat(r))
+
+
+    def EvalOmegaBatch(self, svect):
+        Rs, r, rd, rdd = self.EvalBatch(svect)
+        return LieKernels.omega(r, rd)
+
+
+    def EvalAlphaBatch(self, svect):
+        Rs, r, rd, rdd = self.EvalBatch(svect)
+        return LieKernels.alpha(r, rd, rdd)
+
+
+    def EvalTorquesBatch(self, svect, I):
+        Rs, r, rd, rdd = self.EvalBatch(svect)
+        omegas, alphas = LieKernels.omegaalpha(r, rd, rdd)
+        Iomegas = np.dot(omegas, np.transpose(I))
+        return np.dot(alphas, np.transpose(I)) + np.cross(omegas, Iomegas)
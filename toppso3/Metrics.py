@@ -0,0 +1,328 @@
+"""Timing and counting of the phases of planning and shortcutting.
+
+The phases of RRTPlanner (nearest neighbors, interpolation), of the
+collision sweeps and of the shortcutters (TOPP setup and solve, segment
+replacement) are wrapped in Metrics.Timer and counted with
+Metrics.Count. Recording is disabled by default, in which case Timer
+returns a shared no-op context manager and Count returns at once, so
+that the instrumentation costs a function call per phase.
+
+    import Metrics
+    Metrics.Enable(trace=True)
+    planner.Run(60)
+    Metrics.Report()                         # summary through the sinks
+    Metrics.SaveJSON('metrics.json')
+    Metrics.SaveChromeTrace('trace.json')    # chrome://tracing, Perfetto
+
+Messages of the planners and shortcutters go through Metrics.Log to the
+sinks (a ConsoleSink at level INFO by default, per-iteration messages
+being DEBUG), whether recording is enabled or not. Recording is
+per-process: the workers of Utils.ParallelShortcut and of
+Collision.ParallelCollisionChecker are not recorded.
+"""
+
+import json
+import math
+import os
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+
+## ANSI color codes (see Colorize)
+colors = dict()
+colors['black'] = 0
+colors['red'] = 1
+colors['green'] = 2
+colors['yellow'] = 3
+colors['blue'] = 4
+colors['magenta'] = 5
+colors['cyan'] = 6
+colors['white'] = 7
+def Colorize(string, color = 'white', bold = True):
+    newstring = '\033['
+    newstring += (str(int(bold)) + ';')
+    newstring += ('3' + str(colors[color]))
+    newstring += 'm'
+    newstring += string
+    newstring += '\033[0m' # reset the subsequent text back to normal
+    return newstring
+
+
+class Histogram():
+    """Histogram accumulates durations (or any positive values) in
+       buckets growing geometrically by a factor 2 from MINVALUE.
+       Attributes:
+           count, total, minimum, maximum
+           buckets -- number of values in [MINVALUE*2^(k-1), MINVALUE*2^k)
+                      (bucket 0 holds the values below MINVALUE)
+    """
+    MINVALUE = 1e-6
+    NBUCKETS = 40
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float('inf')
+        self.maximum = 0.0
+        self.buckets = [0]*self.NBUCKETS
+
+
+    def Add(self, value):
+        self.count += 1
+        self.total += value
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        if value < self.MINVALUE:
+            k = 0
+        else:
+            k = min(int(math.log(value/self.MINVALUE, 2)) + 1, self.NBUCKETS - 1)
+        self.buckets[k] += 1
+
+
+    def Mean(self):
+        return self.total/self.count if self.count > 0 else 0.0
+
+
+    def Quantile(self, p):
+        """Quantile returns an upper bound on the p-quantile, 0 <= p <= 1,
+        within a factor 2 (the upper end of its bucket).
+        """
+        if self.count == 0:
+            return 0.0
+        rank = p*self.count
+        cumulated = 0
+        for (k, n) in enumerate(self.buckets):
+            cumulated += n
+            if (n > 0) and (cumulated >= rank):
+                return min(self.MINVALUE*2**k, self.maximum)
+        return self.maximum
+
+
+    def ToDict(self):
+        return {'count': self.count, 'total': self.total,
+                'min': self.minimum if self.count > 0 else 0.0,
+                'max': self.maximum, 'mean': self.Mean(),
+                'p50': self.Quantile(0.5), 'p95': self.Quantile(0.95),
+                'buckets': list(self.buckets)}
+
+
+class _NullTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, value, traceback):
+        return False
+
+
+_NULLTIMER = _NullTimer()
+
+
+class _Timer(object):
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exctype, value, traceback):
+        self.recorder.AddTime(self.name, self.start, time.time() - self.start)
+        return False
+
+
+class ConsoleSink():
+    """ConsoleSink prints the messages of level at least level and the
+       reports.
+    """
+
+    def __init__(self, level=INFO, colored=True):
+        self.level = level
+        self.colored = colored
+
+
+    def Log(self, message, color, level):
+        if level < self.level:
+            return
+        if self.colored and (color is not None):
+            message = Colorize(message, color)
+        print message
+
+
+    def Report(self, summary):
+        lines = ['{0:<28s} {1:>8s} {2:>10s} {3:>10s} {4:>10s} {5:>10s}'.format\
+                 ('timer', 'count', 'total (s)', 'mean (ms)', 'p95 (ms)', 'max (ms)')]
+        for name in sorted(summary['timers']):
+            h = summary['timers'][name]
+            lines.append('{0:<28s} {1:>8d} {2:>10.4f} {3:>10.4f} {4:>10.4f} {5:>10.4f}'.format\
+                         (name, h['count'], h['total'], 1e3*h['mean'], 1e3*h['p95'],
+                          1e3*h['max']))
+        for name in sorted(summary['counters']):
+            lines.append('{0:<28s} {1:>8d}'.format(name, summary['counters'][name]))
+        self.Log('\n'.join(lines), None, WARNING)
+
+
+class Recorder():
+    """Recorder holds the timers and counters of a process.
+       Attributes:
+           enabled    -- whether Timer and Count record anything
+           trace      -- whether every timed phase is kept for
+                         ChromeTraceEvents
+           timers     -- dictionary of Histograms of durations (s)
+           counters   -- dictionary of counts
+           events     -- list of (name, start, duration) if trace
+           sinks      -- objects with Log(message, color, level) and
+                         Report(summary) (e.g. ConsoleSink)
+    """
+
+    def __init__(self, sinks=None):
+        self.enabled = False
+        self.trace = False
+        self.sinks = [ConsoleSink()] if sinks is None else sinks
+        self.Reset()
+
+
+    def Reset(self):
+        self.timers = dict()
+        self.counters = dict()
+        self.events = []
+        self.start = time.time()
+
+
+    def Timer(self, name):
+        if not self.enabled:
+            return _NULLTIMER
+        return _Timer(self, name)
+
+
+    def AddTime(self, name, start, duration):
+        histogram = self.timers.get(name)
+        if histogram is None:
+            histogram = self.timers[name] = Histogram()
+        histogram.Add(duration)
+        if self.trace:
+            self.events.append((name, start, duration))
+
+
+    def Count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def Log(self, message, color='white', level=INFO):
+        for sink in self.sinks:
+            sink.Log(message, color, level)
+
+
+    def Summary(self):
+        return {'duration': time.time() - self.start,
+                'timers': dict([(name, histogram.ToDict())
+                                for (name, histogram) in self.timers.iteritems()]),
+                'counters': dict(self.counters)}
+
+
+    def Report(self):
+        summary = self.Summary()
+        for sink in self.sinks:
+            sink.Report(summary)
+        return summary
+
+
+    def ChromeTraceEvents(self):
+        """ChromeTraceEvents returns the recorded phases as complete
+        events ('ph': 'X', times in microseconds) of the Trace Event
+        Format, followed by the final values of the counters.
+        """
+        pid = os.getpid()
+        events = [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': pid,
+                   'tid': 0, 'ts': 1e6*(start - self.start), 'dur': 1e6*duration}
+                  for (name, start, duration) in self.events]
+        now = 1e6*(time.time() - self.start)
+        for (name, value) in self.counters.iteritems():
+            events.append({'name': name, 'ph': 'C', 'pid': pid, 'tid': 0, 'ts': now,
+                           'args': {'value': value}})
+        return events
+
+
+    def SaveJSON(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.Summary(), f, indent=1, sort_keys=True)
+
+
+    def SaveChromeTrace(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': self.ChromeTraceEvents(),
+                       'displayTimeUnit': 'ms'}, f)
+
+
+############################## module interface ##############################
+RECORDER = Recorder()
+
+def Enable(trace=False, reset=True):
+    """Enable starts recording, keeping every timed phase for the Chrome
+    trace if trace is True (which costs memory on long runs).
+    """
+    if reset:
+        RECORDER.Reset()
+    RECORDER.enabled = True
+    RECORDER.trace = trace
+
+
+def Disable():
+    RECORDER.enabled = False
+
+
+def IsEnabled():
+    return RECORDER.enabled
+
+
+def Reset():
+    RECORDER.Reset()
+
+
+def Timer(name):
+    """Timer returns a context manager recording the duration of its
+    block under name.
+    """
+    if not RECORDER.enabled:
+        return _NULLTIMER
+    return _Timer(RECORDER, name)
+
+
+def Count(name, n=1):
+    if RECORDER.enabled:
+        RECORDER.counters[name] = RECORDER.counters.get(name, 0) + n
+
+
+def Log(message, color='white', level=INFO):
+    RECORDER.Log(message, color, level)
+
+
+def SetSinks(sinks):
+    RECORDER.sinks = list(sinks)
+
+
+def AddSink(sink):
+    RECORDER.sinks.append(sink)
+
+
+def Summary():
+    return RECORDER.Summary()
+
+
+def Report():
+    return RECORDER.Report()
+
+
+def SaveJSON(filename):
+    RECORDER.SaveJSON(filename)
+
+
+def SaveChromeTrace(filename):
+    RECORDER.SaveChromeTrace(filename)
@@ -0,0 +1,252 @@
+import heapq
+import numpy as np
+
+import Heap
+
+
+class KDTree():
+    """KDTree is an incremental bucket kd-tree. Points are embedded in
+       R^dim by the subclass (see SO3Index and SE3Index) so that the
+       Euclidean distance between a query and a node's bounding box gives
+       a lower bound of the true metric. Exact distances are only
+       evaluated on the candidates of the leaves that are visited.
+       Attributes:
+           dim      -- dimension of the embedding
+           leafsize -- maximum number of points in a leaf before it is split
+           bruteforcesize -- below this many points, queries scan all points
+           points   -- embedded points (only the first size rows are valid)
+           size     -- number of points stored
+    """
+
+    def __init__(self, dim, leafsize=64):
+        self.dim = dim
+        self.leafsize = leafsize
+        self.bruteforcesize = 1024
+        self.points = np.zeros((64, dim))
+        self.size = 0
+        ## one entry per node
+        self.splitdims = []
+        self.splitvals = []
+        self.children = [] # (left, right) for inner nodes, None for leaves
+        self.buckets = []  # list of point indices for leaves, None for inner nodes
+        self.lo = []       # bounding box of the points below the node
+        self.hi = []
+        self.NewNode([])
+
+
+    def __len__(self):
+        return self.size
+
+
+    def NewNode(self, bucket):
+        self.splitdims.append(-1)
+        self.splitvals.append(0.0)
+        self.children.append(None)
+        self.buckets.append(bucket)
+        if len(bucket) > 0:
+            pts = self.points[bucket]
+            self.lo.append(pts.min(axis=0))
+            self.hi.append(pts.max(axis=0))
+        else:
+            self.lo.append(np.ones(self.dim)*np.inf)
+            self.hi.append(-np.ones(self.dim)*np.inf)
+        return len(self.buckets) - 1
+
+
+    def InsertPoint(self, point):
+        """InsertPoint adds an embedded point and returns its index (the
+        number of points inserted before it).
+        """
+        if self.size == len(self.points):
+            self.points = np.vstack([self.points, np.zeros(self.points.shape)])
+        index = self.size
+        self.points[index] = point
+        self.size += 1
+
+        node = 0
+        while True:
+            self.lo[node] = np.minimum(self.lo[node], point)
+            self.hi[node] = np.maximum(self.hi[node], point)
+            if self.children[node] is None:
+                break
+            if point[self.splitdims[node]] < self.splitvals[node]:
+                node = self.children[node][0]
+            else:
+                node = self.children[node][1]
+        self.buckets[node].append(index)
+        if len(self.buckets[node]) > self.leafsize:
+            self.Split(node)
+        return index
+
+
+    def Split(self, node):
+        bucket = self.buckets[node]
+        pts = self.points[bucket]
+        spread = self.hi[node] - self.lo[node]
+        d = int(np.argmax(spread))
+        if spread[d] <= 0:
+            return # all points coincide; keep a large leaf
+        vals = np.sort(pts[:, d])
+        val = vals[len(vals)//2]
+        if val <= vals[0]:
+            val = 0.5*(vals[0] + vals[-1])
+        leftbucket = [i for (i, v) in zip(bucket, pts[:, d]) if v < val]
+        rightbucket = [i for (i, v) in zip(bucket, pts[:, d]) if v >= val]
+        left = self.NewNode(leftbucket)
+        right = self.NewNode(rightbucket)
+        self.splitdims[node] = d
+        self.splitvals[node] = val
+        self.children[node] = (left, right)
+        self.buckets[node] = None
+
+
+    def BoxDistance(self, queries, node):
+        """BoxDistance returns the smallest Euclidean distance from the
+        embedded queries to the bounding box of node.
+        """
+        diff = np.maximum(np.maximum(self.lo[node] - queries, queries - self.hi[node]), 0)
+        return np.sqrt(np.min(np.sum(diff*diff, axis=1)))
+
+
+    def KNearest(self, query, k):
+        """KNearest returns the indices of the k nearest points to query
+        in order of increasing distance.
+        """
+        k = min(k, self.size)
+        if k <= 0:
+            return []
+        if (4*k >= self.size) or (self.size <= self.bruteforcesize):
+            ## a vectorized scan is cheaper than walking the tree
+            distances = self.Distances(query, np.arange(self.size))
+            return Heap.KSmallestIndices(distances, k).tolist()
+
+        queries = self.Embed(query)
+        best = [] # max-heap of (-distance, -index)
+        frontier = [(0.0, 0)]
+        while len(frontier) > 0:
+            lb, node = heapq.heappop(frontier)
+            if len(best) == k and lb > -best[0][0]:
+                break
+            if self.children[node] is None:
+                ids = self.buckets[node]
+                distances = self.Distances(query, ids)
+                for (i, dist) in zip(ids, distances):
+                    if len(best) < k:
+                        heapq.heappush(best, (-dist, -i))
+                    elif (-dist, -i) > best[0]:
+                        heapq.heapreplace(best, (-dist, -i))
+            else:
+                for child in self.children[node]:
+                    clb = self.LowerBound(self.BoxDistance(queries, child))
+                    if len(best) < k or clb <= -best[0][0]:
+                        heapq.heappush(frontier, (clb, child))
+        best.sort(reverse=True)
+        return [-i for (d, i) in best]
+
+
+    def Radius(self, query, radius):
+        """Radius returns the indices of all points within radius of query
+        in order of increasing distance.
+        """
+        if self.size == 0:
+            return []
+        queries = self.Embed(query)
+        ids = []
+        nodes = [0]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            if self.children[node] is None:
+                ids.extend(self.buckets[node])
+            else:
+                for child in self.children[node]:
+                    if self.LowerBound(self.BoxDistance(queries, child)) <= radius:
+                        nodes.append(child)
+        ids = np.sort(np.asarray(ids, dtype=int))
+        distances = self.Distances(query, ids)
+        order = np.argsort(distances, kind='mergesort')
+        return [int(ids[i]) for i in order if distances[i] <= radius]
+
+
+class SO3Index(KDTree):
+    """SO3Index indexes unit quaternions with the metric of
+       Utils.QuatDistance, 1 - |<q0, q1>|, under which q and -q are the
+       same point. Quaternions are stored with a non-negative first
+       component and queried with both q and -q; since
+       min |q0 -+ q1|^2 = 2*QuatDistance, the chordal box distance gives
+       an exact lower bound.
+    """
+
+    def __init__(self, leafsize=64):
+        KDTree.__init__(self, 4, leafsize)
+
+
+    def Insert(self, q):
+        q = np.asarray(q, dtype=float)
+        if q[0] < 0:
+            q = -q
+        return self.InsertPoint(q)
+
+
+    def Embed(self, q):
+        q = np.asarray(q, dtype=float)
+        return np.array([q, -q])
+
+
+    def LowerBound(self, boxdistance):
+        return 0.5*boxdistance*boxdistance
+
+
+    def Distances(self, q, ids):
+        return 1 - np.abs(np.dot(self.points[ids], q))
+
+
+class SE3Index(KDTree):
+    """SE3Index indexes (quaternion, translation) pairs with the metric
+       of Utils.SE3Distance, sqrt(c*theta^2 + d*|t0 - t1|^2), theta being
+       the rotation angle between the two orientations. The embedding
+       (2*sqrt(c)*q, sqrt(d)*t) is a lower bound since the quaternion
+       chord 2*sin(theta/4) never exceeds theta/2.
+       Attributes:
+           c, d         -- rotation and translation weights
+           quats        -- stored quaternions
+           translations -- stored translations
+    """
+
+    def __init__(self, c=1, d=1, leafsize=64):
+        KDTree.__init__(self, 7, leafsize)
+        self.c = c
+        self.d = d
+        self.quats = np.zeros((64, 4))
+        self.translations = np.zeros((64, 3))
+
+
+    def Insert(self, q, qt):
+        q = np.asarray(q, dtype=float)
+        if q[0] < 0:
+            q = -q
+        if self.size == len(self.quats):
+            self.quats = np.vstack([self.quats, np.zeros(self.quats.shape)])
+            self.translations = np.vstack([self.translations,
+                                           np.zeros(self.translations.shape)])
+        self.quats[self.size] = q
+        self.translations[self.size] = qt
+        return self.InsertPoint(self.Embed((q, qt))[0])
+
+
+    def Embed(self, query):
+        q, qt = query
+        q = 2*np.sqrt(self.c)*np.asarray(q, dtype=float)
+        qt = np.sqrt(self.d)*np.asarray(qt, dtype=float)
+        return np.array([np.hstack([q, qt]), np.hstack([-q, qt])])
+
+
+    def LowerBound(self, boxdistance):
+        return boxdistance
+
+
+    def Distances(self, query, ids):
+        q, qt = query
+        innerproducts = np.minimum(np.abs(np.dot(self.quats[ids], q)), 1)
+        theta = 2*np.arccos(innerproducts)
+        dt = self.translations[ids] - qt
+        return np.sqrt(self.c*theta*theta + self.d*np.sum(dt*dt, axis=1))
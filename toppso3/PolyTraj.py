@@ -0,0 +1,283 @@
+import numpy as np
+
+from TOPP import Trajectory
+
+
+class PolyTraj():
+    """PolyTraj is a piecewise-polynomial trajectory stored as one
+       contiguous coefficient array, so that it can be evaluated, sliced
+       and concatenated with NumPy instead of going through TOPP's text
+       strings. It is converted to a TOPP PiecewisePolynomialTrajectory
+       (ToTOPP) only where TOPP needs one, i.e. at the solver.
+       Attributes:
+           coefficients -- (nchunks, ndof, degree + 1) array of polynomial
+                           coefficients, weak-term-first (as TOPP)
+           breakpoints  -- (nchunks + 1) array of the cumulated chunk
+                           durations, starting at 0
+           nchunks, dimension, degree, duration
+    """
+
+    def __init__(self, coefficients, breakpoints):
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.breakpoints = np.asarray(breakpoints, dtype=float)
+        (self.nchunks, self.dimension, ncoeffs) = self.coefficients.shape
+        self.degree = ncoeffs - 1
+        self.duration = self.breakpoints[-1] - self.breakpoints[0]
+
+
+    @staticmethod
+    def FromDurations(coefficients, durations):
+        return PolyTraj(coefficients, np.append(0, np.cumsum(durations)))
+
+
+    def Durations(self):
+        return np.diff(self.breakpoints)
+
+
+    def __len__(self):
+        return self.nchunks
+
+
+    def __str__(self):
+        """__str__ returns the trajectory in TOPP's text format. Numbers are
+        written with 17 significant digits so that FromString gives back
+        the same coefficients.
+        """
+        lines = []
+        for (duration, chunk) in zip(self.Durations(), self.coefficients):
+            lines.append("%.17g\n%d"%(duration, self.dimension))
+            for poly in chunk:
+                lines.append(' '.join(["%.17g"%x for x in poly]))
+        return '\n'.join(lines)
+
+
+    ############################## evaluation ##############################
+    def FindChunkIndices(self, svect):
+        """FindChunkIndices returns the chunk indices and the remainders of
+        the times in svect. As in TOPP, a time at a breakpoint belongs to
+        the chunk that ends there.
+        """
+        svect = np.asarray(svect, dtype=float)
+        indices = np.searchsorted(self.breakpoints[1:-1], svect, 'left')
+        return indices, svect - self.breakpoints[indices]
+
+
+    def EvalOrder(self, s, order):
+        indices, remainders = self.FindChunkIndices(np.atleast_1d(s))
+        res = EvalCoefficients(self.coefficients[indices], remainders, order)
+        if np.ndim(s) == 0:
+            return res[0]
+        return res
+
+
+    def Eval(self, s):
+        """Eval returns the positions at s: an array of shape (ndof,) if s
+        is a scalar, (N, ndof) if s is an array of N times.
+        """
+        return self.EvalOrder(s, 0)
+
+
+    def Evald(self, s):
+        return self.EvalOrder(s, 1)
+
+
+    def Evaldd(self, s):
+        return self.EvalOrder(s, 2)
+
+
+    def EvalBatch(self, svect):
+        """EvalBatch returns the positions, velocities and accelerations at
+        every time in svect.
+        """
+        indices, remainders = self.FindChunkIndices(svect)
+        coeffs = self.coefficients[indices]
+        return (EvalCoefficients(coeffs, remainders, 0),
+                EvalCoefficients(coeffs, remainders, 1),
+                EvalCoefficients(coeffs, remainders, 2))
+
+
+    ############################## manipulation ##############################
+    def Slice(self, i0, i1):
+        """Slice returns the trajectory made of chunks i0 to i1 - 1. The
+        coefficient array is a view on this trajectory's.
+        """
+        return PolyTraj(self.coefficients[i0:i1],
+                        self.breakpoints[i0:i1 + 1] - self.breakpoints[i0])
+
+
+    def DofSlice(self, j0, j1):
+        """DofSlice returns the trajectory of dofs j0 to j1 - 1 (e.g. the
+        translational part of an SE(3) trajectory). The coefficient array
+        is a view on this trajectory's.
+        """
+        return PolyTraj(self.coefficients[:, j0:j1], self.breakpoints)
+
+
+    def Split(self, t):
+        """Split returns the two trajectories before and after time t. The
+        chunk containing t is cut in two; its second part is re-expanded
+        about t.
+        """
+        t = min(max(t, 0), self.duration)
+        index = int(np.searchsorted(self.breakpoints[1:-1], t, 'left'))
+        remainder = t - self.breakpoints[index]
+        chunkduration = self.breakpoints[index + 1] - self.breakpoints[index]
+
+        ## left part: chunks before index and the beginning of chunk index
+        leftcoeffs = self.coefficients[:index + 1]
+        leftbreakpoints = np.append(self.breakpoints[:index + 1], t)
+        if remainder <= 0:
+            leftcoeffs = leftcoeffs[:-1]
+            leftbreakpoints = leftbreakpoints[:-1]
+
+        ## right part: the end of chunk index and the chunks after it
+        rightcoeffs = self.coefficients[index:]
+        if remainder >= chunkduration:
+            rightcoeffs = rightcoeffs[1:]
+            rightbreakpoints = self.breakpoints[index + 1:] - t
+        else:
+            if remainder > 0:
+                rightcoeffs = rightcoeffs.copy()
+                rightcoeffs[0] = TaylorShift(rightcoeffs[0], remainder)
+            rightbreakpoints = np.append(0, self.breakpoints[index + 1:] - t)
+        return (PolyTraj(leftcoeffs, leftbreakpoints),
+                PolyTraj(rightcoeffs, rightbreakpoints))
+
+
+    @staticmethod
+    def Concatenate(trajlist):
+        """Concatenate returns the trajectory following every trajectory of
+        trajlist in turn. Coefficients are zero-padded to the highest
+        degree.
+        """
+        trajlist = [traj for traj in trajlist if traj.nchunks > 0]
+        degree = max([traj.degree for traj in trajlist])
+        coefficients = np.concatenate([PadCoefficients(traj.coefficients, degree)
+                                       for traj in trajlist])
+        durations = np.concatenate([traj.Durations() for traj in trajlist])
+        return PolyTraj.FromDurations(coefficients, durations)
+
+
+    @staticmethod
+    def Stack(trajlist):
+        """Stack returns the trajectory whose dofs are those of every
+        trajectory of trajlist, which must share the same breakpoints (e.g.
+        translation and rotation of an SE(3) trajectory).
+        """
+        degree = max([traj.degree for traj in trajlist])
+        coefficients = np.concatenate([PadCoefficients(traj.coefficients, degree)
+                                       for traj in trajlist], axis=1)
+        return PolyTraj(coefficients, trajlist[0].breakpoints)
+
+
+    ############################## conversion ##############################
+    @staticmethod
+    def FromTOPP(traj):
+        """FromTOPP returns the PolyTraj of a TOPP
+        PiecewisePolynomialTrajectory.
+        """
+        ndof = traj.chunkslist[0].dimension
+        degree = max([len(p.coeff_list) for c in traj.chunkslist
+                      for p in c.polynomialsvector]) - 1
+        coefficients = np.zeros((len(traj.chunkslist), ndof, degree + 1))
+        durations = np.zeros(len(traj.chunkslist))
+        for (i, c) in enumerate(traj.chunkslist):
+            durations[i] = c.duration
+            for (j, p) in enumerate(c.polynomialsvector):
+                coefficients[i, j, :len(p.coeff_list)] = p.coeff_list
+        return PolyTraj.FromDurations(coefficients, durations)
+
+
+    def ToTOPP(self):
+        """ToTOPP returns the TOPP PiecewisePolynomialTrajectory of this
+        trajectory, built directly from the coefficients (no string).
+        """
+        chunkslist = []
+        for (duration, chunk) in zip(self.Durations(), self.coefficients):
+            polynomialslist = [Trajectory.Polynomial(poly.tolist()) for poly in chunk]
+            chunkslist.append(Trajectory.Chunk(duration, polynomialslist))
+        return Trajectory.PiecewisePolynomialTrajectory(chunkslist)
+
+
+    @staticmethod
+    def FromString(trajectorystring):
+        """FromString parses a trajectory in TOPP's text format (e.g.
+        x.restrajectorystring) without building TOPP objects.
+        """
+        lines = [line for line in trajectorystring.strip().split('\n')
+                 if len(line.strip()) > 0]
+        durations = []
+        chunks = []
+        i = 0
+        while i < len(lines):
+            durations.append(float(lines[i]))
+            ndof = int(lines[i + 1])
+            chunks.append([np.array(line.split(), dtype=float)
+                           for line in lines[i + 2:i + 2 + ndof]])
+            i += 2 + ndof
+        degree = max([len(poly) for chunk in chunks for poly in chunk]) - 1
+        coefficients = np.zeros((len(chunks), len(chunks[0]), degree + 1))
+        for (i, chunk) in enumerate(chunks):
+            for (j, poly) in enumerate(chunk):
+                coefficients[i, j, :len(poly)] = poly
+        return PolyTraj.FromDurations(coefficients, durations)
+
+
+################################################################################
+def Interpolate3rdDegree(q_beg, q_end, qs_beg, qs_end, duration):
+    """Interpolate3rdDegree returns the one-chunk cubic PolyTraj going from
+    q_beg to q_end with velocities qs_beg and qs_end (see
+    TOPP.Utilities.Interpolate3rdDegree).
+    """
+    q_beg = np.asarray(q_beg, dtype=float)
+    q_end = np.asarray(q_end, dtype=float)
+    qs_beg = np.asarray(qs_beg, dtype=float)
+    qs_end = np.asarray(qs_end, dtype=float)
+    dq = q_end - q_beg - qs_beg*duration
+    coefficients = np.zeros((1, len(q_beg), 4))
+    coefficients[0, :, 0] = q_beg
+    coefficients[0, :, 1] = qs_beg
+    coefficients[0, :, 2] = (3*dq - (qs_end - qs_beg)*duration)/duration**2
+    coefficients[0, :, 3] = ((qs_end - qs_beg)*duration - 2*dq)/duration**3
+    return PolyTraj(coefficients, [0, duration])
+
+
+def EvalCoefficients(coeffs, x, order=0):
+    """EvalCoefficients evaluates the order-th derivative of the
+    polynomials coeffs (N, ndof, degree + 1) at x (N,) with Horner's
+    scheme. It returns an array of shape (N, ndof).
+    """
+    degree = coeffs.shape[2] - 1
+    x = np.asarray(x, dtype=float)[:, None]
+    res = np.zeros(coeffs.shape[:2])
+    for k in range(degree, order - 1, -1):
+        factor = 1
+        for m in range(order):
+            factor *= (k - m)
+        res = res*x + factor*coeffs[:, :, k]
+    return res
+
+
+def PadCoefficients(coefficients, degree):
+    """PadCoefficients zero-pads the last axis of coefficients to degree + 1
+    terms.
+    """
+    npad = degree + 1 - coefficients.shape[-1]
+    if npad == 0:
+        return coefficients
+    pad = [(0, 0)]*(coefficients.ndim - 1) + [(0, npad)]
+    return np.pad(coefficients, pad, 'constant')
+
+
+def TaylorShift(coefficients, r):
+    """TaylorShift returns the (weak-term-first) coefficients of
+    x -> p(x + r) where p has coefficients along the last axis of
+    coefficients: c'_j = sum_{k >= j} binomial(k, j) r^(k - j) c_k.
+    """
+    coefficients = np.asarray(coefficients, dtype=float)
+    shifted = coefficients.copy()
+    n = coefficients.shape[-1]
+    for j in range(n - 1):
+        for k in range(n - 2, j - 1, -1):
+            shifted[..., k] += r*shifted[..., k + 1]
+    return shifted
@@ -0,0 +1,100 @@
+"""Multi-start planning: N independent RRT planners run in separate
+processes and the first path found (or the best K) is returned.
+
+The planners are built in the workers by plannerfactory, a picklable
+callable returning a ready-to-run SO3RRT.RRTPlanner or SE3RRT.RRTPlanner
+(with its collision checker, translational limits, etc.), e.g. a
+module-level function or a class with __call__.
+"""
+
+import time
+import random
+import multiprocessing
+import Queue
+
+import PolyTraj
+
+
+def _PortfolioWorker(plannerfactory, index, seed, allottedtime, evaluate,
+                     stopevent, results):
+    planner = plannerfactory()
+    planner.SetRandomSeed(seed)
+    t_begin = time.time()
+    found = planner.Run(allottedtime, stopevent.is_set)
+    result = {'worker': index, 'seed': seed, 'found': bool(found),
+              'iterations': planner.iterations, 'runningtime': planner.runningtime,
+              'nvertices': len(planner.treestart) + len(planner.treeend),
+              'walltime': time.time() - t_begin}
+    if found:
+        Rlist = planner.GenFinalRotationMatrixList()
+        trajlist = planner.GenFinalTrajList()
+        ## TOPP objects are sent back as coefficient arrays
+        result['Rlist'] = Rlist
+        result['trajlist'] = [PolyTraj.PolyTraj.FromTOPP(traj) for traj in trajlist]
+        if hasattr(planner, 'GenFinalTrajTranList'):
+            result['trajtranlist'] = planner.GenFinalTrajTranList()
+        if evaluate is not None:
+            result['duration'] = evaluate(planner)
+    results.put(result)
+
+
+def RunPortfolio(plannerfactory, nworkers=None, allottedtime=600, nsolutions=1,
+                 evaluate=None, seed=None):
+    """RunPortfolio runs nworkers planners in parallel, each with its own
+    random seed, and cancels them as soon as nsolutions of them have
+    found a path.
+
+    If evaluate is given, it is called in the worker on every planner that
+    found a path (e.g. to retime it with TOPP) and must return a duration;
+    solutions are then sorted by increasing duration, otherwise by the
+    order in which they were found.
+
+    It returns the list of solutions and the per-worker statistics. A
+    solution is a dict with the worker's statistics and the outputs of
+    GenFinalRotationMatrixList ('Rlist'), GenFinalTrajList ('trajlist')
+    and, for SE(3) planners, GenFinalTrajTranList ('trajtranlist').
+    """
+    if nworkers is None:
+        nworkers = multiprocessing.cpu_count()
+    if seed is None:
+        seeds = [random.SystemRandom().randint(0, 2**31 - 1) for i in range(nworkers)]
+    else:
+        seeds = [seed + i for i in range(nworkers)]
+
+    stopevent = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_PortfolioWorker,
+                                       args=(plannerfactory, i, seeds[i], allottedtime,
+                                             evaluate, stopevent, results))
+               for i in range(nworkers)]
+    for worker in workers:
+        worker.start()
+
+    stats = []
+    solutions = []
+    deadline = time.time() + allottedtime
+    while len(stats) < nworkers:
+        ## workers stop on their own once allottedtime is spent; the
+        ## margin covers the evaluation of a late solution
+        timeout = max(deadline - time.time(), 0) + 60
+        try:
+            result = results.get(timeout=timeout)
+        except Queue.Empty:
+            break
+        if result['found']:
+            result['trajlist'] = [segment.ToTOPP() for segment in result['trajlist']]
+            solutions.append(result)
+            if len(solutions) >= nsolutions:
+                stopevent.set()
+        stats.append(dict([(key, value) for (key, value) in result.iteritems()
+                           if key not in ['Rlist', 'trajlist', 'trajtranlist']]))
+
+    stopevent.set()
+    for worker in workers:
+        worker.join(1)
+        if worker.is_alive():
+            worker.terminate()
+    stats.sort(key=lambda x: x['worker'])
+    if evaluate is not None:
+        solutions.sort(key=lambda x: x['duration'])
+    return solutions[:nsolutions], stats
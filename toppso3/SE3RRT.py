@@ -8,7 +8,11 @@ import numpy as np
 import copy
 import random
 import os
-import Heap
+import NearestNeighbor
+import Collision
+import EdgeMemo
+import PolyTraj
+import Metrics
 
 import lie as Lie
 import Utils as SE3Utils
@@ -26,7 +30,11 @@ TRAPPED = 2
 INCOLLISION = -1
 OK = 1
 
-class Config():
+# weights of the rotational and translational parts of the SE(3) distance
+ROTATIONWEIGHT = 1/pi
+TRANSLATIONWEIGHT = 1
+
+class Config(object):
     """Attributes:
          q   -- quaternion vector
          qs  -- angular velocity
@@ -34,6 +42,8 @@ class Config():
          qt  -- translation vector
          qts -- translational velocity
     """
+    __slots__ = ('q', 'qs', 'qt', 'qts')
+
     def __init__(self, q, qt, qs=None, qts=None, qss=None, qtss=None):
         self.q = q
         if qs is None:
@@ -48,34 +58,127 @@ class Config():
             self.qts = qts
 
 
-class Vertex():
+class Vertex(object):
     """Attributes:
          config     -- stores a Config obj
          parent     -- the parent for FW vertex, the child for BW vertex
-         trajstring -- a trajectory from its parent (or child)
+         index      -- its row in the arrays of its tree
+         duration   -- duration of the trajectories from its parent (or
+                       child)
          level      -- its level from the root of the tree (0 for the root)
+         validated  -- False until traj and trajtran have been checked for
+                       collision (see RRTPlanner.lazy)
+       The rotational and translational (a PolyTraj) trajectories from its
+       parent (or to its child), traj and trajtran, are not stored: they
+       are interpolated again from the two configs when needed.
     """
+    __slots__ = ('config', 'vertextype', 'parent', 'index', 'duration', 'level',
+                 'validated')
+
     def __init__(self, config, vertextype = FW):
         self.config = config
         self.vertextype = vertextype
         self.parent = None # to be assigned when added to a tree
-        self.traj = '' # to be assigned when added to a tree (rot)
-        self.trajtran = '' # to be assigned when added to a tree (trans)
+        self.index = -1 # to be assigned when added to a tree
+        self.duration = None # to be assigned when added to a tree
         self.level = 0
+        self.validated = True
+
+
+    def EdgeConfigs(self):
+        """EdgeConfigs returns the configs at the beginning and at the end
+        of the edge between the vertex and its parent.
+        """
+        if (self.vertextype == FW):
+            return (self.parent.config, self.config)
+        return (self.config, self.parent.config)
+
+
+    @property
+    def traj(self):
+        if (self.parent is None):
+            return None
+        (c_beg, c_end) = self.EdgeConfigs()
+        return Lie.InterpolateSO3Quat(c_beg.q, c_end.q, c_beg.qs, c_end.qs, self.duration)
+
+
+    @property
+    def trajtran(self):
+        if (self.parent is None):
+            return None
+        (c_beg, c_end) = self.EdgeConfigs()
+        return PolyTraj.Interpolate3rdDegree(c_beg.qt, c_end.qt, c_beg.qts, c_end.qts,
+                                             self.duration)
 
 
 class Tree():
     """Attributes:
          verticeslist -- stores all vertices added to the tree
          treetype     -- FW or BW    
+         index        -- nearest-neighbor index over the vertices' poses
+         size         -- number of vertices in the arrays below
+         quats        -- (N,4) quaternions of the vertices
+         velocities   -- (N,3) angular velocities of the vertices
+         translations -- (N,3) translations of the vertices
+         tvelocities  -- (N,3) translational velocities of the vertices
+         parents      -- (N,) row of the parent of each vertex (-1 for the
+                         root)
+       Row i of the arrays (i < size) holds verticeslist[i]. Connect
+       may append to verticeslist a vertex already in the tree.
     """
     def __init__(self, treetype=FW, vroot=None):
-        if vroot is None:
-            self.verticeslist = []
-        else:
-            self.verticeslist = [vroot]
+        self.verticeslist = []
+        self.size = 0
+        self.quats = np.zeros((64, 4))
+        self.velocities = np.zeros((64, 3))
+        self.translations = np.zeros((64, 3))
+        self.tvelocities = np.zeros((64, 3))
+        self.parents = -np.ones(64, dtype=int)
+        self.index = NearestNeighbor.SE3Index(ROTATIONWEIGHT, TRANSLATIONWEIGHT)
+        if vroot is not None:
+            self.AddVertex(None, vroot, None)
         self.treetype = treetype
 
+
+    def Grow(self):
+        self.quats = np.vstack([self.quats, np.zeros(self.quats.shape)])
+        self.velocities = np.vstack([self.velocities, np.zeros(self.velocities.shape)])
+        self.translations = np.vstack([self.translations,
+                                       np.zeros(self.translations.shape)])
+        self.tvelocities = np.vstack([self.tvelocities, np.zeros(self.tvelocities.shape)])
+        self.parents = np.hstack([self.parents, -np.ones(len(self.parents), dtype=int)])
+
+
+    def RebuildIndex(self):
+        self.index = NearestNeighbor.SE3Index(ROTATIONWEIGHT, TRANSLATIONWEIGHT)
+        for i in range(self.size):
+            self.index.Insert(self.quats[i], self.translations[i])
+
+
+    def RemoveSubtree(self, vertex):
+        """RemoveSubtree removes vertex and its descendants (which are
+        stored after it) from the tree and returns the removed vertices.
+        """
+        parents = self.parents[:self.size].tolist()
+        removed = [False]*self.size
+        removed[vertex.index] = True
+        for i in range(vertex.index + 1, self.size):
+            removed[i] = (parents[i] >= 0) and removed[parents[i]]
+        removed = np.array(removed)
+        removedvertices = [self.verticeslist[i] for i in np.flatnonzero(removed)]
+        kept = np.flatnonzero(~removed)
+        newindices = np.cumsum(~removed) - 1
+        parents = self.parents[kept]
+        self.parents[:len(kept)] = np.where(parents >= 0, newindices[parents], -1)
+        for array in [self.quats, self.velocities, self.translations, self.tvelocities]:
+            array[:len(kept)] = array[kept]
+        self.verticeslist = [self.verticeslist[i] for i in kept]
+        for (i, v) in enumerate(self.verticeslist):
+            v.index = i
+        self.size = len(kept)
+        self.RebuildIndex()
+        return removedvertices
+
         
     def __len__(self):
         return len(self.verticeslist)
@@ -85,11 +188,23 @@ class Tree():
         return self.verticeslist[index]        
     
     
-    def AddVertex(self, parent, traj, trajtran, vnew):
+    def AddVertex(self, parent, vnew, duration):
+        """AddVertex adds vnew, reached from parent (None for the root) by
+        trajectories of the given duration.
+        """
         vnew.parent = parent
-        vnew.traj = traj
-        vnew.trajtran = trajtran
+        vnew.duration = duration
+        vnew.index = self.size
+        if (self.size == len(self.parents)):
+            self.Grow()
+        self.quats[self.size] = vnew.config.q
+        self.velocities[self.size] = vnew.config.qs
+        self.translations[self.size] = vnew.config.qt
+        self.tvelocities[self.size] = vnew.config.qts
+        self.parents[self.size] = -1 if (parent is None) else parent.index
+        self.size += 1
         self.verticeslist.append(vnew)
+        self.index.Insert(vnew.config.q, vnew.config.qt)
 
         
     def GenTrajList(self):
@@ -134,7 +249,7 @@ class Tree():
         return RotationMatList
 
     
-    def GenTrajTranString(self):
+    def GenTrajTranList(self):
         trajtranlist = []
         if (self.treetype == FW):
             vertex = self.verticeslist[-1]
@@ -151,14 +266,13 @@ class Tree():
                 trajtranlist.append(vertex.trajtran)
                 if (vertex.parent is not None):
                     vertex = vertex.parent
-        trajectorytranstring = ''
-        for i in range(len(trajtranlist)):
-            trajectorytranstring += "\n"
-            trajectorytranstring += trajtranlist[i]
-        trajectorytranstring = string.lstrip(trajectorytranstring) # remove leading "\n"
-        return trajectorytranstring
+        return trajtranlist
+
+
+    def GenTrajTranString(self):
+        return '\n'.join([str(trajtran) for trajtran in self.GenTrajTranList()])
+
 
-    
 class RRTPlanner():
     """Base class for RRT planners"""
     REACHED = 0
@@ -174,10 +288,35 @@ class RRTPlanner():
         ## need more unpredictable sequence than that generated from np.random
         self._RNG = random.SystemRandom()
         self.robot = robot
+        ## any Collision.CollisionBackend (e.g. a ParallelCollisionChecker)
+        if robot is None:
+            self.collisionchecker = None
+        else:
+            self.collisionchecker = Collision.OpenRAVEBackend(robot)
+        ## 'dense' or 'bisection' (see Collision.SweepIsInCollision)
+        self.sweepmode = 'dense'
+        ## radius of a ball centered at the robot's origin containing the
+        ## robot; enables the Lipschitz certification of 'bisection' sweeps
+        self.robotradius = None
+        ## if True, the trees grow checking only the new vertices and the
+        ## edges are swept only once they make a path (see ValidatePath)
+        self.lazy = False
+        self.connectingtree = None # tree Connect appended its vertex to
+        ## outcomes of the connections swept by ValidatePath (see EdgeMemo)
+        self.edgememo = EdgeMemo.EdgeMemo()
+        ## Connect tries at most connectattempts vertices of the other tree
+        ## (-1 for all of them), nearest first, within connectradius (None
+        ## for no limit); with connectmode 'greedy', it rather extends the
+        ## other tree toward the new vertex, at most connectattempts steps
+        ## (-1 for no limit)
+        self.connectattempts = -1
+        self.connectradius = None
+        self.connectmode = 'direct'
+        self.connectstats = dict(calls=0, reached=0, rejected=0, attempts=0, steps=0)
         self.treestart = Tree(FW, vertex_start)
         self.treeend = Tree(BW, vertex_goal)
         self.connectingtraj = []
-        self.connectingtrajtran = []
+        self.connectingtrajtran = None
         self.runningtime = 0.0
         self.nn = -1
         self.iterations = 0
@@ -191,6 +330,15 @@ class RRTPlanner():
         self._settranslationallimits = False
         
         
+    def SetRandomSeed(self, seed):
+        """SetRandomSeed makes the sampling of the planner reproducible.
+        Orientations are drawn from np.random (see Lie.RandomQuat), which
+        is seeded as well.
+        """
+        self._RNG = random.Random(seed)
+        np.random.seed(seed % 2**32)
+
+
     def SetTranslationalLimits(self, upper, lower=[]):
         self.uppertlimits = upper
         if len(lower) == 0:
@@ -204,7 +352,8 @@ class RRTPlanner():
 
     def __str__(self):
         ret = "Total running time :" + str(self.runningtime) + "sec.\n"
-        ret += "Total number of iterations :" + str(self.iterations)
+        ret += "Total number of iterations :" + str(self.iterations) + "\n"
+        ret += self.ConnectStatistics()
         return ret
 
     
@@ -234,8 +383,8 @@ class RRTPlanner():
         return res
 
 
-    def ExtendFW(self, c_rand):
-        nnindices = self.NearestNeighborIndices(c_rand, FW)
+    def ExtendFW(self, c_rand, custom_nn = 0):
+        nnindices = self.NearestNeighborIndices(c_rand, FW, custom_nn)
         for index in nnindices:
             v_near = self.treestart.verticeslist[index]
             q_beg = v_near.config.q
@@ -262,35 +411,37 @@ class RRTPlanner():
             ## check feasibility of c_new
             if (not self.IsFeasibleConfig(c_new)):
                 if self.PRINT:
-                    print '    [ExtendFW] TRAPPED (infeasible configuration)'
+                    Metrics.Log('    [ExtendFW] TRAPPED (infeasible configuration)',
+                                None, Metrics.DEBUG)
                 STATUS = TRAPPED
                 continue            
             
             ## interpolate a trajectory
-            trajectory = Lie.InterpolateSO3(rotationMatrixFromQuat(q_beg),
-                                            rotationMatrixFromQuat(q_end),
-                                            qs_beg, qs_end, self.INTERPOLATIONDURATION)
-            trajectorytranstring = SE3Utils.TrajString3rdDegree\
-            (qt_beg, qt_end, qts_beg, qts_end, self.INTERPOLATIONDURATION)
+            with Metrics.Timer('rrt.interpolate'):
+                trajectory = Lie.InterpolateSO3Quat(q_beg, q_end, qs_beg, qs_end,
+                                                    self.INTERPOLATIONDURATION)
+                trajtran = PolyTraj.Interpolate3rdDegree\
+                (qt_beg, qt_end, qts_beg, qts_end, self.INTERPOLATIONDURATION)
             
             ## check feasibility ( collision checking for the trajectory)
-            result = self.IsFeasibleTrajectory(trajectory, trajectorytranstring, 
-                                               q_beg, qt_beg, FW) 
+            result = self.CheckEdge(trajectory, trajtran, q_beg, qt_beg, FW)
             if (result[0] == OK):
                   ## extension is now successful
                 v_new = Vertex(c_new, FW)
+                v_new.validated = not self.lazy
                 v_new.level = v_near.level + 1
-                self.treestart.AddVertex(v_near, trajectory, trajectorytranstring, v_new)
+                self.treestart.AddVertex(v_near, v_new, self.INTERPOLATIONDURATION)
                 return STATUS
             else:
                 if self.PRINT:
-                    print '    [ExtendFW] TRAPPED (trajectory in collision)'
+                    Metrics.Log('    [ExtendFW] TRAPPED (trajectory in collision)',
+                                None, Metrics.DEBUG)
                 STATUS = TRAPPED
         return STATUS
     
 
-    def ExtendBW(self, c_rand):
-        nnindices = self.NearestNeighborIndices(c_rand, BW)
+    def ExtendBW(self, c_rand, custom_nn = 0):
+        nnindices = self.NearestNeighborIndices(c_rand, BW, custom_nn)
         for index in nnindices:
             v_near = self.treeend.verticeslist[index]
             q_end = v_near.config.q
@@ -316,48 +467,171 @@ class RRTPlanner():
             ## check feasibility of c_new
             if (not self.IsFeasibleConfig(c_new)):
                 if self.PRINT:
-                    print '    [ExtendBW] TRAPPED (infeasible configuration)'
+                    Metrics.Log('    [ExtendBW] TRAPPED (infeasible configuration)',
+                                None, Metrics.DEBUG)
                 STATUS = TRAPPED
                 continue            
 
             ## interpolate a trajectory
-            trajectory = Lie.InterpolateSO3(rotationMatrixFromQuat(q_beg),
-                                            rotationMatrixFromQuat(q_end),
-                                            qs_beg, qs_end, self.INTERPOLATIONDURATION)
+            with Metrics.Timer('rrt.interpolate'):
+                trajectory = Lie.InterpolateSO3Quat(q_beg, q_end, qs_beg, qs_end,
+                                                    self.INTERPOLATIONDURATION)
 
-            trajectorytranstring = SE3Utils.TrajString3rdDegree\
-            (qt_beg, qt_end, qts_beg, qts_end, self.INTERPOLATIONDURATION)
+                trajtran = PolyTraj.Interpolate3rdDegree\
+                (qt_beg, qt_end, qts_beg, qts_end, self.INTERPOLATIONDURATION)
             
             ## check feasibility ( collision checking for the trajectory)
-            result = self.IsFeasibleTrajectory(trajectory, trajectorytranstring, 
-                                               q_beg, qt_beg, BW)
+            result = self.CheckEdge(trajectory, trajtran, q_beg, qt_beg, BW)
             if (result[0] == OK):
                 ## extension is now successful
                 v_new = Vertex(c_new, BW)
+                v_new.validated = not self.lazy
                 v_new.level = v_near.level + 1
-                self.treeend.AddVertex(v_near, trajectory,trajectorytranstring, v_new)
+                self.treeend.AddVertex(v_near, v_new, self.INTERPOLATIONDURATION)
                 return STATUS
             else:
                 if self.PRINT:
-                    print '    [ExtendBW] TRAPPED (trajectory in collision)'
+                    Metrics.Log('    [ExtendBW] TRAPPED (trajectory in collision)',
+                                None, Metrics.DEBUG)
                 STATUS = TRAPPED
         return STATUS
 
 
     def Connect(self):
+        """Connect tries to connect the tree just extended to the other
+        one. In lazy mode, the path made by the connection is then checked
+        by ValidatePath, and the connection only counts as reached if it
+        is valid.
+        """
+        greedy = (self.connectmode == 'greedy')
         if (np.mod(self.iterations - 1, 2) == FW):
             ## treestart has just been extended
-            res = self.ConnectBW()
+            res = self.ConnectGreedyBW() if greedy else self.ConnectBW()
         else:
             ## treeend has just been extended
-            res = self.ConnectFW()
+            res = self.ConnectGreedyFW() if greedy else self.ConnectFW()
+        if (res == REACHED) and not self.ValidatePath():
+            self.connectstats['rejected'] += 1
+            Metrics.Count('rrt.connect.rejected')
+            res = TRAPPED
+        self.connectstats['calls'] += 1
+        if (res == REACHED):
+            self.connectstats['reached'] += 1
+            Metrics.Count('rrt.connect.reached')
+        else:
+            Metrics.Count('rrt.connect.trapped')
         return res
+
+
+    def ConnectCandidates(self, c_test, treetype, n=0):
+        """ConnectCandidates returns the indices of the vertices of the
+        tree specified by treetype that Connect tries to join to c_test,
+        nearest first: at most n of them (by default, connectattempts and
+        nn), within connectradius. The kd-tree only visits the cells whose
+        lower bound on the distance can beat the candidates found.
+        """
+        if (treetype == FW):
+            tree = self.treestart
+        else:
+            tree = self.treeend
+        if (n == 0):
+            n = len(tree) if (self.connectattempts == -1) else self.connectattempts
+            if (self.nn != -1):
+                n = min(n, self.nn)
+        with Metrics.Timer('rrt.nearestneighbor'):
+            if self.connectradius is None:
+                return tree.index.KNearest((c_test.q, c_test.qt), n)
+            return tree.index.Radius((c_test.q, c_test.qt), self.connectradius)[:n]
+
+
+    def ConnectGreedy(self, treetype):
+        """ConnectGreedy extends the tree specified by treetype from its
+        nearest vertex toward the vertex just added to the other tree, as
+        in RRT-Connect, until it is within STEPSIZE of it and the two are
+        connected, an extension fails, or connectattempts steps are made.
+        """
+        if (treetype == FW):
+            tree = self.treestart
+            v_test = self.treeend.verticeslist[-1]
+        else:
+            tree = self.treeend
+            v_test = self.treestart.verticeslist[-1]
+        steps = 0
+        while True:
+            nnindices = self.ConnectCandidates(v_test.config, treetype, 1)
+            if len(nnindices) == 0:
+                return TRAPPED
+            if (self.Distance(tree.verticeslist[nnindices[0]].config, v_test.config)
+                <= self.STEPSIZE):
+                if (treetype == FW):
+                    return self.ConnectFW(nnindices)
+                else:
+                    return self.ConnectBW(nnindices)
+            if (steps == self.connectattempts):
+                return TRAPPED
+            steps += 1
+            self.connectstats['steps'] += 1
+            Metrics.Count('rrt.connect.steps')
+            if (treetype == FW):
+                status = self.ExtendFW(v_test.config, 1)
+            else:
+                status = self.ExtendBW(v_test.config, 1)
+            if (status == TRAPPED):
+                return TRAPPED
+
+
+    def ConnectGreedyFW(self):
+        return self.ConnectGreedy(FW)
+
+
+    def ConnectGreedyBW(self):
+        return self.ConnectGreedy(BW)
+
+
+    def LookupEdge(self, vstart, vend):
+        """LookupEdge returns the key in edgememo of the connection from
+        vstart to vend and its remembered outcome (None if unknown).
+        """
+        key = self.edgememo.Key(vstart, vend, [vstart.config.qs, vstart.config.qts, vend.config.qs,
+                     vend.config.qts],
+                                self.INTERPOLATIONDURATION)
+        outcome = self.edgememo.Lookup(key)
+        if (outcome is None):
+            Metrics.Count('rrt.edgememo.misses')
+        else:
+            Metrics.Count('rrt.edgememo.hits')
+        return key, outcome
+
+
+    def ConnectStatistics(self):
+        """ConnectStatistics describes the outcomes of Connect so far.
+        """
+        stats = self.connectstats
+        failed = stats['calls'] - stats['reached']
+        return ("Connect : {0} calls, {1} failed ({2} rejected by ValidatePath), "
+                "{3} connections tried ({4:.2f} per call), {5} greedy steps, "
+                "edge memo hit rate {6:.1%}").format\
+                (stats['calls'], failed, stats['rejected'], stats['attempts'],
+                 stats['attempts']/float(max(stats['calls'], 1)), stats['steps'],
+                 self.edgememo.HitRate())
         
-    def ConnectFW(self):
+    def ConnectFW(self, nnindices=None):
         v_test = self.treeend.verticeslist[-1]
-        nnindices = self.NearestNeighborIndices(v_test.config, FW)
-        for index in nnindices:
-            v_near = self.treestart.verticeslist[index]
+        if nnindices is None:
+            nnindices = self.ConnectCandidates(v_test.config, FW)
+        if len(nnindices) == 0:
+            return TRAPPED
+        ## interpolate the rotations to all the neighbors at once
+        v_nears = [self.treestart.verticeslist[index] for index in nnindices]
+        ones = np.ones((len(v_nears), 1))
+        indices = [v_near.index for v_near in v_nears]
+        q_nears = self.treestart.quats[indices]
+        qs_nears = self.treestart.velocities[indices]
+        with Metrics.Timer('rrt.interpolate'):
+            coefficients = Lie.InterpolateSO3QuatBatch\
+            (q_nears, ones*v_test.config.q, qs_nears, ones*v_test.config.qs,
+             self.INTERPOLATIONDURATION)
+        for (i, v_near) in enumerate(v_nears):
             
             q_beg = v_near.config.q
             qs_beg = v_near.config.qs
@@ -369,30 +643,43 @@ class RRTPlanner():
             qt_end = v_test.config.qt
             qts_end = v_test.config.qts
             
+            self.connectstats['attempts'] += 1
+            Metrics.Count('rrt.connect.attempts')
             ## interpolate a trajectory
-            trajectory = Lie.InterpolateSO3(rotationMatrixFromQuat(q_beg),
-                                            rotationMatrixFromQuat(q_end),
-                                            qs_beg, qs_end, self.INTERPOLATIONDURATION)
-            trajectorytranstring = SE3Utils.TrajString3rdDegree\
+            trajectory = PolyTraj.PolyTraj(coefficients[i:i + 1],
+                                           [0, self.INTERPOLATIONDURATION]).ToTOPP()
+            trajtran = PolyTraj.Interpolate3rdDegree\
             (qt_beg, qt_end, qts_beg, qts_end, self.INTERPOLATIONDURATION)
             
             ## check feasibility (collision checking for the trajectory)
-            result = self.IsFeasibleTrajectory(trajectory, trajectorytranstring, 
-                                               q_beg, qt_beg, FW)
+            result = self.CheckEdge(trajectory, trajtran, q_beg, qt_beg, FW)
             if (result[0] == 1):
                 ## conection is now successful
                 self.treestart.verticeslist.append(v_near)
+                self.connectingtree = FW
                 self.connectingtraj = trajectory
-                self.connectingtrajtran = trajectorytranstring
+                self.connectingtrajtran = trajtran
                 return REACHED
         return TRAPPED
     
 
-    def ConnectBW(self):
+    def ConnectBW(self, nnindices=None):
         v_test = self.treestart.verticeslist[-1]
-        nnindices = self.NearestNeighborIndices(v_test.config, BW)
-        for index in nnindices:
-            v_near = self.treeend.verticeslist[index]
+        if nnindices is None:
+            nnindices = self.ConnectCandidates(v_test.config, BW)
+        if len(nnindices) == 0:
+            return TRAPPED
+        ## interpolate the rotations to all the neighbors at once
+        v_nears = [self.treeend.verticeslist[index] for index in nnindices]
+        ones = np.ones((len(v_nears), 1))
+        indices = [v_near.index for v_near in v_nears]
+        q_nears = self.treeend.quats[indices]
+        qs_nears = self.treeend.velocities[indices]
+        with Metrics.Timer('rrt.interpolate'):
+            coefficients = Lie.InterpolateSO3QuatBatch\
+            (ones*v_test.config.q, q_nears, ones*v_test.config.qs, qs_nears,
+             self.INTERPOLATIONDURATION)
+        for (i, v_near) in enumerate(v_nears):
             
             q_end = v_near.config.q
             qs_end = v_near.config.qs
@@ -404,70 +691,67 @@ class RRTPlanner():
             qt_beg = v_test.config.qt
             qts_beg = v_test.config.qts
 
+            self.connectstats['attempts'] += 1
+            Metrics.Count('rrt.connect.attempts')
             ## interpolate a trajectory
-            trajectory = Lie.InterpolateSO3(rotationMatrixFromQuat(q_beg),
-                                            rotationMatrixFromQuat(q_end),
-                                            qs_beg, qs_end, self.INTERPOLATIONDURATION)
-            trajectorytranstring = SE3Utils.TrajString3rdDegree\
+            trajectory = PolyTraj.PolyTraj(coefficients[i:i + 1],
+                                           [0, self.INTERPOLATIONDURATION]).ToTOPP()
+            trajtran = PolyTraj.Interpolate3rdDegree\
             (qt_beg, qt_end, qts_beg, qts_end, self.INTERPOLATIONDURATION)
             
             ## check feasibility (collision checking for the trajectory)
-            result = self.IsFeasibleTrajectory(trajectory, trajectorytranstring, 
-                                               q_beg, qt_beg, BW)
+            result = self.CheckEdge(trajectory, trajtran, q_beg, qt_beg, BW)
             if (result[0] == 1):
                  ## conection is now successful
                 self.treeend.verticeslist.append(v_near)
+                self.connectingtree = BW
                 self.connectingtraj = trajectory
-                self.connectingtrajtran = trajectorytranstring
+                self.connectingtrajtran = trajtran
                 return REACHED
         return TRAPPED
     
 
+    def EnableCollisionCache(self, maxsize=100000, rotationresolution=1e-3,
+                             translationresolution=1e-3):
+        """EnableCollisionCache puts a Collision.CachedCollisionBackend in
+        front of the current collision checker.
+        """
+        self.collisionchecker = Collision.CachedCollisionBackend\
+        (self.collisionchecker, maxsize, rotationresolution, translationresolution)
+        return self.collisionchecker
+
+
     def IsFeasibleConfig(self, c_rand):
         """IsFeasibleConfig checks feasibility of the given Config object. 
         Feasibility conditions are to be determined by each RRT planner.
         """
-        env = self.robot.GetEnv()
-        with self.robot:
-            transformation = eye(4)
-            transformation[0:3,0:3] = rotationMatrixFromQuat(c_rand.q)
-            transformation[0:3,3] = c_rand.qt
-            self.robot.SetTransform(transformation)
-            isincollision = (env.CheckCollision(self.robot, CollisionReport()))
-            if (isincollision):
-                return False
-            else:
-                return True
+        transformation = eye(4)
+        transformation[0:3,0:3] = rotationMatrixFromQuat(c_rand.q)
+        transformation[0:3,3] = c_rand.qt
+        Metrics.Count('collision.poses')
+        with Metrics.Timer('collision.pose'):
+            isincollision = self.collisionchecker.CheckPose(transformation)
+        if (isincollision):
+            return False
+        else:
+            return True
 
 
-    def IsFeasibleTrajectory(self, trajectory, trajectorytranstring, 
+    def IsFeasibleTrajectory(self, trajectory, trajtran, 
                              q_beg, qt_beg, direction):
         """IsFeasibleTrajectory checks feasibility of the given trajectory.
         Feasibility conditions are to be determined by each RRT planner.
         """
         ## check collision
-        env = self.robot.GetEnv()
         traj = trajectory
         R_beg =  rotationMatrixFromQuat(q_beg)
-        trajtran = TOPP.Trajectory.PiecewisePolynomialTrajectory.FromString\
-        (trajectorytranstring)
         
-        for s in np.arange(0, traj.duration, self.discrtimestep):
-            with self.robot:
-                transformation = eye(4)
-                transformation[0:3,0:3] = Lie.EvalRotation(R_beg, traj, s)
-                transformation[0:3,3] = trajtran.Eval(s)
- 
-                self.robot.SetTransform(transformation)
-                isincollision = (env.CheckCollision(self.robot, CollisionReport()))
-                
-            if (isincollision):
-                return [INCOLLISION]
-
-        with self.robot:
-            self.robot.SetTransform(transformation)
-            isincollision = (env.CheckCollision(self.robot, CollisionReport()))
-        if (isincollision):
+        svect = np.arange(0, traj.duration, self.discrtimestep)
+        transformations = Collision.TrajectoryTransformations(R_beg, traj, svect, trajtran)
+        lipschitz = Collision.SweepLipschitz(self.discrtimestep, self.robotradius,
+                                             traj, trajtran)
+        if (Collision.SweepIsInCollision(self.collisionchecker, transformations,
+                                         self.sweepmode, lipschitz)):
             return [INCOLLISION]
         else:
             if (direction == FW):
@@ -476,9 +760,81 @@ class RRTPlanner():
                 return [OK]
 
 
-    def Run(self, allottedtime):
+    def CheckEdge(self, trajectory, trajtran, q_beg, qt_beg, direction):
+        """CheckEdge is IsFeasibleTrajectory for the edges of the trees
+        and connections; in lazy mode, they are only swept by
+        ValidatePath.
+        """
+        if self.lazy:
+            return [OK]
+        return self.IsFeasibleTrajectory(trajectory, trajtran, q_beg, qt_beg, direction)
+
+
+    def ValidatePath(self):
+        """ValidatePath sweeps the connection found by Connect and the
+        edges of the path not validated yet. If one is in collision, the
+        connection is undone, the vertex ending the failed tree edge is
+        removed with its subtree, and False is returned. Validated edges
+        are never swept again, nor are the connections in edgememo.
+        """
+        if not self.lazy:
+            return True
+        vstart = self.treestart.verticeslist[-1]
+        vend = self.treeend.verticeslist[-1]
+        edges = [] # (tree, vertex whose edge to its parent is checked)
+        for (tree, vertex) in [(self.treestart, vstart), (self.treeend, vend)]:
+            while vertex.parent is not None:
+                if not vertex.validated:
+                    edges.append((tree, vertex))
+                vertex = vertex.parent
+        failed = None
+        self.edgememo.Validate(self.collisionchecker.EnvironmentStamp())
+        key, outcome = self.LookupEdge(vstart, vend)
+        if (outcome is None):
+            Metrics.Count('rrt.lazy.sweeps')
+            outcome = self.IsFeasibleTrajectory(self.connectingtraj, self.connectingtrajtran,
+                                                vstart.config.q, vstart.config.qt, FW)[0]
+            self.edgememo.Store(key, outcome)
+        if (outcome != OK):
+            failed = (None, None)
+        if failed is None:
+            for (tree, vertex) in edges:
+                Metrics.Count('rrt.lazy.sweeps')
+                ## an edge starts at the vertex closer to the start
+                if tree.treetype == FW:
+                    c_beg = vertex.parent.config
+                else:
+                    c_beg = vertex.config
+                if (self.IsFeasibleTrajectory(vertex.traj, vertex.trajtran, c_beg.q,
+                                              c_beg.qt, tree.treetype)[0] == OK):
+                    vertex.validated = True
+                else:
+                    failed = (tree, vertex)
+                    break
+        if failed is None:
+            return True
+        ## undo the connection, then drop the failed edge
+        if self.connectingtree == FW:
+            self.treestart.verticeslist.pop()
+        else:
+            self.treeend.verticeslist.pop()
+        self.connectingtraj = []
+        self.connectingtrajtran = None
+        (tree, vertex) = failed
+        if tree is not None:
+            removed = tree.RemoveSubtree(vertex)
+            Metrics.Count('rrt.lazy.removed', len(removed))
+            self.edgememo.DiscardVertices(removed)
+        return False
+
+
+    def Run(self, allottedtime, shouldstop=None):
+        """Run grows the trees for at most allottedtime seconds. If given,
+        shouldstop is called at every iteration and stops the planner when
+        it returns True (see Portfolio).
+        """
         if (self.result):
-            print "The planner has already found a path."
+            Metrics.Log('The planner has already found a path.', None, Metrics.WARNING)
             return True
 
         t = 0.0
@@ -487,40 +843,49 @@ class RRTPlanner():
 
         t_begin = time.time()
         if (self.Connect() == REACHED):
-            print Colorize('Path found', 'green')
-            print Colorize('    Total number of iterations : {0}'.format\
-                               (self.iterations), 'green')
+            Metrics.Log('Path found', 'green')
+            Metrics.Log('    Total number of iterations : {0}'.format\
+                        (self.iterations), 'green')
             t_end = time.time()
             t += t_end - t_begin
             self.runningtime += t
-            print Colorize('    Total running time : {0} sec.'.format\
-                               (self.runningtime), 'green')
+            Metrics.Log('    Total running time : {0} sec.'.format\
+                        (self.runningtime), 'green')
+            Metrics.Log('    ' + self.ConnectStatistics(), 'green')
             self.result = True
             return self.result
 
 
         while (t < allottedtime):
+            if (shouldstop is not None) and shouldstop():
+                break
             it += 1
             self.iterations += 1
-            print Colorize('iteration : {0}'.format(it), 'blue')
+            Metrics.Count('rrt.iterations')
+            Metrics.Log('iteration : {0}'.format(it), 'blue', Metrics.DEBUG)
             t_begin = time.time()
             
             c_rand = self.RandomConfig()
-            if (self.Extend(c_rand) != TRAPPED):
-                print Colorize('Tree start : {0}; Tree end : {1}'.\
-                                   format(len(self.treestart.verticeslist), 
-                                          len(self.treeend.verticeslist)),
-                               'green')
+            with Metrics.Timer('rrt.extend'):
+                status = self.Extend(c_rand)
+            if (status != TRAPPED):
+                Metrics.Log('Tree start : {0}; Tree end : {1}'.\
+                            format(len(self.treestart.verticeslist), 
+                                   len(self.treeend.verticeslist)),
+                            'green', Metrics.DEBUG)
                 
-                if (self.Connect() == REACHED):
-                    print Colorize('Path found', 'green')
-                    print Colorize('    Total number of iterations : {0}'.format\
-                                       (self.iterations), 'green')
+                with Metrics.Timer('rrt.connect'):
+                    status = self.Connect()
+                if (status == REACHED):
+                    Metrics.Log('Path found', 'green')
+                    Metrics.Log('    Total number of iterations : {0}'.format\
+                                (self.iterations), 'green')
                     t_end = time.time()
                     t += t_end - t_begin
                     self.runningtime += t
-                    print Colorize('    Total running time : {0} sec.'.format\
-                                       (self.runningtime), 'green')
+                    Metrics.Log('    Total running time : {0} sec.'.format\
+                                (self.runningtime), 'green')
+                    Metrics.Log('    ' + self.ConnectStatistics(), 'green')
                     self.result = True
                     return self.result
                 
@@ -528,8 +893,9 @@ class RRTPlanner():
             t += t_end - t_begin
             self.runningtime += t_end - t_begin
             
-        print Colorize('Allotted time {0} sec. is exhausted after {1} iterations'.\
-                           format(allottedtime, self.iterations - prev_it))
+        Metrics.Log('Allotted time {0} sec. is exhausted after {1} iterations'.\
+                    format(allottedtime, self.iterations - prev_it))
+        Metrics.Log('    ' + self.ConnectStatistics())
         
         return self.result
 
@@ -537,13 +903,8 @@ class RRTPlanner():
     def Distance(self, c_test0, c_test1):
         """Distance measures distance between 2 configs, ctest0 and ctest1
         """
-        X0 = eye(4)
-        X1 = eye(4)
-        X0[:3,:3] = rotationMatrixFromQuat(c_test0.q)
-        X0[:3,3] = c_test0.qt
-        X1[:3,:3] = rotationMatrixFromQuat(c_test1.q)
-        X1[:3,3] = c_test1.qt
-        return SE3Utils.SE3Distance(X0, X1,1/pi, 1)
+        return SE3Utils.SE3QuatDistance(c_test0.q, c_test0.qt, c_test1.q, c_test1.qt,
+                                        ROTATIONWEIGHT, TRANSLATIONWEIGHT)
 
         
     def NearestNeighborIndices(self, c_rand, treetype, custom_nn = 0):
@@ -556,10 +917,7 @@ class RRTPlanner():
         else:
             tree = self.treeend
             nv = len(tree)
-            
-        distancelist = [self.Distance(c_rand, v.config) for v in tree.verticeslist]
-        distanceheap = Heap.Heap(distancelist)
-        
+
         if (custom_nn == 0):
             nn = self.nn
         else:
@@ -568,14 +926,15 @@ class RRTPlanner():
         if (nn == -1): #using all of the vertexes in the tree
             nn = nv
         else:
-            nn = min(self.nn, nv)
-        nnindices = [distanceheap.ExtractMin()[0] for i in range(nn)]
-        return nnindices
+            nn = min(nn, nv)
+        with Metrics.Timer('rrt.nearestneighbor'):
+            return tree.index.KNearest((c_rand.q, c_rand.qt), nn)
 
 
     def GenFinalTrajList(self):
         if (not self.result):
-            print "The Planner did not find any path from start to goal."
+            Metrics.Log('The Planner did not find any path from start to goal.', None,
+                        Metrics.WARNING)
             return []
         TrajectoryList = []
         TrajectoryList = self.treestart.GenTrajList()
@@ -589,7 +948,8 @@ class RRTPlanner():
     
     def GenFinalRotationMatrixList(self):
         if (not self.result):
-            print "The Planner did not find any path from start to goal."
+            Metrics.Log('The Planner did not find any path from start to goal.', None,
+                        Metrics.WARNING)
             return []
         
         RotationMatrixList = []
@@ -600,20 +960,27 @@ class RRTPlanner():
         #print len(RotationMatrixList)
         return RotationMatrixList
 
-    def GenFinalTrajTranString(self):
+    def GenFinalTrajTranList(self):
         if (not self.result):
-            print "The Planner did not find any path from start to goal."
-            return ''
-        
-        trajectorytranstring = ''
-        trajectorytranstring += self.treestart.GenTrajTranString()
-        if not (self.connectingtrajtran == ''):
-            if not (trajectorytranstring == ''):
-                trajectorytranstring += "\n"
-            trajectorytranstring += self.connectingtrajtran
-        trajtranstring_treeend = self.treeend.GenTrajTranString()
-        if (not trajtranstring_treeend == ''):
-            trajectorytranstring += "\n"
-            trajectorytranstring += trajtranstring_treeend
-        
-        return trajectorytranstring
+            Metrics.Log('The Planner did not find any path from start to goal.', None,
+                        Metrics.WARNING)
+            return []
+        trajtranlist = self.treestart.GenTrajTranList()
+        if (self.connectingtrajtran is not None):
+            trajtranlist.append(self.connectingtrajtran)
+        trajtranlist.extend(self.treeend.GenTrajTranList())
+        return trajtranlist
+
+
+    def GenFinalTransTraj(self):
+        """GenFinalTransTraj returns the translational part of the path as
+        a single PolyTraj (None if no path has been found).
+        """
+        trajtranlist = self.GenFinalTrajTranList()
+        if (len(trajtranlist) == 0):
+            return None
+        return PolyTraj.PolyTraj.Concatenate(trajtranlist)
+
+
+    def GenFinalTrajTranString(self):
+        return '\n'.join([str(trajtran) for trajtran in self.GenFinalTrajTranList()])
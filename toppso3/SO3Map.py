@@ -0,0 +1,339 @@
+"""Precomputed collision map of SO(3) for a robot rotating about a point.
+
+When the robot only rotates (as in SO3RRT), whether it collides in a
+static environment is a function of its orientation alone. SO3Map
+stores that function on a grid of SO(3) built as a cubed hypersphere.
+A unit quaternion q (identified with -q) lies on the face f of its
+largest component; its three other components divided by q[f] are
+mapped to [-1, 1]^3 by the equal-angle map u = 4/pi*arctan(x). At level
+L, each of the 4 faces is split into 8^L cubes, numbered in Morton (Z)
+order, so that the cells of level L descending from a cell c of level l
+are the contiguous range [c*8^(L-l), (c+1)*8^(L-l)).
+
+Build checks the cell centers. It marks as boundary the cells whose
+verdict may differ elsewhere in the cell: those with a neighbor of the
+other verdict (the set being grown margin times) and, if the backend has
+a Clearance and robotradius is given, the free cells whose clearance
+does not cover the whole cell (see CellAngle); the free cells are then
+certified coarse-to-fine, a large free region costing one check.
+SO3MapBackend answers the queries off the boundary from the map and
+hands the others to the exact backend. Without a clearance, the map is
+only as good as its resolution: an obstacle thinner than a cell may be
+missed by the centers (raise margin or level).
+
+The map is saved as two bitsets (np.packbits) in a .npz file. It can be
+built offline for an OpenRAVE environment with
+
+    python SO3Map.py ../MESSENGER/messengerWithEnv.xml messenger.npz --level 5
+"""
+
+import numpy as np
+
+import lie as Lie
+import Collision
+import Metrics
+
+## Morton codes of the cells of a face fit in 30 bits
+MAXLEVEL = 10
+
+## indices of the components of a quaternion other than that of its face
+_OTHERS = np.array([[1, 2, 3], [0, 2, 3], [0, 1, 3], [0, 1, 2]])
+
+_CELLANGLES = dict()
+
+
+def NCells(level):
+    return 4*8**level
+
+
+def MortonEncode(i, j, k, level):
+    codes = np.zeros(np.shape(i), dtype=np.int64)
+    for b in range(level):
+        codes |= (((i >> b) & 1) << (3*b + 2)) | (((j >> b) & 1) << (3*b + 1)) | \
+                 (((k >> b) & 1) << (3*b))
+    return codes
+
+
+def MortonDecode(codes, level):
+    i = np.zeros(np.shape(codes), dtype=np.int64)
+    j = np.zeros(np.shape(codes), dtype=np.int64)
+    k = np.zeros(np.shape(codes), dtype=np.int64)
+    for b in range(level):
+        i |= ((codes >> (3*b + 2)) & 1) << b
+        j |= ((codes >> (3*b + 1)) & 1) << b
+        k |= ((codes >> (3*b)) & 1) << b
+    return i, j, k
+
+
+def CellIndices(quats, level):
+    """CellIndices returns the indices of the cells of the given level
+    containing the (N,4) unit quaternions.
+    """
+    quats = np.reshape(np.asarray(quats, dtype=float), (-1, 4))
+    n = 2**level
+    rows = np.arange(len(quats))
+    faces = np.argmax(np.abs(quats), axis=1)
+    x = quats[rows[:, None], _OTHERS[faces]]/quats[rows, faces][:, None]
+    u = np.arctan(x)*(4/np.pi)
+    ijk = np.clip(np.floor((u + 1)*(0.5*n)).astype(np.int64), 0, n - 1)
+    return faces*8**level + MortonEncode(ijk[:, 0], ijk[:, 1], ijk[:, 2], level)
+
+
+def FaceQuats(faces, u):
+    """FaceQuats returns the unit quaternions of the points of
+    coordinates u (N,3) on the faces (N,). Coordinates beyond [-1, 1]
+    (but in (-2, 2)) give points of the neighboring faces.
+    """
+    rows = np.arange(len(faces))
+    q = np.empty((len(faces), 4))
+    q[rows, faces] = 1
+    q[rows[:, None], _OTHERS[faces]] = np.tan(u*(np.pi/4))
+    return q/np.sqrt(np.sum(q*q, axis=1))[:, None]
+
+
+def CellCoordinates(indices, level):
+    """CellCoordinates returns the faces and the coordinates u of the
+    centers of the cells.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    i, j, k = MortonDecode(indices % 8**level, level)
+    u = (np.array([i, j, k]).T + 0.5)*(2.0/2**level) - 1
+    return indices//8**level, u
+
+
+def CellCenters(indices, level):
+    return FaceQuats(*CellCoordinates(indices, level))
+
+
+def NeighborIndices(indices, level):
+    """NeighborIndices returns the (N,6) indices of the cells adjacent to
+    the cells through their faces, crossing to the other faces of the
+    hypercube where needed.
+    """
+    faces, u = CellCoordinates(indices, level)
+    neighbors = np.empty((len(faces), 6), dtype=np.int64)
+    ## 1.5 cell widths away: inside the adjacent cell, and |u| < 2
+    step = 1.5*2.0/2**level/2
+    for axis in range(3):
+        for (s, sign) in enumerate([-1, 1]):
+            v = u.copy()
+            v[:, axis] += sign*step
+            neighbors[:, 2*axis + s] = CellIndices(FaceQuats(faces, v), level)
+    return neighbors
+
+
+def CellAngle(level):
+    """CellAngle returns the largest rotation angle between the center of
+    a cell of the given level and any point of the cell. Cells are
+    bounded by great spheres (planes in the gnomonic coordinates), hence
+    geodesically convex, so the largest distance to the center is reached
+    at a corner. By symmetry, the cells of one octant of a face suffice.
+    """
+    if level in _CELLANGLES:
+        return _CELLANGLES[level]
+    n = 2**level
+    half = np.arange(n//2, n)
+    i, j, k = [a.ravel() for a in np.meshgrid(half, half, half, indexing='ij')]
+    u = (np.array([i, j, k]).T + 0.5)*(2.0/n) - 1
+    faces = np.zeros(len(u), dtype=int)
+    centers = FaceQuats(faces, u)
+    angle = 0.0
+    for corner in np.array(np.meshgrid([-1, 1], [-1, 1], [-1, 1])).reshape(3, -1).T:
+        angle = max(angle, np.max(Lie.quatangle(centers, FaceQuats(faces, u + corner/float(n)))))
+    _CELLANGLES[level] = angle
+    return angle
+
+
+def Transformations(quats, translation):
+    transformations = np.zeros((len(quats), 4, 4))
+    transformations[:, :3, :3] = Lie.rotationfromquat(quats)
+    transformations[:, :3, 3] = translation
+    transformations[:, 3, 3] = 1
+    return transformations
+
+
+class SO3Map():
+    """SO3Map is the collision map of SO(3) described in the module
+       docstring.
+       Attributes:
+           level       -- the grid has NCells(level) cells
+           occupied    -- (ncells,) verdicts at the cell centers
+           boundary    -- (ncells,) cells whose queries go to the exact
+                          checker
+           translation -- translation of the robot in the transformations
+                          the map holds for
+    """
+
+    def __init__(self, level, occupied, boundary, translation=None):
+        assert(0 <= level <= MAXLEVEL)
+        self.level = level
+        self.occupied = np.asarray(occupied, dtype=bool)
+        self.boundary = np.asarray(boundary, dtype=bool)
+        assert(len(self.occupied) == NCells(level) == len(self.boundary))
+        self.translation = np.zeros(3) if translation is None else \
+                           np.asarray(translation, dtype=float)
+
+
+    @staticmethod
+    def Build(backend, level, robotradius=None, margin=1, translation=None,
+              blocksize=65536):
+        """Build checks the cells of the grid of the given level with
+        backend (any Collision.CollisionBackend) for the robot rotated
+        about translation. robotradius is the radius of a ball centered at
+        the robot's origin containing the robot (see the module
+        docstring for margin).
+        """
+        assert(0 <= level <= MAXLEVEL)
+        translation = np.zeros(3) if translation is None else \
+                      np.asarray(translation, dtype=float)
+        ncells = NCells(level)
+        occupied = np.zeros(ncells, dtype=bool)
+        certify = (robotradius is not None) and backend.HasClearance()
+        with Metrics.Timer('so3map.build'):
+            if certify:
+                uncertified = np.ones(ncells, dtype=bool)
+                active = np.arange(4)
+                for l in range(level + 1):
+                    clearances = np.concatenate\
+                    ([backend.Clearances(Transformations(CellCenters(active[b:b + blocksize], l),
+                                                         translation))
+                      for b in range(0, len(active), blocksize)] + [np.zeros(0)])
+                    ## rotating by at most CellAngle moves the robot by less
+                    certified = clearances > robotradius*CellAngle(l)
+                    d = 8**(level - l)
+                    if d == 1:
+                        uncertified[active[certified]] = False
+                    else:
+                        for c in active[certified]:
+                            uncertified[c*d:(c + 1)*d] = False
+                    if l == level:
+                        occupied[active] = clearances < 0
+                    else:
+                        active = (8*active[~certified][:, None] + np.arange(8)).ravel()
+            else:
+                for b in range(0, ncells, blocksize):
+                    indices = np.arange(b, min(b + blocksize, ncells))
+                    occupied[indices] = backend.CheckPoses\
+                    (Transformations(CellCenters(indices, level), translation))
+
+            ## cells with a neighbor of the other verdict, grown margin times
+            boundary = np.zeros(ncells, dtype=bool)
+            for b in range(0, ncells, blocksize):
+                indices = np.arange(b, min(b + blocksize, ncells))
+                neighbors = NeighborIndices(indices, level)
+                boundary[indices] = np.any(occupied[neighbors] != occupied[indices][:, None],
+                                           axis=1)
+            for it in range(margin):
+                grown = boundary.copy()
+                for b in range(0, ncells, blocksize):
+                    indices = np.arange(b, min(b + blocksize, ncells))
+                    grown[indices] |= np.any(boundary[NeighborIndices(indices, level)], axis=1)
+                boundary = grown
+            if certify:
+                boundary |= uncertified & ~occupied
+        return SO3Map(level, occupied, boundary, translation)
+
+
+    def Lookup(self, quats):
+        """Lookup returns the verdicts and the boundary flags of the cells
+        of the (N,4) quaternions.
+        """
+        indices = CellIndices(quats, self.level)
+        return self.occupied[indices], self.boundary[indices]
+
+
+    def BoundaryFraction(self):
+        return np.mean(self.boundary)
+
+
+    def OccupiedFraction(self):
+        return np.mean(self.occupied)
+
+
+    def Save(self, filename):
+        np.savez_compressed(filename, level=self.level, translation=self.translation,
+                            occupied=np.packbits(self.occupied),
+                            boundary=np.packbits(self.boundary))
+
+
+    @staticmethod
+    def Load(filename):
+        data = np.load(filename)
+        level = int(data['level'])
+        ncells = NCells(level)
+        return SO3Map(level, np.unpackbits(data['occupied'])[:ncells],
+                      np.unpackbits(data['boundary'])[:ncells], data['translation'])
+
+
+class SO3MapBackend(Collision.CollisionBackend):
+    """SO3MapBackend answers from an SO3Map the queries off its boundary
+       and whose translation is that of the map, and hands the others to
+       backend.
+       Attributes:
+           so3map, backend
+           nlookups, nfallbacks -- number of poses answered by each
+    """
+    BLOCKSIZE = 256
+
+    def __init__(self, so3map, backend, translationtolerance=1e-9):
+        self.so3map = so3map
+        self.backend = backend
+        self.translationtolerance = translationtolerance
+        self.nlookups = 0
+        self.nfallbacks = 0
+
+
+    def CheckPose(self, transformation):
+        return bool(self.CheckPoses(np.asarray(transformation)[None])[0])
+
+
+    def CheckPoses(self, transformations):
+        transformations = np.asarray(transformations, dtype=float)
+        if len(transformations) == 0:
+            return np.zeros(0, dtype=bool)
+        verdicts, exact = self.so3map.Lookup\
+        (Lie.quatfromrotationbatch(transformations[:, :3, :3]))
+        exact |= np.max(np.abs(transformations[:, :3, 3] - self.so3map.translation),
+                        axis=1) > self.translationtolerance
+        nfallbacks = np.count_nonzero(exact)
+        self.nlookups += len(transformations) - nfallbacks
+        self.nfallbacks += nfallbacks
+        Metrics.Count('so3map.lookups', len(transformations) - nfallbacks)
+        Metrics.Count('so3map.fallbacks', nfallbacks)
+        if nfallbacks > 0:
+            verdicts[exact] = self.backend.CheckPoses(transformations[exact])
+        return verdicts
+
+
+    def EnvironmentStamp(self):
+        return self.backend.EnvironmentStamp()
+
+
+    def HitRate(self):
+        nqueries = self.nlookups + self.nfallbacks
+        if nqueries == 0:
+            return 0.0
+        return float(self.nlookups)/nqueries
+
+
+    def Stats(self):
+        return {'lookups': self.nlookups, 'fallbacks': self.nfallbacks,
+                'hitrate': self.HitRate()}
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='builds the SO3Map of a body of an '
+                                     'OpenRAVE environment rotating about its origin')
+    parser.add_argument('envfilename')
+    parser.add_argument('output')
+    parser.add_argument('--level', type=int, default=5)
+    parser.add_argument('--margin', type=int, default=1)
+    parser.add_argument('--body', default=None)
+    args = parser.parse_args()
+    backend = Collision.OpenRAVEBackendFactory(args.envfilename, args.body)()
+    so3map = SO3Map.Build(backend, args.level, margin=args.margin)
+    so3map.Save(args.output)
+    print "{0} cells, {1:.1%} occupied, {2:.1%} boundary, cell angle {3:.4f} rad".format\
+    (NCells(args.level), so3map.OccupiedFraction(), so3map.BoundaryFraction(),
+     CellAngle(args.level))
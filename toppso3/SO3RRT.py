@@ -12,7 +12,12 @@ import os
 import lie
 
 import Utils
-import Heap
+import NearestNeighbor
+import Collision
+import EdgeMemo
+import PolyTraj
+import Metrics
+import SO3Map
 
 import TOPP
 from TOPP import TOPPpy
@@ -36,77 +41,156 @@ OK = 1
 # def quatfromuler
 # def quatfromvect
 
-class Config():
+class Config(object):
     """Attributes:
          q   -- quaternion vector
          qs  -- angular velocity
     """
+    __slots__ = ('q', 'qs')
+
     def __init__(self, q, qs = None, qss = None):
         self.q = q
-        if (qs == None):
+        if (qs is None):
             self.qs = zeros(3)
         else:
             self.qs = qs
 
 
-class Vertex():
+class Vertex(object):
     """Attributes:
          config     -- stores a Config obj
          parent     -- the parent for FW vertex, the child for BW vertex
-         trajstring -- a trajectory from its parent (or child)
+         index      -- its row in the arrays of its tree
+         duration   -- duration of the trajectory from its parent (or child)
          # sdmin      -- minimum reachable sd
          # sdmax      -- maximum reachable sd
          level      -- its level from the root of the tree (0 for the root)
+         validated  -- False until traj has been checked for collision
+                       (see RRTPlanner.lazy)
          # drawn      -- True if this vertex has been plotted via Vertex::Plot
+       The trajectory from its parent (or to its child), traj, is not
+       stored: it is interpolated again from the two configs when needed.
     """
+    __slots__ = ('config', 'vertextype', 'parent', 'index', 'duration', 'level',
+                 'validated')
+
     def __init__(self, config, vertextype = FW):
         self.config = config
         self.vertextype = vertextype
         self.parent = None # to be assigned when added to a tree
-        self.traj = '' # to be assigned when added to a tree
+        self.index = -1 # to be assigned when added to a tree
+        self.duration = None # to be assigned when added to a tree
         self.level = 0
+        self.validated = True
         # self.drawn = False 
 
 
+    @property
+    def traj(self):
+        if (self.parent is None):
+            return None
+        if (self.vertextype == FW):
+            (c_beg, c_end) = (self.parent.config, self.config)
+        else:
+            (c_beg, c_end) = (self.config, self.parent.config)
+        return lie.InterpolateSO3Quat(c_beg.q, c_end.q, c_beg.qs, c_end.qs, self.duration)
+
+
 class Tree():
     """Attributes:
          verticeslist -- stores all vertices added to the tree
          treetype     -- FW or BW    
+         index        -- nearest-neighbor index over the vertices' quaternions
+         size         -- number of vertices in the arrays below
+         quats        -- (N,4) quaternions of the vertices
+         velocities   -- (N,3) angular velocities of the vertices
+         parents      -- (N,) row of the parent of each vertex (-1 for the root)
+       Row i of the arrays (i < size) holds verticeslist[i]. Connect
+       may append to verticeslist a vertex already in the tree.
     """
     def __init__(self, treetype = FW, vroot = None):
-        if (vroot == None):
-            self.verticeslist = []
-        else:
-            self.verticeslist = [vroot]
+        self.verticeslist = []
+        self.size = 0
+        self.quats = np.zeros((64, 4))
+        self.velocities = np.zeros((64, 3))
+        self.parents = -np.ones(64, dtype=int)
+        self.index = NearestNeighbor.SO3Index()
+        if (vroot is not None):
+            self.AddVertex(None, vroot, None)
         self.treetype = treetype
 
+    def Grow(self):
+        self.quats = np.vstack([self.quats, np.zeros(self.quats.shape)])
+        self.velocities = np.vstack([self.velocities, np.zeros(self.velocities.shape)])
+        self.parents = np.hstack([self.parents, -np.ones(len(self.parents), dtype=int)])
+
+    def RebuildIndex(self):
+        self.index = NearestNeighbor.SO3Index()
+        for i in range(self.size):
+            self.index.Insert(self.quats[i])
+
+    def RemoveSubtree(self, vertex):
+        """RemoveSubtree removes vertex and its descendants (which are
+        stored after it) from the tree and returns the removed vertices.
+        """
+        parents = self.parents[:self.size].tolist()
+        removed = [False]*self.size
+        removed[vertex.index] = True
+        for i in range(vertex.index + 1, self.size):
+            removed[i] = (parents[i] >= 0) and removed[parents[i]]
+        removed = np.array(removed)
+        removedvertices = [self.verticeslist[i] for i in np.flatnonzero(removed)]
+        kept = np.flatnonzero(~removed)
+        newindices = np.cumsum(~removed) - 1
+        parents = self.parents[kept]
+        self.parents[:len(kept)] = np.where(parents >= 0, newindices[parents], -1)
+        self.quats[:len(kept)] = self.quats[kept]
+        self.velocities[:len(kept)] = self.velocities[kept]
+        self.verticeslist = [self.verticeslist[i] for i in kept]
+        for (i, v) in enumerate(self.verticeslist):
+            v.index = i
+        self.size = len(kept)
+        self.RebuildIndex()
+        return removedvertices
+
     def __len__(self):
         return len(self.verticeslist)
 
     def __getitem__(self, index):
         return self.verticeslist[index]        
                     
-    def AddVertex(self, parent, traj, vnew):
+    def AddVertex(self, parent, vnew, duration):
+        """AddVertex adds vnew, reached from parent (None for the root) by
+        a trajectory of the given duration.
+        """
         vnew.parent = parent
-        vnew.traj = traj
+        vnew.duration = duration
+        vnew.index = self.size
+        if (self.size == len(self.parents)):
+            self.Grow()
+        self.quats[self.size] = vnew.config.q
+        self.velocities[self.size] = vnew.config.qs
+        self.parents[self.size] = -1 if (parent is None) else parent.index
+        self.size += 1
         self.verticeslist.append(vnew)
+        self.index.Insert(vnew.config.q)
 
     def GenTrajList(self):
         trajlist = []
         if (self.treetype == FW):
             vertex = self.verticeslist[-1]
             parent = vertex.parent
-            while (vertex.parent != None):
+            while (vertex.parent is not None):
                 trajlist.append(vertex.traj)
                 vertex = parent
-                if (vertex.parent != None):
+                if (vertex.parent is not None):
                     parent = vertex.parent
             trajlist = trajlist[::-1]
         else:
             vertex = self.verticeslist[-1]
-            while (vertex.parent != None):
+            while (vertex.parent is not None):
                 trajlist.append(vertex.traj)
-                if (vertex.parent != None):
+                if (vertex.parent is not None):
                     vertex = vertex.parent
         return trajlist
     
@@ -116,18 +200,18 @@ class Tree():
             vertex = self.verticeslist[-1]
             RotationMatList.append(rotationMatrixFromQuat(vertex.config.q))
             parent = vertex.parent
-            while (vertex.parent != None):
+            while (vertex.parent is not None):
                 RotationMatList.append(rotationMatrixFromQuat(parent.config.q))
                 vertex = parent
-                if (vertex.parent != None):
+                if (vertex.parent is not None):
                     parent = vertex.parent
             RotationMatList =  RotationMatList[::-1]
         else:
             vertex = self.verticeslist[-1]
             RotationMatList.append(rotationMatrixFromQuat(vertex.config.q))                       
-            while (vertex.parent != None):
+            while (vertex.parent is not None):
                 RotationMatList.append(rotationMatrixFromQuat(vertex.parent.config.q))
-                if (vertex.parent != None):
+                if (vertex.parent is not None):
                     vertex = vertex.parent
         return RotationMatList
 
@@ -161,12 +245,46 @@ class RRTPlanner():
         
         #Openrave paras
         self.robot = robot
+        ## any Collision.CollisionBackend (e.g. a ParallelCollisionChecker)
+        if robot is None:
+            self.collisionchecker = None
+        else:
+            self.collisionchecker = Collision.OpenRAVEBackend(robot)
+        ## 'dense' or 'bisection' (see Collision.SweepIsInCollision)
+        self.sweepmode = 'dense'
+        ## radius of a ball centered at the robot's origin containing the
+        ## robot; enables the Lipschitz certification of 'bisection' sweeps
+        self.robotradius = None
+        ## if True, the trees grow checking only the new vertices and the
+        ## edges are swept only once they make a path (see ValidatePath)
+        self.lazy = False
+        self.connectingtree = None # tree Connect appended its vertex to
+        ## outcomes of the connections swept by ValidatePath (see EdgeMemo)
+        self.edgememo = EdgeMemo.EdgeMemo()
+        ## Connect tries at most connectattempts vertices of the other tree
+        ## (-1 for all of them), nearest first, within connectradius (None
+        ## for no limit); with connectmode 'greedy', it rather extends the
+        ## other tree toward the new vertex, at most connectattempts steps
+        ## (-1 for no limit)
+        self.connectattempts = -1
+        self.connectradius = None
+        self.connectmode = 'direct'
+        self.connectstats = dict(calls=0, reached=0, rejected=0, attempts=0, steps=0)
         
         self.discrtimestep = 1e-2 ## for collision checking, etc.
 
+    def SetRandomSeed(self, seed):
+        """SetRandomSeed makes the sampling of the planner reproducible.
+        Orientations are drawn from np.random (see lie.RandomQuat), which
+        is seeded as well.
+        """
+        self.RANDOM_NUMBER_GENERATOR = random.Random(seed)
+        np.random.seed(seed % 2**32)
+
     def __str__(self):
         ret = "Total running time :" + str(self.runningtime) + "sec.\n"
-        ret += "Total number of iterations :" + str(self.iterations)
+        ret += "Total number of iterations :" + str(self.iterations) + "\n"
+        ret += self.ConnectStatistics()
         return ret
 
     def RandomConfig(self):
@@ -188,8 +306,8 @@ class RRTPlanner():
             res = self.ExtendBW(c_rand)
         return res
 
-    def ExtendFW(self, c_rand):
-        nnindices = self.NearestNeighborIndices(c_rand, FW)
+    def ExtendFW(self, c_rand, custom_nn = 0):
+        nnindices = self.NearestNeighborIndices(c_rand, FW, custom_nn)
         for index in nnindices:
             v_near = self.treestart.verticeslist[index]
             q_beg = v_near.config.q
@@ -215,24 +333,26 @@ class RRTPlanner():
                 continue                        
             ## interpolate a trajectory
             #trajectory = lie.InterpolateSO3ZeroOmega(rotationMatrixFromQuat(q_beg),rotationMatrixFromQuat(q_end),self.INTERPOLATIONDURATION)
-            trajectory = lie.InterpolateSO3(rotationMatrixFromQuat(q_beg),rotationMatrixFromQuat(q_end),qs_beg,qs_end,self.INTERPOLATIONDURATION)
+            with Metrics.Timer('rrt.interpolate'):
+                trajectory = lie.InterpolateSO3Quat(q_beg,q_end,qs_beg,qs_end,self.INTERPOLATIONDURATION)
             ## check feasibility ( collision checking for the trajectory)
-            result = self.IsFeasibleTrajectory(trajectory, q_beg, FW)
+            result = self.CheckEdge(trajectory, q_beg, FW)
             if (result[0] == OK):
                   ## extension is now successful
                 v_new = Vertex(c_new, FW)
+                v_new.validated = not self.lazy
                 # v_new.sdmin = result[1]
                 # v_new.sdmax = result[2]
                 v_new.level = v_near.level + 1
-                self.treestart.AddVertex(v_near, trajectory, v_new)
+                self.treestart.AddVertex(v_near, v_new, self.INTERPOLATIONDURATION)
                 return STATUS
             else:
                 STATUS = TRAPPED  #trajecory doesnt satify the collision-free constraint
         return STATUS
 
-    def ExtendBW(self, c_rand):
+    def ExtendBW(self, c_rand, custom_nn = 0):
         # Implement NearestneiborIndices return the list of nodes in order of increasing distance
-        nnindices = self.NearestNeighborIndices(c_rand, BW)
+        nnindices = self.NearestNeighborIndices(c_rand, BW, custom_nn)
         for index in nnindices:
             v_near = self.treeend.verticeslist[index]
             q_end = v_near.config.q
@@ -259,16 +379,18 @@ class RRTPlanner():
 
             ## interpolate a trajectory
             #trajectory = lie.InterpolateSO3ZeroOmega(rotationMatrixFromQuat(q_beg),rotationMatrixFromQuat(q_end),self.INTERPOLATIONDURATION)
-            trajectory = lie.InterpolateSO3(rotationMatrixFromQuat(q_beg),rotationMatrixFromQuat(q_end),qs_beg,qs_end,self.INTERPOLATIONDURATION)
+            with Metrics.Timer('rrt.interpolate'):
+                trajectory = lie.InterpolateSO3Quat(q_beg,q_end,qs_beg,qs_end,self.INTERPOLATIONDURATION)
             ## check feasibility ( collision checking for the trajectory)
-            result = self.IsFeasibleTrajectory(trajectory, q_beg, BW)
+            result = self.CheckEdge(trajectory, q_beg, BW)
             if (result[0] == OK):
                 ## extension is now successful
                 v_new = Vertex(c_new, BW)
+                v_new.validated = not self.lazy
                 # v_new.sdmin = result[1]
                 # v_new.sdmax = result[2]
                 v_new.level = v_near.level + 1
-                self.treeend.AddVertex(v_near, trajectory, v_new)
+                self.treeend.AddVertex(v_near, v_new, self.INTERPOLATIONDURATION)
                 return STATUS
             else:
                 STATUS = TRAPPED  #trajecory doesnt satify the collision-free constraint
@@ -276,19 +398,139 @@ class RRTPlanner():
 
 
     def Connect(self):
+        """Connect tries to connect the tree just extended to the other
+        one. In lazy mode, the path made by the connection is then checked
+        by ValidatePath, and the connection only counts as reached if it
+        is valid.
+        """
+        greedy = (self.connectmode == 'greedy')
         if (np.mod(self.iterations - 1, 2) == FW):
             ## treestart has just been extended
-            res = self.ConnectBW()
+            res = self.ConnectGreedyBW() if greedy else self.ConnectBW()
         else:
             ## treeend has just been extended
-            res = self.ConnectFW()
+            res = self.ConnectGreedyFW() if greedy else self.ConnectFW()
+        if (res == REACHED) and not self.ValidatePath():
+            self.connectstats['rejected'] += 1
+            Metrics.Count('rrt.connect.rejected')
+            res = TRAPPED
+        self.connectstats['calls'] += 1
+        if (res == REACHED):
+            self.connectstats['reached'] += 1
+            Metrics.Count('rrt.connect.reached')
+        else:
+            Metrics.Count('rrt.connect.trapped')
         return res
+
+
+    def ConnectCandidates(self, c_test, treetype, n=0):
+        """ConnectCandidates returns the indices of the vertices of the
+        tree specified by treetype that Connect tries to join to c_test,
+        nearest first: at most n of them (by default, connectattempts and
+        nn), within connectradius. The kd-tree only visits the cells whose
+        lower bound on the distance can beat the candidates found.
+        """
+        if (treetype == FW):
+            tree = self.treestart
+        else:
+            tree = self.treeend
+        if (n == 0):
+            n = len(tree) if (self.connectattempts == -1) else self.connectattempts
+            if (self.nn != -1):
+                n = min(n, self.nn)
+        with Metrics.Timer('rrt.nearestneighbor'):
+            if self.connectradius is None:
+                return tree.index.KNearest(c_test.q, n)
+            return tree.index.Radius(c_test.q, self.connectradius)[:n]
+
+
+    def ConnectGreedy(self, treetype):
+        """ConnectGreedy extends the tree specified by treetype from its
+        nearest vertex toward the vertex just added to the other tree, as
+        in RRT-Connect, until it is within STEPSIZE of it and the two are
+        connected, an extension fails, or connectattempts steps are made.
+        """
+        if (treetype == FW):
+            tree = self.treestart
+            v_test = self.treeend.verticeslist[-1]
+        else:
+            tree = self.treeend
+            v_test = self.treestart.verticeslist[-1]
+        steps = 0
+        while True:
+            nnindices = self.ConnectCandidates(v_test.config, treetype, 1)
+            if len(nnindices) == 0:
+                return TRAPPED
+            if (self.Distance(tree.verticeslist[nnindices[0]].config, v_test.config)
+                <= self.STEPSIZE):
+                if (treetype == FW):
+                    return self.ConnectFW(nnindices)
+                else:
+                    return self.ConnectBW(nnindices)
+            if (steps == self.connectattempts):
+                return TRAPPED
+            steps += 1
+            self.connectstats['steps'] += 1
+            Metrics.Count('rrt.connect.steps')
+            if (treetype == FW):
+                status = self.ExtendFW(v_test.config, 1)
+            else:
+                status = self.ExtendBW(v_test.config, 1)
+            if (status == TRAPPED):
+                return TRAPPED
+
+
+    def ConnectGreedyFW(self):
+        return self.ConnectGreedy(FW)
+
+
+    def ConnectGreedyBW(self):
+        return self.ConnectGreedy(BW)
+
+
+    def LookupEdge(self, vstart, vend):
+        """LookupEdge returns the key in edgememo of the connection from
+        vstart to vend and its remembered outcome (None if unknown).
+        """
+        key = self.edgememo.Key(vstart, vend, [vstart.config.qs, vend.config.qs],
+                                self.INTERPOLATIONDURATION)
+        outcome = self.edgememo.Lookup(key)
+        if (outcome is None):
+            Metrics.Count('rrt.edgememo.misses')
+        else:
+            Metrics.Count('rrt.edgememo.hits')
+        return key, outcome
+
+
+    def ConnectStatistics(self):
+        """ConnectStatistics describes the outcomes of Connect so far.
+        """
+        stats = self.connectstats
+        failed = stats['calls'] - stats['reached']
+        return ("Connect : {0} calls, {1} failed ({2} rejected by ValidatePath), "
+                "{3} connections tried ({4:.2f} per call), {5} greedy steps, "
+                "edge memo hit rate {6:.1%}").format\
+                (stats['calls'], failed, stats['rejected'], stats['attempts'],
+                 stats['attempts']/float(max(stats['calls'], 1)), stats['steps'],
+                 self.edgememo.HitRate())
         
-    def ConnectFW(self):
+    def ConnectFW(self, nnindices=None):
         v_test = self.treeend.verticeslist[-1]
-        nnindices = self.NearestNeighborIndices(v_test.config, FW)
-        for index in nnindices:
-            v_near = self.treestart.verticeslist[index]
+        if nnindices is None:
+            nnindices = self.ConnectCandidates(v_test.config, FW)
+        if len(nnindices) == 0:
+            return TRAPPED
+        ## interpolate the rotations to all the neighbors at once
+        v_nears = [self.treestart.verticeslist[index] for index in nnindices]
+        ones = np.ones((len(v_nears), 1))
+        indices = [v_near.index for v_near in v_nears]
+        q_nears = self.treestart.quats[indices]
+        qs_nears = self.treestart.velocities[indices]
+        with Metrics.Timer('rrt.interpolate'):
+            coefficients = lie.InterpolateSO3QuatBatch\
+            (q_nears, ones*v_test.config.q, qs_nears, ones*v_test.config.qs,
+             self.INTERPOLATIONDURATION)
+        for (i, v_near) in enumerate(v_nears):
             
             q_beg = v_near.config.q
             qs_beg = v_near.config.qs
@@ -296,23 +538,39 @@ class RRTPlanner():
             q_end = v_test.config.q
             qs_end = v_test.config.qs
             
+            self.connectstats['attempts'] += 1
+            Metrics.Count('rrt.connect.attempts')
              ## interpolate a trajectory
             #trajectory = lie.InterpolateSO3ZeroOmega(rotationMatrixFromQuat(q_beg),rotationMatrixFromQuat(q_end),self.INTERPOLATIONDURATION)
-            trajectory = lie.InterpolateSO3(rotationMatrixFromQuat(q_beg),rotationMatrixFromQuat(q_end),qs_beg,qs_end,self.INTERPOLATIONDURATION)
+            trajectory = PolyTraj.PolyTraj(coefficients[i:i + 1],
+                                           [0, self.INTERPOLATIONDURATION]).ToTOPP()
              ## check feasibility ( collision checking for the trajectory)
-            result = self.IsFeasibleTrajectory(trajectory, q_beg, FW)
+            result = self.CheckEdge(trajectory, q_beg, FW)
             if (result[0] == 1):
                  ## conection is now successful
                 self.treestart.verticeslist.append(v_near)
+                self.connectingtree = FW
                 self.connectingtraj = trajectory
                 return REACHED
         return TRAPPED
 
-    def ConnectBW(self):
+    def ConnectBW(self, nnindices=None):
         v_test = self.treestart.verticeslist[-1]
-        nnindices = self.NearestNeighborIndices(v_test.config, BW)
-        for index in nnindices:
-            v_near = self.treeend.verticeslist[index]
+        if nnindices is None:
+            nnindices = self.ConnectCandidates(v_test.config, BW)
+        if len(nnindices) == 0:
+            return TRAPPED
+        ## interpolate the rotations to all the neighbors at once
+        v_nears = [self.treeend.verticeslist[index] for index in nnindices]
+        ones = np.ones((len(v_nears), 1))
+        indices = [v_near.index for v_near in v_nears]
+        q_nears = self.treeend.quats[indices]
+        qs_nears = self.treeend.velocities[indices]
+        with Metrics.Timer('rrt.interpolate'):
+            coefficients = lie.InterpolateSO3QuatBatch\
+            (ones*v_test.config.q, q_nears, ones*v_test.config.qs, qs_nears,
+             self.INTERPOLATIONDURATION)
+        for (i, v_near) in enumerate(v_nears):
             
             q_end = v_near.config.q
             qs_end = v_near.config.qs
@@ -320,33 +578,55 @@ class RRTPlanner():
             q_beg = v_test.config.q
             qs_beg = v_test.config.qs
             
+            self.connectstats['attempts'] += 1
+            Metrics.Count('rrt.connect.attempts')
             ## interpolate a trajectory
             #trajectory = lie.InterpolateSO3ZeroOmega(rotationMatrixFromQuat(q_beg),rotationMatrixFromQuat(q_end),self.INTERPOLATIONDURATION)
-            trajectory = lie.InterpolateSO3(rotationMatrixFromQuat(q_beg),rotationMatrixFromQuat(q_end),qs_beg,qs_end,self.INTERPOLATIONDURATION)
+            trajectory = PolyTraj.PolyTraj(coefficients[i:i + 1],
+                                           [0, self.INTERPOLATIONDURATION]).ToTOPP()
              ## check feasibility ( collision checking for the trajectory)
-            result = self.IsFeasibleTrajectory(trajectory, q_beg, BW)
+            result = self.CheckEdge(trajectory, q_beg, BW)
             if (result[0] == 1):
                  ## conection is now successful
                 self.treeend.verticeslist.append(v_near)
+                self.connectingtree = BW
                 self.connectingtraj = trajectory
                 return REACHED
         return TRAPPED
 
+    def EnableCollisionCache(self, maxsize=100000, rotationresolution=1e-3,
+                             translationresolution=1e-3):
+        """EnableCollisionCache puts a Collision.CachedCollisionBackend in
+        front of the current collision checker.
+        """
+        self.collisionchecker = Collision.CachedCollisionBackend\
+        (self.collisionchecker, maxsize, rotationresolution, translationresolution)
+        return self.collisionchecker
+
+
+    def EnableSO3Map(self, so3map):
+        """EnableSO3Map answers the collision queries from so3map (an
+        SO3Map.SO3Map built for this robot and environment), the current
+        collision checker handling the cells near obstacles.
+        """
+        self.collisionchecker = SO3Map.SO3MapBackend(so3map, self.collisionchecker)
+        return self.collisionchecker
+
+
     def IsFeasibleConfig(self, c_rand):
         """IsFeasibleConfig checks feasibility of the given Config object. 
         Feasibility conditions are to be determined by each RRT planner.
         """
-        env = self.robot.GetEnv()
-        with self.robot:
-            transformation = eye(4)
-            transformation[0:3,0:3] = rotationMatrixFromQuat(c_rand.q)
-            self.robot.SetTransform(transformation)
-            isincollision = (env.CheckCollision(self.robot, CollisionReport()))
-            if (isincollision):
-                # print "\t in-collision"
-                return False
-            else:
-                return True
+        transformation = eye(4)
+        transformation[0:3,0:3] = rotationMatrixFromQuat(c_rand.q)
+        Metrics.Count('collision.poses')
+        with Metrics.Timer('collision.pose'):
+            isincollision = self.collisionchecker.CheckPose(transformation)
+        if (isincollision):
+            # print "\t in-collision"
+            return False
+        else:
+            return True
 
 
     def IsFeasibleTrajectory(self, trajectory, q_beg, direction):
@@ -354,24 +634,13 @@ class RRTPlanner():
         Feasibility conditions are to be determined by each RRT planner.
         """
         ## check collision
-        env = self.robot.GetEnv()
-        #traj = Trajectory.PiecewisePolynomialTrajectory.FromString(trajectory)
         traj = trajectory
         R_beg =  rotationMatrixFromQuat(q_beg)
-        for s in np.arange(0, traj.duration, self.discrtimestep):
-            with self.robot:
-                transformation = eye(4)
-                transformation[0:3,0:3] = lie.EvalRotation(R_beg, traj, s)
-                self.robot.SetTransform(transformation)           
-                isincollision = (env.CheckCollision(self.robot, CollisionReport()))
-                # print  "s =", s, " ", isincollision
-            if (isincollision):
-                return [INCOLLISION]
-
-        with self.robot:
-            self.robot.SetTransform(transformation)
-            isincollision = (env.CheckCollision(self.robot, CollisionReport()))
-        if (isincollision):
+        svect = np.arange(0, traj.duration, self.discrtimestep)
+        transformations = Collision.TrajectoryTransformations(R_beg, traj, svect)
+        lipschitz = Collision.SweepLipschitz(self.discrtimestep, self.robotradius, traj)
+        if (Collision.SweepIsInCollision(self.collisionchecker, transformations,
+                                         self.sweepmode, lipschitz)):
             return [INCOLLISION]
         else:
             if (direction == FW):
@@ -380,36 +649,118 @@ class RRTPlanner():
                 return [OK]
 
 
-    def Run(self, allottedtime):
+    def CheckEdge(self, trajectory, q_beg, direction):
+        """CheckEdge is IsFeasibleTrajectory for the edges of the trees
+        and connections; in lazy mode, they are only swept by
+        ValidatePath.
+        """
+        if self.lazy:
+            return [OK]
+        return self.IsFeasibleTrajectory(trajectory, q_beg, direction)
+
+
+    def ValidatePath(self):
+        """ValidatePath sweeps the connection found by Connect and the
+        edges of the path not validated yet. If one is in collision, the
+        connection is undone, the vertex ending the failed tree edge is
+        removed with its subtree, and False is returned. Validated edges
+        are never swept again, nor are the connections in edgememo.
+        """
+        if not self.lazy:
+            return True
+        vstart = self.treestart.verticeslist[-1]
+        vend = self.treeend.verticeslist[-1]
+        edges = [] # (tree, vertex whose edge to its parent is checked)
+        for (tree, vertex) in [(self.treestart, vstart), (self.treeend, vend)]:
+            while vertex.parent is not None:
+                if not vertex.validated:
+                    edges.append((tree, vertex))
+                vertex = vertex.parent
+        failed = None
+        self.edgememo.Validate(self.collisionchecker.EnvironmentStamp())
+        key, outcome = self.LookupEdge(vstart, vend)
+        if (outcome is None):
+            Metrics.Count('rrt.lazy.sweeps')
+            outcome = self.IsFeasibleTrajectory(self.connectingtraj, vstart.config.q, FW)[0]
+            self.edgememo.Store(key, outcome)
+        if (outcome != OK):
+            failed = (None, None)
+        if failed is None:
+            for (tree, vertex) in edges:
+                Metrics.Count('rrt.lazy.sweeps')
+                ## an edge starts at the vertex closer to the start
+                if tree.treetype == FW:
+                    q_beg = vertex.parent.config.q
+                else:
+                    q_beg = vertex.config.q
+                if (self.IsFeasibleTrajectory(vertex.traj, q_beg, tree.treetype)[0] == OK):
+                    vertex.validated = True
+                else:
+                    failed = (tree, vertex)
+                    break
+        if failed is None:
+            return True
+        ## undo the connection, then drop the failed edge
+        if self.connectingtree == FW:
+            self.treestart.verticeslist.pop()
+        else:
+            self.treeend.verticeslist.pop()
+        self.connectingtraj = []
+        (tree, vertex) = failed
+        if tree is not None:
+            removed = tree.RemoveSubtree(vertex)
+            Metrics.Count('rrt.lazy.removed', len(removed))
+            self.edgememo.DiscardVertices(removed)
+        return False
+
+
+    def Run(self, allottedtime, shouldstop=None):
+        """Run grows the trees for at most allottedtime seconds. If given,
+        shouldstop is called at every iteration and stops the planner when
+        it returns True (see Portfolio).
+        """
         if (self.result):
-            print "The planner has already found a path."
+            Metrics.Log('The planner has already found a path.', None, Metrics.WARNING)
             return True
 
         t = 0.0
         prev_it = self.iterations
 
         while (t < allottedtime):
+            if (shouldstop is not None) and shouldstop():
+                break
             self.iterations += 1
-            # print "\033[1;34miteration:", self.iterations, "\033[0m"
+            Metrics.Count('rrt.iterations')
+            Metrics.Log('iteration : {0}'.format(self.iterations), 'blue', Metrics.DEBUG)
             t_begin = time.time()
             
             c_rand = self.RandomConfig()
-            if (self.Extend(c_rand) != TRAPPED):
-                print "\033[1;32mTree start : ", len(self.treestart.verticeslist), 
-                print "; Tree end : ", len(self.treeend.verticeslist), "\033[0m"
-                if (self.Connect() == REACHED):
-                    print "\033[1;32mPath found"
-                    print "    Total number of iterations:", self.iterations
+            with Metrics.Timer('rrt.extend'):
+                status = self.Extend(c_rand)
+            if (status != TRAPPED):
+                Metrics.Log('Tree start : {0}; Tree end : {1}'.format\
+                            (len(self.treestart.verticeslist),
+                             len(self.treeend.verticeslist)), 'green', Metrics.DEBUG)
+                with Metrics.Timer('rrt.connect'):
+                    status = self.Connect()
+                if (status == REACHED):
+                    Metrics.Log('Path found', 'green')
+                    Metrics.Log('    Total number of iterations : {0}'.format\
+                                (self.iterations), 'green')
                     t_end = time.time()
                     t += t_end - t_begin
                     self.runningtime += t
-                    print "    Total running time:", self.runningtime, "sec.", "\033[0m"
+                    Metrics.Log('    Total running time : {0} sec.'.format\
+                                (self.runningtime), 'green')
+                    Metrics.Log('    ' + self.ConnectStatistics(), 'green')
                     self.result = True
                     return True
             t_end = time.time()
             t += t_end - t_begin
             self.runningtime += t_end - t_begin
-        print "\033[1;31mAllotted time (", allottedtime, " sec.) is exhausted after", self.iterations - prev_it, "iterations.", "\033[0m"
+        Metrics.Log('Allotted time {0} sec. is exhausted after {1} iterations'.format\
+                    (allottedtime, self.iterations - prev_it), 'red')
+        Metrics.Log('    ' + self.ConnectStatistics(), 'red')
         return False
 
 
@@ -429,10 +780,7 @@ class RRTPlanner():
         else:
             tree = self.treeend
             nv = len(tree)
-            
-        distancelist = [self.Distance(c_rand, v.config) for v in tree.verticeslist]
-        distanceheap = Heap.Heap(distancelist)
-        
+
         if (custom_nn == 0):
             nn = self.nn
         else:
@@ -441,14 +789,15 @@ class RRTPlanner():
         if (nn == -1): #using all of the vertexes in the tree
             nn = nv
         else:
-            nn = min(self.nn, nv)
-        nnindices = [distanceheap.ExtractMin()[0] for i in range(nn)]
-        return nnindices
+            nn = min(nn, nv)
+        with Metrics.Timer('rrt.nearestneighbor'):
+            return tree.index.KNearest(c_rand.q, nn)
 
 
     def GenFinalTrajList(self):
         if (not self.result):
-            print "The Planner did not find any path from start to goal."
+            Metrics.Log('The Planner did not find any path from start to goal.', None,
+                        Metrics.WARNING)
             return []
         TrajectoryList = []
         TrajectoryList = self.treestart.GenTrajList()
@@ -462,7 +811,8 @@ class RRTPlanner():
     
     def GenFinalRotationMatrixList(self):
         if (not self.result):
-            print "The Planner did not find any path from start to goal."
+            Metrics.Log('The Planner did not find any path from start to goal.', None,
+                        Metrics.WARNING)
             return []
         
         RotationMatrixList = []
@@ -3,7 +3,13 @@ from pylab import *
 import numpy as np
 
 import lie as Lie
+import Collision
+import PolyTraj
+import LieRope
+import Metrics
+from Metrics import Colorize, colors
 import time
+import multiprocessing
 
 import string
 import StringIO
@@ -18,6 +24,19 @@ import matplotlib.pyplot as plt
 import random
 _RNG = random.SystemRandom()
 
+
+def SetRandomSeed(seed=None):
+    """SetRandomSeed makes the selection of shortcutting intervals
+    reproducible. With seed None, intervals are drawn from
+    random.SystemRandom again.
+    """
+    global _RNG
+    if seed is None:
+        _RNG = random.SystemRandom()
+    else:
+        _RNG = random.Random(seed)
+
+
 def QuatDistance(quat0, quat1): 
     rotationweight = 1
     innerProduct = np.dot(quat0, quat1)
@@ -47,18 +66,31 @@ def SE3Distance(X0, X1, c=None, d=None): # left invariance
         d = d
     return np.sqrt(c*(SO3Distance(R0, R1)**2) + d*(R3Distance(b0, b1)**2))
 
+
+def SE3QuatDistance(q0, qt0, q1, qt1, c=None, d=None):
+    """SE3QuatDistance is SE3Distance for poses given as a quaternion and
+    a translation.
+    """
+    if c is None:
+        c = 1
+    if d is None:
+        d = 1
+    theta = Lie.quatangle(q0, q1)
+    dt = np.asarray(qt1, dtype=float) - qt0
+    return np.sqrt(c*theta*theta + d*np.dot(dt, dt))
+
     
 ################## interpolate translation ####################################
 def TrajString3rdDegree(q_beg, q_end, qs_beg, qs_end, duration):
     trajectorystring = ''
     ndof = len(q_beg)
     
-    trajectorystring += "%f\n%d"%(duration, ndof)
+    trajectorystring += "%.17g\n%d"%(duration, ndof)
 
     for k in range(ndof):
         a, b, c, d = Utilities.Interpolate3rdDegree(q_beg[k], q_end[k], 
                                                     qs_beg[k], qs_end[k], duration)
-        trajectorystring += "\n%f %f %f %f"%(d, c, b, a)
+        trajectorystring += "\n%.17g %.17g %.17g %.17g"%(d, c, b, a)
     return trajectorystring
 
 
@@ -101,92 +133,251 @@ def ComputeSE3Constraints(SE3traj, taumax, fmax, discrtimestep, I=None, m=None):
     a = zeros((ndiscrsteps, 12))
     b = zeros((ndiscrsteps, 12))
     c = zeros((ndiscrsteps, 12))
-    transtraj, rtraj = TransRotTrajFromSE3Traj(SE3traj)
-    for i in range(ndiscrsteps):
-        #rotconstraints
-        t = i * discrtimestep
-        r = rtraj.Eval(t)
-        rd = rtraj.Evald(t)
-        rdd = rtraj.Evaldd(t)
-        nr = np.linalg.norm(r)
-        nr2 = nr*nr
-        nr3 = nr2*nr
-        nr4 = nr3*nr
-        nr5 = nr4*nr
-        R = Lie.skewfromvect(r)
-
-        snr = np.sin(nr)
-        cnr = np.cos(nr)
-        rcrd = np.cross(r,rd)
-        rdrd = np.dot(r,rd)
-
-        Amat =  eye(3) - (1 - cnr)/nr2*R + (nr - snr)/nr3*np.dot(R, R)
-        C1 = (nr - snr)/nr3 * np.cross(rd, rcrd)
-        C2 = -(2*cnr + nr*snr - 2)/nr4 * rdrd*rcrd
-        C3 = (3*snr - nr*cnr - 2*nr)/nr5 * rdrd*cross(r, rcrd)
-        C = C1 + C2 + C3
-
-        Ard = np.dot(Amat, rd)
-        if I is None:            
-            at = Ard
-            bt = np.dot(Amat, rdd) + C
-        else:
-            at = np.dot(I, Ard)
-            bt = (np.dot(I, np.dot(Amat, rdd)) + np.dot(I, C) + 
-                  np.cross(Ard, np.dot(I, Ard)))
-        
-        a[i, 3:6] = at
-        a[i, 9:12] = -at
-        b[i, 3:6] = bt
-        b[i, 9:12] = -bt
-        c[i, 3:6] = -taumax
-        c[i, 9:12] = -taumax
-
-        #transconstraints
-        td = transtraj.Evald(t)
-        tdd = transtraj.Evaldd(t)
-        if m is None:
-            at = td
-            bt = tdd
-
-        a[i, :3] = at
-        a[i, 6:9] = -at
-        b[i, :3] = bt
-        b[i, 6:9] = -bt
-        c[i, :3] = -fmax
-        c[i, 6:9] = -fmax
+    tvect = np.arange(ndiscrsteps) * discrtimestep
+    q, qd, qdd = Lie.EvalTrajBatch(SE3traj, tvect)
+
+    #rotconstraints
+    at, bt = Lie.SO3ConstraintTerms(q[:, 3:6], qd[:, 3:6], qdd[:, 3:6], I)
+    a[:, 3:6] = at
+    a[:, 9:12] = -at
+    b[:, 3:6] = bt
+    b[:, 9:12] = -bt
+    c[:, 3:6] = -taumax
+    c[:, 9:12] = -taumax
+
+    #transconstraints
+    td = qd[:, :3]
+    tdd = qdd[:, :3]
+    if m is None:
+        at = td
+        bt = tdd
+    else:
+        at = m*td
+        bt = m*tdd
+
+    a[:, :3] = at
+    a[:, 6:9] = -at
+    b[:, :3] = bt
+    b[:, 6:9] = -bt
+    c[:, :3] = -fmax
+    c[:, 6:9] = -fmax
     return a, b, c
 
 
 ######################## se3 traj collision checking ########################
-def CheckCollisionSE3Traj( robot, transtraj, rtraj, R_beg, checkcollisiontimestep=1e-3):
+def CheckCollisionSE3Traj( robot, transtraj, rtraj, R_beg, checkcollisiontimestep=1e-3,
+                           checker=None, sweepmode='dense', robotradius=None):
     """CheckCollisionSE3Traj accepts a robot and trans, rot trajectory
        object as its inputs.  (checkcollisiontimestep is set to 1e-3
        as a default value) It returns True if any config along the
-       traj is IN-COLLISION.
+       traj is IN-COLLISION. See Collision.SweepIsInCollision for
+       sweepmode; robotradius, the radius of a ball centered at the
+       robot's origin containing the robot, enables the Lipschitz
+       certification of the 'bisection' mode.
     """
-    env = robot.GetEnv()
-    for s in np.arange(0, transtraj.duration, checkcollisiontimestep):
-        with robot:
-            transformation = eye(4)
-            transformation[0:3, 0:3] = Lie.EvalRotation(R_beg, rtraj, s)
-            transformation[0:3, 3] = transtraj.Eval(s)
-            robot.SetTransform(transformation)           
-            isincollision = (env.CheckCollision(robot, orpy.CollisionReport()))
-            if (isincollision):
-                return True
-    with robot:
-        robot.SetTransform(transformation)
-        isincollision = (env.CheckCollision(robot, orpy.CollisionReport()))
-        if (isincollision):
-            return True
-        else:
-            return False
+    if checker is None:
+        checker = Collision.OpenRAVEBackend(robot)
+    svect = np.arange(0, transtraj.duration, checkcollisiontimestep)
+    transformations = Collision.TrajectoryTransformations(R_beg, rtraj, svect, transtraj)
+    lipschitz = Collision.SweepLipschitz(checkcollisiontimestep, robotradius, 
+                                         rtraj, transtraj)
+    return Collision.SweepIsInCollision(checker, transformations, sweepmode, lipschitz)
+
+
+def FindFirstCollisionSE3Traj(robot, transtraj, rtraj, R_beg, checkcollisiontimestep=1e-3,
+                              checker=None):
+    """FindFirstCollisionSE3Traj returns the first time at which the
+       robot is IN-COLLISION along the traj, or -1. checker is any
+       Collision.CollisionBackend (e.g. a ParallelCollisionChecker); by
+       default, the robot's OpenRAVE environment is used.
+    """
+    if checker is None:
+        checker = Collision.OpenRAVEBackend(robot)
+    svect = np.arange(0, transtraj.duration, checkcollisiontimestep)
+    transformations = Collision.TrajectoryTransformations(R_beg, rtraj, svect, transtraj)
+    i = checker.FindFirstCollision(transformations)
+    if i < 0:
+        return -1
+    return svect[i]
+
+
+########################## shortcut attempts ##################################
+## outcomes of a shortcut attempt
+SHORTCUT_OK = 0
+SHORTCUT_COLLISION = 1
+SHORTCUT_NOTRETIMABLE = 2
+SHORTCUT_NOTSHORTER = 3
+## names of the Metrics counters of the outcomes
+SHORTCUT_COUNTERS = {SHORTCUT_OK: 'shortcut.ok', SHORTCUT_COLLISION: 'shortcut.collision',
+                     SHORTCUT_NOTRETIMABLE: 'shortcut.notretimable',
+                     SHORTCUT_NOTSHORTER: 'shortcut.notshorter'}
+
+
+def SampleShortcutWindow(dur, meanduration, upperlimit, checkcollisiontimestep):
+    """SampleShortcutWindow draws a shortcutting interval (t0, t1), at
+    least two collision-checking steps long, of a trajectory of duration
+    dur. It returns t0, t1 and meanduration, which is set by the first
+    draw if it was 0.
+    """
+    t0 = _RNG.random()* dur
+    
+    if meanduration == 0:
+        meanduration = dur - t0
+        
+    T = _RNG.random()*min(meanduration,dur - t0)
+    t1 = t0 + T
+
+    while (T < 2.0*checkcollisiontimestep):
+        t0 = _RNG.random()*dur
+        if meanduration == 0:
+            meanduration = dur - t0
+            
+        T = _RNG.random()*min(meanduration, dur - t0)
+        t1 = t0 + T
+
+        if t1 > upperlimit:
+            t1 = upperlimit
+            if (t1 < t0):
+                temp = t0
+                t0 = t1
+                t1 = temp
+                T = t1 - t0
+    return t0, t1, meanduration
+
+
+def TrySO3Shortcut(robot, lietraj, t0, t1, taumax, vmax, inertia, discrtimestep,
+                   checker=None, sweepmode='dense', robotradius=None,
+                   checkcollisiontimestep=1e-2):
+    """TrySO3Shortcut interpolates lietraj between t0 and t1, checks the
+    interpolant for collision every checkcollisiontimestep and retimes it
+    with TOPP on the grid of step discrtimestep. It returns the outcome
+    (SHORTCUT_*), the retimed duration (-1 if not retimed) and the
+    retimed trajectory string (None unless SHORTCUT_OK).
+    """
+    T = t1 - t0
+    R_beg = lietraj.EvalRotation(t0)
+    R_end = lietraj.EvalRotation(t1)
+    omega0 = lietraj.EvalOmega(t0)
+    omega1 = lietraj.EvalOmega(t1)
+
+    with Metrics.Timer('shortcut.interpolate'):
+        shortcuttraj = Lie.InterpolateSO3(R_beg,R_end,omega0,omega1, T)
+    #check feasibility only for the new portion
+    if CheckCollisionTraj(robot, shortcuttraj, R_beg, checkcollisiontimestep,
+                          checker, sweepmode, robotradius):
+        return SHORTCUT_COLLISION, -1, None
+    if T < 2.0*discrtimestep: # TOPP needs at least two grid steps
+        return SHORTCUT_NOTRETIMABLE, -1, None
+
+    with Metrics.Timer('topp.setup'):
+        a,b,c = Lie.ComputeSO3Constraints(shortcuttraj, taumax, discrtimestep, inertia)
+        topp_inst = TOPP.QuadraticConstraints(shortcuttraj, discrtimestep, vmax, 
+                                              list(a), list(b), list(c))
+    x = topp_inst.solver
+    with Metrics.Timer('topp.solve'):
+        ret = x.RunComputeProfiles(1,1) 
+    if (ret != 1):
+        return SHORTCUT_NOTRETIMABLE, -1, None
+    ## check whether the new one has shorter duration
+    if not (x.resduration + 0.01 < T): #skip if not shorter than 0.01 s
+        return SHORTCUT_NOTSHORTER, x.resduration, None
+    with Metrics.Timer('topp.reparameterize'):
+        x.ReparameterizeTrajectory()
+        x.WriteResultTrajectory()
+    return SHORTCUT_OK, x.resduration, x.restrajectorystring
+
+
+def ApplySO3Shortcut(lietraj, t0, t1, restrajectorystring, constraintgrid=None):
+    """ApplySO3Shortcut returns lietraj whose segment (t0, t1) is replaced
+    by the trajectory returned by TrySO3Shortcut. lietraj may be a LieTraj
+    or a LieRope.LieRope (then spliced in O(log n)). The rows of the replaced
+    chunks are evicted from constraintgrid (a
+    ConstraintGrid.ConstraintGrid), if given.
+    """
+    if constraintgrid is not None:
+        with Metrics.Timer('shortcut.evict'):
+            constraintgrid.EvictInterval(lietraj, t0, t1)
+    with Metrics.Timer('shortcut.replace'):
+        shortcuttraj = PolyTraj.PolyTraj.FromString(restrajectorystring)
+        if isinstance(lietraj, LieRope.LieRope):
+            return lietraj.Replace(t0, t1, lietraj.EvalRotation(t0), shortcuttraj)
+        return ReplaceTrajectorySegment(lietraj, shortcuttraj.ToTOPP(), t0, t1)
+
+
+def TrySE3Shortcut(robot, transtraj, lietraj, t0, t1, taumax, fmax, vmax,
+                   discrtimestep, checker=None, sweepmode='dense', robotradius=None,
+                   checkcollisiontimestep=1e-2):
+    """TrySE3Shortcut is the SE(3) counterpart of TrySO3Shortcut.
+    """
+    T = t1 - t0
+    R_beg = lietraj.EvalRotation(t0)
+    R_end = lietraj.EvalRotation(t1)
+    omega0 = lietraj.EvalOmega(t0)
+    omega1 = lietraj.EvalOmega(t1)
+    t_beg = transtraj.Eval(t0)
+    t_end = transtraj.Eval(t1)
+    v_beg = transtraj.Evald(t0)
+    v_end = transtraj.Evald(t1)
+    
+    with Metrics.Timer('shortcut.interpolate'):
+        shortcutrtraj = Lie.InterpolateSO3(R_beg,R_end,omega0,omega1, T)
+        shortcuttranstraj = PolyTraj.Interpolate3rdDegree(t_beg, t_end, v_beg, v_end, T)
+    
+    #check feasibility only for the new portion
+    if CheckCollisionSE3Traj(robot, shortcuttranstraj, shortcutrtraj, R_beg,
+                             checkcollisiontimestep, checker, sweepmode, robotradius):
+        return SHORTCUT_COLLISION, -1, None
+    if T < 2.0*discrtimestep: # TOPP needs at least two grid steps
+        return SHORTCUT_NOTRETIMABLE, -1, None
+
+    with Metrics.Timer('topp.setup'):
+        shortcutse3traj = PolyTraj.PolyTraj.Stack\
+        ([shortcuttranstraj, PolyTraj.PolyTraj.FromTOPP(shortcutrtraj)])
+        a,b,c = ComputeSE3Constraints(shortcutse3traj, taumax, fmax, discrtimestep)
+        topp_inst = TOPP.QuadraticConstraints(shortcutse3traj.ToTOPP(), discrtimestep, 
+                                              vmax, list(a), list(b), list(c))
+    x = topp_inst.solver
+    with Metrics.Timer('topp.solve'):
+        ret = x.RunComputeProfiles(1,1) 
+    if (ret != 1):
+        return SHORTCUT_NOTRETIMABLE, -1, None
+    ## check whether the new one has shorter duration
+    if not (x.resduration + 0.1 < T): #skip if not shorter than 0.1 s
+        return SHORTCUT_NOTSHORTER, x.resduration, None
+    with Metrics.Timer('topp.reparameterize'):
+        x.ReparameterizeTrajectory()
+        x.WriteResultTrajectory()
+    return SHORTCUT_OK, x.resduration, x.restrajectorystring
+
+
+def ApplySE3Shortcut(transtraj, lietraj, t0, t1, restrajectorystring,
+                     constraintgrid=None):
+    """ApplySE3Shortcut returns transtraj and lietraj whose segments (t0,
+    t1) are replaced by the trajectory returned by TrySE3Shortcut (see
+    ApplySO3Shortcut for constraintgrid).
+    """
+    if constraintgrid is not None:
+        with Metrics.Timer('shortcut.evict'):
+            rtraj = PolyTraj.PolyTraj.Concatenate([PolyTraj.PolyTraj.FromTOPP(traj)
+                                                   for traj in lietraj.trajlist])
+            constraintgrid.EvictInterval(PolyTraj.PolyTraj.Stack\
+                                         ([PolyTraj.PolyTraj.FromTOPP(transtraj), rtraj]),
+                                         t0, t1)
+    with Metrics.Timer('shortcut.replace'):
+        TOPPed_shortcutse3traj = PolyTraj.PolyTraj.FromString(restrajectorystring)
+        TOPPed_shortcuttranstraj = TOPPed_shortcutse3traj.DofSlice(0, 3).ToTOPP()
+        TOPPed_shortcutrtraj = TOPPed_shortcutse3traj.DofSlice(3, 6).ToTOPP()
+        newlietraj = ReplaceTrajectorySegment(lietraj, TOPPed_shortcutrtraj , t0, t1)
+        newtranstraj = ReplaceTransTrajectorySegment\
+        (transtraj, TOPPed_shortcuttranstraj, t0, t1)
+    return newtranstraj, newlietraj
 
 
 ######################### SE3 shortcutting ##################################
 def SE3Shortcut(robot, taumax, fmax, vmax, se3traj, Rlist, maxiter, 
-                expectedduration=-1,  meanduration=0, upperlimit=-1, plotdura=None):
+                expectedduration=-1,  meanduration=0, upperlimit=-1, plotdura=None,
+                checker=None, sweepmode='dense', robotradius=None, constraintgrid=None,
+                discrtimestep=1e-2, checkcollisiontimestep=1e-2):
     if plotdura == 1:
         plt.axis([0, maxiter, 0, se3traj.duration])
         plt.ion()
@@ -207,8 +398,10 @@ def SE3Shortcut(robot, taumax, fmax, vmax, se3traj, Rlist, maxiter,
     integrationtimestep = 1e-2             
     reparamtimestep = 1e-2                  
     passswitchpointnsteps = 5                
-    discrtimestep = 1e-2                    
-    assert(dur > 10.0*discrtimestep)
+    ## discrtimestep is TOPP's grid step only (see
+    ## ConstraintGrid.ChooseDiscrTimeStep); checkcollisiontimestep is the
+    ## step of the collision sweeps and sets the shortest window
+    assert(dur > 10.0*checkcollisiontimestep)
     
     ncollision = 0
     nnotretimable = 0 
@@ -227,120 +420,52 @@ def SE3Shortcut(robot, taumax, fmax, vmax, se3traj, Rlist, maxiter,
         if (expectedduration > 0): # check, if newlietraj.duration is
                                    # short enough, stop SHORTCUTING
             if (se3traj.duration < expectedduration):
-                print Colorize('Trajectory duration is already too short', 'yellow')
-                print Colorize('Stop shortcutting', 'yellow')
+                Metrics.Log('Trajectory duration is already too short', 'yellow')
+                Metrics.Log('Stop shortcutting', 'yellow')
                 break
             
         if (dur < discrtimestep):
-            print "[Utils::Shortcut] trajectory duration is less than discrtimestep.\n"
+            Metrics.Log('[Utils::Shortcut] trajectory duration is less than discrtimestep.',
+                        None, Metrics.WARNING)
             break ## otherwise, this will cause an error in TOPP        
         
         ## select an interval for shortcutting
-        t0 = _RNG.random()* dur
-        
-        if meanduration == 0:
-            meanduration = dur - t0
-            
-        T = _RNG.random()*min(meanduration,dur - t0)
-        t1 = t0 + T
-
-        while (T < 2.0*discrtimestep):
-            t0 = _RNG.random()*dur
-            if meanduration == 0:
-                meanduration = dur - t0
-                
-            T = _RNG.random()*min(meanduration, dur - t0)
-            t1 = t0 + T
-
-            if t1 > upperlimit:
-                t1 = upperlimit
-                if (t1 < t0):
-                    temp = t0
-                    t0 = t1
-                    t1 = temp
-                    T = t1 - t0
+        t0, t1, meanduration = SampleShortcutWindow(dur, meanduration, upperlimit,
+                                                    checkcollisiontimestep)
 
         # print "\n\nShortcutting iteration", it + 1
         # print t0, t1, t1- t0       
-        # interpolate from t0 to t1
-        R_beg = lietraj.EvalRotation(t0)
-        R_end = lietraj.EvalRotation(t1)
-        omega0 = lietraj.EvalOmega(t0)
-        omega1 = lietraj.EvalOmega(t1)
-        shortcutrtraj = Lie.InterpolateSO3(R_beg,R_end,omega0,omega1, T)
-
-        t_beg = transtraj.Eval(t0)
-        t_end = transtraj.Eval(t1)
-        v_beg = transtraj.Evald(t0)
-        v_end = transtraj.Evald(t1)
-        
-        shortcuttranstraj = Trajectory.PiecewisePolynomialTrajectory.\
-        FromString(TrajString3rdDegree(t_beg, t_end, v_beg, v_end, T))
-        
-        shortcutse3traj = SE3TrajFromTransandSO3(shortcuttranstraj, shortcutrtraj)
-        #check feasibility only for the new portion
-        
-        isincollision = CheckCollisionSE3Traj(robot, shortcuttranstraj, 
-                                              shortcutrtraj, R_beg, discrtimestep)
-        if (not isincollision):
-            a,b,c = ComputeSE3Constraints(shortcutse3traj, taumax, fmax, discrtimestep)
-            topp_inst = TOPP.QuadraticConstraints(shortcutse3traj, discrtimestep, 
-                                                  vmax, list(a), list(b), list(c))
-            x = topp_inst.solver
-            ret = x.RunComputeProfiles(1,1) 
-            if (ret == 1):
-                x.resduration
-                ## check whether the new one has shorter duration
-                if (x.resduration + 0.1 < T): #skip if not shorter than 0.1 s
-                    x.ReparameterizeTrajectory()
-                    x.WriteResultTrajectory()
-                    TOPPed_shortcutse3traj = Trajectory.PiecewisePolynomialTrajectory.\
-                    FromString(x.restrajectorystring)
-                    
-                    TOPPed_shortcuttranstraj, TOPPed_shortcutrtraj = \
-                    TransRotTrajFromSE3Traj(TOPPed_shortcutse3traj)
-                    
-                    newlietraj = ReplaceTrajectorySegment\
-                    (lietraj, TOPPed_shortcutrtraj , t0, t1)
-                   
-                    newtranstraj = ReplaceTransTrajectorySegment\
-                    (transtraj, TOPPed_shortcuttranstraj, t0, t1)
-
-                    #####################################################
-                    newrtraj = Trajectory.PiecewisePolynomialTrajectory.FromString\
-                    (TrajStringFromTrajList(newlietraj.trajlist))
-                    
-                    newse3traj = SE3TrajFromTransandSO3(newtranstraj, newrtraj)
-
-                    Rlist = newlietraj.Rlist
-                    rtraj = newrtraj
-                    transtraj = newtranstraj
-                    lietraj = newlietraj
-                    se3traj = newse3traj
-                    
-                    dur = se3traj.duration
-
-                    #print "*******************************************"
-                    print 'Success at iteration {0}; Delta t = {1}'.format\
-                    (it + 1, t1 - t0 - x.resduration)
-                    
-                    attempt += 1
-                else:
-                    # print "Not shorter"
-                    nnotshorter += 1
-            else: 
-                # print "Not retimable"
-                nnotretimable += 1
+        with Metrics.Timer('shortcut.try'):
+            status, resduration, restrajectorystring = TrySE3Shortcut\
+            (robot, transtraj, lietraj, t0, t1, taumax, fmax, vmax, discrtimestep,
+             checker, sweepmode, robotradius, checkcollisiontimestep)
+        if (status == SHORTCUT_OK):
+            transtraj, lietraj = ApplySE3Shortcut(transtraj, lietraj, t0, t1,
+                                                  restrajectorystring, constraintgrid)
+            rtraj = Trajectory.PiecewisePolynomialTrajectory\
+            ([c for traj in lietraj.trajlist for c in traj.chunkslist])
+            se3traj = SE3TrajFromTransandSO3(transtraj, rtraj)
+            Rlist = lietraj.Rlist
+            dur = se3traj.duration
+
+            #print "*******************************************"
+            Metrics.Log('Success at iteration {0}; Delta t = {1}'.format\
+                        (it + 1, t1 - t0 - resduration), None)
+            attempt += 1
+        elif (status == SHORTCUT_NOTSHORTER):
+            nnotshorter += 1
+        elif (status == SHORTCUT_NOTRETIMABLE):
+            nnotretimable += 1
         else:
-            # print "Collision"
             ncollision += 1
+        Metrics.Count(SHORTCUT_COUNTERS[status])
 
-    print Colorize('Attempt: T = {0}, S = {1}, C = {2}, OK = {3}'.format\
-                       (nnotretimable, nnotshorter, ncollision, attempt), 'yellow')
-    print Colorize('New trajectory is {0} sec. shorter'.format\
-                       (originalduration - se3traj.duration), 'green')
+    Metrics.Log('Attempt: T = {0}, S = {1}, C = {2}, OK = {3}'.format\
+                (nnotretimable, nnotshorter, ncollision, attempt), 'yellow')
+    Metrics.Log('New trajectory is {0} sec. shorter'.format\
+                (originalduration - se3traj.duration), 'green')
     t_sc_end = time.time()
-    print Colorize('Running time = {0} sec.'.format(t_sc_end-t_sc_start), 'green')
+    Metrics.Log('Running time = {0} sec.'.format(t_sc_end-t_sc_start), 'green')
     
     return se3traj, Rlist
 
@@ -374,20 +499,8 @@ def ReplaceTransTrajectorySegment(originaltranstraj, transtrajsegment, t0,t1):
     ## remainderchunk1
     newpoly_list = []
     for p in originaltranstraj.chunkslist[i1].polynomialsvector:
-        ## perform variable changing of p(x) = a_n(x)^n + a_(n-1)(x)^(n-1) + ...
-        ## by x = y + rem1
-        
-        a = p.q ## coefficient vector with python convention (highest degree first)
-        ## a is a poly1d object
-        r = a.r ## polynomial roots
-        for i in range(len(r)):
-            r[i] = r[i] - rem1
-        b = np.poly1d(r, True) ## reconstruct a new polynomial from roots
-        ## b is a poly1d object
-        b = b*a.coeffs[0] ## multiply back by a_n *** this multiplication does not commute
-        
-        ## TOPP convention is weak-term-first
-        newpoly = Trajectory.Polynomial(b.coeffs.tolist()[::-1]) 
+        ## perform variable changing of p(x) by x = y + rem1
+        newpoly = Trajectory.Polynomial(PolyTraj.TaylorShift(p.coeff_list, rem1).tolist())
         newpoly_list.append(newpoly)
     remchunk1 = Trajectory.Chunk(originaltranstraj.chunkslist[i1].duration - rem1, 
                                  newpoly_list)
@@ -402,34 +515,43 @@ def ReplaceTransTrajectorySegment(originaltranstraj, transtrajsegment, t0,t1):
 
 
 ############################# traj collision checking ###############################
-def CheckCollisionTraj(robot, trajectory, R_beg, checkcollisiontimestep = 1e-3):
+def CheckCollisionTraj(robot, trajectory, R_beg, checkcollisiontimestep = 1e-3,
+                       checker=None, sweepmode='dense', robotradius=None):
     """CheckCollisionTraj accepts a robot and a trajectory object as its inputs.
        (checkcollisiontimestep is set to 1e-3 as a default value)
        It returns True if any config along the traj is IN-COLLISION.
+       See CheckCollisionSE3Traj for sweepmode and robotradius.
     """
-    env = robot.GetEnv()
-    traj = trajectory
-    for s in np.arange(0, traj.duration, checkcollisiontimestep):
-        with robot:
-            transformation = eye(4)
-            transformation[0:3,0:3] = Lie.EvalRotation(R_beg, traj, s)
-            robot.SetTransform(transformation)           
-            isincollision = (env.CheckCollision(robot, orpy.CollisionReport()))
-            #print  "s =", s, " ", isincollision
-            if (isincollision):
-                return True
-    with robot:
-        robot.SetTransform(transformation)
-        isincollision = (env.CheckCollision(robot, orpy.CollisionReport()))
-        if (isincollision):
-            return True
-        else:
-            return False
+    if checker is None:
+        checker = Collision.OpenRAVEBackend(robot)
+    svect = np.arange(0, trajectory.duration, checkcollisiontimestep)
+    transformations = Collision.TrajectoryTransformations(R_beg, trajectory, svect)
+    lipschitz = Collision.SweepLipschitz(checkcollisiontimestep, robotradius, trajectory)
+    return Collision.SweepIsInCollision(checker, transformations, sweepmode, lipschitz)
+
+
+def FindFirstCollisionTraj(robot, trajectory, R_beg, checkcollisiontimestep = 1e-3,
+                           checker=None):
+    """FindFirstCollisionTraj returns the first time at which the robot
+       is IN-COLLISION along the traj, or -1. checker is any
+       Collision.CollisionBackend (e.g. a ParallelCollisionChecker); by
+       default, the robot's OpenRAVE environment is used.
+    """
+    if checker is None:
+        checker = Collision.OpenRAVEBackend(robot)
+    svect = np.arange(0, trajectory.duration, checkcollisiontimestep)
+    transformations = Collision.TrajectoryTransformations(R_beg, trajectory, svect)
+    i = checker.FindFirstCollision(transformations)
+    if i < 0:
+        return -1
+    return svect[i]
 
 
 ############################# SHORTCUTING SO3 ############################
 def Shortcut(robot, taumax, vmax, lietraj,  maxiter, expectedduration=-1, 
-             meanduration=0, upperlimit=-1, inertia=None, trackingplot=None):
+             meanduration=0, upperlimit=-1, inertia=None, trackingplot=None,
+             checker=None, sweepmode='dense', robotradius=None, constraintgrid=None,
+             discrtimestep=1e-2, checkcollisiontimestep=1e-2):
     if trackingplot == 1:
         plt.axis([0, maxiter, 0, lietraj.duration])
         plt.ion()
@@ -440,6 +562,8 @@ def Shortcut(robot, taumax, vmax, lietraj,  maxiter, expectedduration=-1,
     
     t_sc_start = time.time()
     originalduration =  lietraj.duration
+    ## accepted shortcuts are spliced in O(log n)
+    lietraj = LieRope.LieRope.FromLieTraj(lietraj)
     #return shortcuted traj
     if upperlimit < 0:
         dur = lietraj.duration
@@ -452,15 +576,11 @@ def Shortcut(robot, taumax, vmax, lietraj,  maxiter, expectedduration=-1,
     integrationtimestep = 1e-2            
     reparamtimestep = 1e-2                
     passswitchpointnsteps = 5            
-    discrtimestep = 1e-2                 
+    ## discrtimestep is TOPP's grid step only (see
+    ## ConstraintGrid.ChooseDiscrTimeStep); checkcollisiontimestep is the
+    ## step of the collision sweeps and sets the shortest window
 
-    constraintsstring = str(discrtimestep)
-    constraintsstring += "\n" + ' '.join([str(v) for v in taumax])
-    if not(inertia is None):
-        for v in inertia:
-            constraintsstring += "\n" + ' '.join([str(i) for i in v])
-
-    assert(dur > 10.0*discrtimestep)
+    assert(dur > 10.0*checkcollisiontimestep)
     
 
     ncollision = 0
@@ -473,98 +593,256 @@ def Shortcut(robot, taumax, vmax, lietraj,  maxiter, expectedduration=-1,
             plt.draw()
         if (expectedduration > 0):
             if (lietraj.duration < expectedduration):
-                print Colorize('Trajectory duration is already too short', 'yellow')
-                print Colorize('Stop shortcutting', 'yellow')
+                Metrics.Log('Trajectory duration is already too short', 'yellow')
+                Metrics.Log('Stop shortcutting', 'yellow')
                 break
             
         if (dur < discrtimestep):
-            print "[Utils::Shortcut] trajectory duration is less than discrtimestep.\n"
+            Metrics.Log('[Utils::Shortcut] trajectory duration is less than discrtimestep.',
+                        None, Metrics.WARNING)
             break ## otherwise, this will cause an error in TOPP        
         
         ## select an interval for shortcutting
-        t0 = _RNG.random()* dur
-        
-        if meanduration == 0:
-            meanduration = dur - t0
-            
-        T = _RNG.random()*min(meanduration,dur - t0)
-        t1 = t0 + T
-
-        while (T < 2.0*discrtimestep):
-            t0 = _RNG.random()*dur
-            if meanduration == 0:
-                meanduration = dur - t0
-                
-            T = _RNG.random()*min(meanduration, dur - t0)
-            t1 = t0 + T
-
-            if t1 > upperlimit:
-                t1 = upperlimit
-                if (t1 < t0):
-                    temp = t0
-                    t0 = t1
-                    t1 = temp
-                    T = t1 - t0
+        t0, t1, meanduration = SampleShortcutWindow(dur, meanduration, upperlimit,
+                                                    checkcollisiontimestep)
 
         # print "\n\nShortcutting iteration", it + 1
         # print t0, t1, t1- t0       
-        # interpolate from t0 to t1
-        R_beg = lietraj.EvalRotation(t0)
-        R_end = lietraj.EvalRotation(t1)
-        omega0 = lietraj.EvalOmega(t0)
-        omega1 = lietraj.EvalOmega(t1)
-
-        shortcuttraj = Lie.InterpolateSO3(R_beg,R_end,omega0,omega1, T)
-        #check feasibility only for the new portion
-
-        isincollision = CheckCollisionTraj(robot, shortcuttraj, R_beg, discrtimestep)
-        if (not isincollision):
-            # a,b,c = Lie.ComputeSO3Constraints(shortcuttraj, taumax, discrtimestep)
-            abc = TOPPbindings.RunComputeSO3Constraints(str(shortcuttraj),
-                                                        constraintsstring)
-            a,b,c = Lie.Extractabc(abc)
-
-            topp_inst = TOPP.QuadraticConstraints(shortcuttraj, discrtimestep, vmax, 
-                                                  list(a), list(b), list(c))
-            x = topp_inst.solver
-            ret = x.RunComputeProfiles(1,1) 
-            if (ret == 1):
-                x.resduration
-                ## check whether the new one has shorter duration
-                if (x.resduration + 0.01 < T): #skip if not shorter than 0.3 s
-                    
-                    x.ReparameterizeTrajectory()
-                    x.WriteResultTrajectory()
-                    TOPPed_shortcuttraj = Trajectory.PiecewisePolynomialTrajectory.\
-                    FromString(x.restrajectorystring)
-
-                    newlietraj = ReplaceTrajectorySegment\
-                    (lietraj, TOPPed_shortcuttraj, t0, t1)  
-                    lietraj = newlietraj
-                    dur = lietraj.duration
-                    #print "*******************************************"
-                    print 'Success at iteration {0}; Delta t = {1}'.format\
-                    (it + 1, t1 - t0 - x.resduration)
-                    
-                    attempt += 1
-                else:
-                    # print "Not shorter"
-                    nnotshorter += 1
-            else: 
-                # print "Not retimable"
-                nnotretimable += 1
+        with Metrics.Timer('shortcut.try'):
+            status, resduration, restrajectorystring = TrySO3Shortcut\
+            (robot, lietraj, t0, t1, taumax, vmax, inertia, discrtimestep,
+             checker, sweepmode, robotradius, checkcollisiontimestep)
+        if (status == SHORTCUT_OK):
+            lietraj = ApplySO3Shortcut(lietraj, t0, t1, restrajectorystring,
+                                       constraintgrid)
+            dur = lietraj.duration
+            #print "*******************************************"
+            Metrics.Log('Success at iteration {0}; Delta t = {1}'.format\
+                        (it + 1, t1 - t0 - resduration), None)
+            attempt += 1
+        elif (status == SHORTCUT_NOTSHORTER):
+            nnotshorter += 1
+        elif (status == SHORTCUT_NOTRETIMABLE):
+            nnotretimable += 1
         else:
-            # print "Collision"
             ncollision += 1
+        Metrics.Count(SHORTCUT_COUNTERS[status])
 
-    print Colorize('Attempt: T = {0}, S = {1}, C = {2}, OK = {3}'.format\
-                       (nnotretimable, nnotshorter, ncollision, attempt), 'yellow')
-    print Colorize('New trajectory is {0} sec. shorter'.format\
-                       (originalduration - lietraj.duration), 'green')
+    Metrics.Log('Attempt: T = {0}, S = {1}, C = {2}, OK = {3}'.format\
+                (nnotretimable, nnotshorter, ncollision, attempt), 'yellow')
+    Metrics.Log('New trajectory is {0} sec. shorter'.format\
+                (originalduration - lietraj.duration), 'green')
     t_sc_end = time.time()
-    print Colorize('Running time = {0} sec.'.format(t_sc_end-t_sc_start), 'green')
+    Metrics.Log('Running time = {0} sec.'.format(t_sc_end-t_sc_start), 'green')
     
-    return lietraj
+    return lietraj.ToLieTraj()
+
+
+######################## parallel shortcutting ###############################
+## per-process state of the shortcutting workers
+_SHORTCUTCHECKER = None
+
+def _InitShortcutWorker(backendfactory):
+    global _SHORTCUTCHECKER
+    _SHORTCUTCHECKER = backendfactory()
+
+
+def _TryShortcutChunk(args):
+    """_TryShortcutChunk evaluates a list of windows against the trajectory
+    sent by ParallelShortcut or ParallelSE3Shortcut.
+    """
+    kind, payload, windows, params = args
+    Rlist, rsegments, transsegment = payload
+    lietraj = Lie.LieTraj(Rlist, [segment.ToTOPP() for segment in rsegments])
+    results = []
+    for (t0, t1) in windows:
+        if kind == 'SO3':
+            results.append(TrySO3Shortcut\
+                           (None, lietraj, t0, t1, params['taumax'], params['vmax'],
+                            params['inertia'], params['discrtimestep'],
+                            _SHORTCUTCHECKER, params['sweepmode'], params['robotradius'],
+                            params['checkcollisiontimestep']))
+        else:
+            results.append(TrySE3Shortcut\
+                           (None, transsegment, lietraj, t0, t1, params['taumax'],
+                            params['fmax'], params['vmax'], params['discrtimestep'],
+                            _SHORTCUTCHECKER, params['sweepmode'], params['robotradius'],
+                            params['checkcollisiontimestep']))
+    return results
+
+
+def MapTimeAfterShortcuts(t, shortcuts):
+    """MapTimeAfterShortcuts maps a time t of a trajectory to the
+    trajectory obtained by applying shortcuts, a list of disjoint (t0, t1,
+    newduration). Times inside a shortcut are mapped proportionally.
+    """
+    newt = t
+    for (t0, t1, newduration) in shortcuts:
+        if t >= t1:
+            newt -= (t1 - t0) - newduration
+        elif t > t0:
+            newt -= (t - t0)*(1 - newduration/(t1 - t0))
+    return newt
+
+
+def _ParallelShortcutLoop(kind, state, maxiter, params, backendfactory, nworkers,
+                          batchsize, expectedduration, meanduration, upperlimit,
+                          constraintgrid=None):
+    """_ParallelShortcutLoop runs speculative shortcutting in batches.
+
+    Every batch of windows is evaluated in the worker pool against the
+    current trajectory. Accepted shortcuts are then applied greedily by
+    decreasing time gain, skipping any that overlaps a window already
+    applied in this batch: the others start and end on unchanged parts of
+    the trajectory, so their collision and retiming checks still hold.
+    Skipped windows are mapped to the new trajectory and evaluated again
+    at the head of the next batch. Every evaluation counts as an
+    iteration.
+    """
+    if nworkers is None:
+        nworkers = multiprocessing.cpu_count()
+    if batchsize is None:
+        batchsize = 2*nworkers
+    checkcollisiontimestep = params['checkcollisiontimestep']
+    transtraj, lietraj = state
+    if upperlimit < 0:
+        upperlimit = lietraj.duration
+
+    stats = {'ok': 0, 'collision': 0, 'notretimable': 0, 'notshorter': 0,
+             'revalidated': 0, 'nbatches': 0}
+    pending = []
+    niterations = 0
+    pool = multiprocessing.Pool(nworkers, _InitShortcutWorker, (backendfactory,))
+    try:
+        while niterations < maxiter:
+            dur = lietraj.duration
+            if (expectedduration > 0) and (dur < expectedduration):
+                Metrics.Log('Trajectory duration is already too short', 'yellow')
+                break
+            if (dur < 10.0*checkcollisiontimestep):
+                break
+
+            nwindows = min(batchsize, maxiter - niterations)
+            windows = pending[:nwindows]
+            pending = pending[nwindows:]
+            stats['revalidated'] += len(windows)
+            while len(windows) < nwindows:
+                t0, t1, meanduration = SampleShortcutWindow\
+                (dur, meanduration, min(upperlimit, dur), checkcollisiontimestep)
+                windows.append((t0, t1))
+
+            payload = (lietraj.Rlist,
+                       [PolyTraj.PolyTraj.FromTOPP(traj) for traj in lietraj.trajlist],
+                       None if transtraj is None else PolyTraj.PolyTraj.FromTOPP(transtraj))
+            tasks = [(kind, payload, windows[i::nworkers], params) for i in range(nworkers)
+                     if len(windows[i::nworkers]) > 0]
+            with Metrics.Timer('shortcut.batch'):
+                taskresults = pool.map(_TryShortcutChunk, tasks)
+            results = [None]*len(windows)
+            for (i, taskresult) in enumerate(taskresults):
+                results[i::nworkers] = taskresult
+            niterations += len(windows)
+            stats['nbatches'] += 1
+
+            ## apply the best non-overlapping shortcuts
+            accepted = []
+            for ((t0, t1), (status, resduration, restrajectorystring)) in zip(windows, results):
+                if status == SHORTCUT_OK:
+                    accepted.append(((t1 - t0) - resduration, t0, t1, resduration,
+                                     restrajectorystring))
+                elif status == SHORTCUT_COLLISION:
+                    stats['collision'] += 1
+                elif status == SHORTCUT_NOTRETIMABLE:
+                    stats['notretimable'] += 1
+                else:
+                    stats['notshorter'] += 1
+                Metrics.Count(SHORTCUT_COUNTERS[status])
+            accepted.sort(key=lambda x: -x[0])
+            applied = []
+            skipped = []
+            for (gain, t0, t1, resduration, restrajectorystring) in accepted:
+                if all([(t1 <= s0) or (t0 >= s1) for (s0, s1, d, r) in applied]):
+                    applied.append((t0, t1, resduration, restrajectorystring))
+                else:
+                    skipped.append((t0, t1))
+            ## later windows first, so that the earlier ones keep their times
+            for (t0, t1, resduration, restrajectorystring) in sorted(applied, reverse=True):
+                if kind == 'SO3':
+                    lietraj = ApplySO3Shortcut(lietraj, t0, t1, restrajectorystring,
+                                               constraintgrid)
+                else:
+                    transtraj, lietraj = ApplySE3Shortcut(transtraj, lietraj, t0, t1,
+                                                          restrajectorystring, constraintgrid)
+                Metrics.Log('Success at batch {0}; Delta t = {1}'.format\
+                            (stats['nbatches'], t1 - t0 - resduration), None)
+            stats['ok'] += len(applied)
+
+            shortcuts = sorted([(t0, t1, d) for (t0, t1, d, r) in applied])
+            for (t0, t1) in skipped:
+                t0 = MapTimeAfterShortcuts(t0, shortcuts)
+                t1 = MapTimeAfterShortcuts(t1, shortcuts)
+                if (t1 - t0 >= 2.0*checkcollisiontimestep) and (t1 <= lietraj.duration):
+                    pending.append((t0, t1))
+    finally:
+        pool.close()
+        pool.join()
+
+    Metrics.Log('Attempt: T = {0}, S = {1}, C = {2}, OK = {3}, revalidated = {4}'.format\
+                (stats['notretimable'], stats['notshorter'], stats['collision'],
+                 stats['ok'], stats['revalidated']), 'yellow')
+    return (transtraj, lietraj), stats
+
+
+def ParallelShortcut(backendfactory, taumax, vmax, lietraj, maxiter, nworkers=None,
+                     batchsize=None, expectedduration=-1, meanduration=0,
+                     upperlimit=-1, inertia=None, sweepmode='dense', robotradius=None,
+                     discrtimestep=1e-2, constraintgrid=None, checkcollisiontimestep=1e-2):
+    """ParallelShortcut is a parallel version of Shortcut. Batches of
+    batchsize (by default 2*nworkers) windows are checked for collision
+    and retimed in nworkers processes, each owning the
+    Collision.CollisionBackend built by backendfactory (see
+    Collision.ParallelCollisionChecker). It returns the new LieTraj and
+    statistics on the attempts. As in Shortcut, the rows of the replaced
+    chunks are evicted from constraintgrid, if given.
+    """
+    t_sc_start = time.time()
+    params = {'taumax': taumax, 'vmax': vmax, 'inertia': inertia,
+              'discrtimestep': discrtimestep, 'sweepmode': sweepmode,
+              'robotradius': robotradius, 'checkcollisiontimestep': checkcollisiontimestep}
+    (transtraj, newlietraj), stats = _ParallelShortcutLoop\
+    ('SO3', (None, lietraj), maxiter, params, backendfactory, nworkers, batchsize,
+     expectedduration, meanduration, upperlimit, constraintgrid)
+    Metrics.Log('New trajectory is {0} sec. shorter'.format\
+                (lietraj.duration - newlietraj.duration), 'green')
+    Metrics.Log('Running time = {0} sec.'.format(time.time() - t_sc_start), 'green')
+    return newlietraj, stats
+
+
+def ParallelSE3Shortcut(backendfactory, taumax, fmax, vmax, se3traj, Rlist, maxiter,
+                        nworkers=None, batchsize=None, expectedduration=-1,
+                        meanduration=0, upperlimit=-1, sweepmode='dense',
+                        robotradius=None, discrtimestep=1e-2, constraintgrid=None,
+                        checkcollisiontimestep=1e-2):
+    """ParallelSE3Shortcut is the parallel version of SE3Shortcut (see
+    ParallelShortcut). It returns the new SE(3) trajectory, its rotation
+    list and statistics on the attempts.
+    """
+    t_sc_start = time.time()
+    params = {'taumax': taumax, 'fmax': fmax, 'vmax': vmax, 'inertia': None,
+              'discrtimestep': discrtimestep, 'sweepmode': sweepmode,
+              'robotradius': robotradius, 'checkcollisiontimestep': checkcollisiontimestep}
+    transtraj, rtraj = TransRotTrajFromSE3Traj(se3traj)
+    lietraj = Lie.SplitTraj(Rlist, rtraj)
+    (transtraj, lietraj), stats = _ParallelShortcutLoop\
+    ('SE3', (transtraj, lietraj), maxiter, params, backendfactory, nworkers, batchsize,
+     expectedduration, meanduration, upperlimit, constraintgrid)
+    rtraj = Trajectory.PiecewisePolynomialTrajectory\
+    ([c for traj in lietraj.trajlist for c in traj.chunkslist])
+    newse3traj = SE3TrajFromTransandSO3(transtraj, rtraj)
+    Metrics.Log('New trajectory is {0} sec. shorter'.format\
+                (se3traj.duration - newse3traj.duration), 'green')
+    Metrics.Log('Running time = {0} sec.'.format(time.time() - t_sc_start), 'green')
+    return newse3traj, lietraj.Rlist, stats
 
 
 ################## REPLACE TRAJECTORY SEGMENT SO3 #############################
@@ -614,20 +892,8 @@ def ReplaceTrajectorySegment(originallietraj, trajsegment, t0, t1):
     ic1, remc1 = originallietraj.trajlist[i1].FindChunkIndex(rem1)
     newpoly_list = []
     for p in originallietraj.trajlist[i1].chunkslist[ic1].polynomialsvector:
-        ## perform variable changing of p(x) = a_n(x)^n + a_(n-1)(x)^(n-1) + ...
-        ## by x = y + remc1
-        
-        a = p.q ## coefficient vector with python convention (highest degree first)
-        ## a is a poly1d object
-        r = a.r ## polynomial roots
-        for i in range(len(r)):
-            r[i] = r[i] - remc1
-        b = np.poly1d(r, True) ## reconstruct a new polynomial from roots
-        ## b is a poly1d object
-        b = b*a.coeffs[0] ## multiply back by a_n *** this multiplication does not commute
-        
-        ## TOPP convention is weak-term-first
-        newpoly = Trajectory.Polynomial(b.coeffs.tolist()[::-1])
+        ## perform variable changing of p(x) by x = y + remc1
+        newpoly = Trajectory.Polynomial(PolyTraj.TaylorShift(p.coeff_list, remc1).tolist())
         newpoly_list.append(newpoly)
     remchunk1 = Trajectory.Chunk\
     (originallietraj.trajlist[i1].chunkslist[ic1].duration - remc1, newpoly_list)
@@ -852,23 +1118,3 @@ def CheckIntersection(interval0, interval1):
     
     else:
         return True
-
-
-##################################################
-colors = dict()
-colors['black'] = 0
-colors['red'] = 1
-colors['green'] = 2
-colors['yellow'] = 3
-colors['blue'] = 4
-colors['magenta'] = 5
-colors['cyan'] = 6
-colors['white'] = 7
-def Colorize(string, color = 'white', bold = True):
-    newstring = '\033['
-    newstring += (str(int(bold)) + ';')
-    newstring += ('3' + str(colors[color]))
-    newstring += 'm'
-    newstring += string
-    newstring += '\033[0m' # reset the subsequent text back to normal
-    return newstring
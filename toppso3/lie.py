@@ -1,9 +1,13 @@
 # Interpolation in SO(3) following Park and Ravani
 import time
+import math
 
 import TOPP
 from TOPP import Trajectory
 import bisect
+
+import PolyTraj
+import LieKernels
 from pylab import *
 from numpy import *
 import pdb
@@ -30,6 +34,8 @@ class LieTraj():
         for t in trajlist:
             self.trajcumulateddurationslist.append(self.duration)
             self.duration += t.duration
+        self._coefficientslist = None # built on the first batch evaluation
+        self._quatlist = None # quaternions of Rlist, built on the first EvalQuat
 
     def FindTrajIndex(self, s):
         if s == 0:
@@ -43,6 +49,17 @@ class LieTraj():
         i, remainder = self.FindTrajIndex(s)
         return(dot(self.Rlist[i],expmat(self.trajlist[i].Eval(remainder))))
 
+    # Rotation as a quaternion [w,x,y,z], w >= 0
+    def EvalQuat(self,s):
+        i, remainder = self.FindTrajIndex(s)
+        q = quatmult(self.QuatList()[i],quatexp(self.trajlist[i].Eval(remainder)))
+        return quatcanonical(q)
+
+    def QuatList(self):
+        if self._quatlist is None:
+            self._quatlist = array([quatfromrotation(R) for R in self.Rlist])
+        return self._quatlist
+
     # Velocity in body frame
     def EvalOmega(self,s):
         i, remainder = self.FindTrajIndex(s)
@@ -56,7 +73,7 @@ class LieTraj():
         r = self.trajlist[i].Eval(remainder)
         rd = self.trajlist[i].Evald(remainder)
         rdd = self.trajlist[i].Evaldd(remainder)
-        return dot(Bmat(r),rdd) + dot(rd,tensordot(Ctensor(r),rd,([2],[0])))
+        return alpha(r,rd,rdd)
 
     # Torques
     def EvalTorques(self,s,I):
@@ -64,15 +81,74 @@ class LieTraj():
         r = self.trajlist[i].Eval(remainder)
         rd = self.trajlist[i].Evald(remainder)
         rdd = self.trajlist[i].Evaldd(remainder)
-        omega = dot(Amat(r),rd)
-        alpha =  dot(Bmat(r),rdd) + dot(rd,tensordot(Ctensor(r),rd,([2],[0])))
-        return dot(I,alpha) + cross(omega,dot(I,omega))
-
+        return tau(r,rd,rdd,I)
+
+    def FindTrajIndexBatch(self, svect):
+        """FindTrajIndexBatch is the array counterpart of FindTrajIndex. It
+        returns an array of traj indices and an array of remainders.
+        """
+        svect = asarray(svect, dtype=float)
+        svect = where(svect == 0, 1e-10, svect)
+        indices = searchsorted(self.trajcumulateddurationslist, svect, 'left') - 1
+        indices = clip(indices, 0, len(self.trajlist) - 1)
+        remainders = svect - asarray(self.trajcumulateddurationslist)[indices]
+        return indices, remainders
+
+    def EvalBatch(self, svect):
+        """EvalBatch returns the traj indices together with r, rd and rdd,
+        each of shape (N,3), evaluated at every time in svect.
+        """
+        if self._coefficientslist is None:
+            self._coefficientslist = [TrajCoefficients(t) for t in self.trajlist]
+        indices, remainders = self.FindTrajIndexBatch(svect)
+        n = len(indices)
+        r = zeros((n,3))
+        rd = zeros((n,3))
+        rdd = zeros((n,3))
+        for i in unique(indices):
+            mask = (indices == i)
+            r[mask], rd[mask], rdd[mask] = EvalTrajBatch\
+            (self.trajlist[i], remainders[mask], self._coefficientslist[i])
+        return indices, r, rd, rdd
+
+    def EvalRotationBatch(self, svect):
+        """EvalRotationBatch returns the (N,3,3) rotation matrices at svect.
+        """
+        indices, r, rd, rdd = self.EvalBatch(svect)
+        Rs = asarray(self.Rlist)[indices]
+        return einsum('nij,njk->nik', Rs, expmatbatch(r))
+
+    def EvalQuatBatch(self, svect):
+        """EvalQuatBatch returns the (N,4) quaternions (w >= 0) at svect.
+        """
+        indices, r, rd, rdd = self.EvalBatch(svect)
+        return quatcanonical(quatmult(self.QuatList()[indices], quatexp(r)))
+
+    def EvalOmegaBatch(self, svect):
+        """EvalOmegaBatch returns the (N,3) body angular velocities at svect.
+        """
+        indices, r, rd, rdd = self.EvalBatch(svect)
+        return LieKernels.omega(r, rd)
+
+    def EvalAlphaBatch(self, svect):
+        """EvalAlphaBatch returns the (N,3) body angular accelerations at svect.
+        """
+        indices, r, rd, rdd = self.EvalBatch(svect)
+        return LieKernels.alpha(r, rd, rdd)
+
+    def EvalTorquesBatch(self, svect, I):
+        """EvalTorquesBatch returns the (N,3) torques at svect for the
+        inertia matrix I.
+        """
+        indices, r, rd, rdd = self.EvalBatch(svect)
+        omegas, alphas = LieKernels.omegaalpha(r, rd, rdd)
+        Iomegas = dot(omegas, transpose(I))
+        return dot(alphas, transpose(I)) + cross(omegas, Iomegas)
     
     def Plot(self,dt=0.01,figstart=0,vmax=[],accelmax=[],taumax=[],I=None):
 
         tvect = arange(0, self.duration + dt, dt)
-        omegavect = array([self.EvalOmega(t) for t in tvect])
+        omegavect = self.EvalOmegaBatch(tvect)
         figure(figstart)
         clf()
         
@@ -87,7 +163,7 @@ class LieTraj():
         ylabel('Angular velocities (rad/s)')
         xlabel('Time (s)')
 
-        alphavect = array([self.EvalAlpha(t) for t in tvect])
+        alphavect = self.EvalAlphaBatch(tvect)
         figure(figstart+1)
         clf()
         plt.plot(tvect,alphavect[:,0],'--',label = '$\dot \omega^1$',linewidth = 2)
@@ -102,7 +178,7 @@ class LieTraj():
         xlabel('Time (s)')
 
         if not(I is None):
-            torquesvect = array([self.EvalTorques(t,I) for t in tvect])
+            torquesvect = self.EvalTorquesBatch(tvect,I)
             figure(figstart+2)
             clf()
             plt.plot(tvect,torquesvect[:,0],'--',label = r'$\tau^1$',linewidth = 2)
@@ -171,72 +247,82 @@ def skewfromvect(r):
 def vectfromskew(R):
     return array([R[2,1],R[0,2],R[1,0]])
 
+def skewfromvectbatch(rs):
+    Rs = zeros((len(rs),3,3))
+    Rs[:,0,1] = -rs[:,2]
+    Rs[:,0,2] = rs[:,1]
+    Rs[:,1,0] = rs[:,2]
+    Rs[:,1,2] = -rs[:,0]
+    Rs[:,2,0] = -rs[:,1]
+    Rs[:,2,1] = rs[:,0]
+    return Rs
+
+## The coefficients of the closed-form expressions below are those of
+## LieKernels, which switches to their Taylor series at small angles.
 def expmat(r):
     nr = linalg.norm(r)
-    if(nr<=1e-10):
-        return eye(3)
+    a, b = LieKernels.coefficients(nr, 'ab')
     R = skewfromvect(r)
-    return eye(3) + sin(nr)/nr*R + (1-cos(nr))/(nr*nr)*dot(R,R)
+    return eye(3) + a*R + b*dot(R,R)
+
+def expmatbatch(rs):
+    """expmatbatch is the array counterpart of expmat for rs of shape (N,3).
+    """
+    return LieKernels.expmat(rs)
 
 def logvect(R):
-    if(abs(trace(R)+1)>1e-10):
-        if(linalg.norm(R-eye(3))<=1e-10):
-            return zeros(3)
-        else:
-            phi = arccos((trace(R)-1)/2)
-            return vectfromskew(phi/(2*sin(phi))*(R-R.T))
-    else:
-        eigval, eigvect = linalg.eig(R)
-        for (i,val) in enumerate(eigval):
-            if abs((val-1)) <= 1e-10:
-                return pi*real(eigvect[:,i])
+    return LieKernels.logvect(asarray(R, dtype=float)[None])[0]
                 
 def Amat(r):
     nr = linalg.norm(r)
-    if(nr<=1e-10):
-        return eye(3)
+    b, c = LieKernels.coefficients(nr, 'bc')
     R = skewfromvect(r)
-    return eye(3) - (1-cos(nr))/(nr*nr)*R + (nr-sin(nr))/(nr*nr*nr)*dot(R,R)
+    return eye(3) - b*R + c*dot(R,R)
+
+def Amatbatch(rs):
+    """Amatbatch is the array counterpart of Amat for rs of shape (N,3).
+    """
+    return LieKernels.Amat(rs)
 
 def Bmat0(r):
     nr = linalg.norm(r)
+    b, c = LieKernels.coefficients(nr, 'bc')
     R = skewfromvect(r)
-    return eye(3) + (1-cos(nr))/(nr*nr)*R + (nr-sin(nr))/(nr*nr*nr)*dot(R,R)
+    return eye(3) + b*R + c*dot(R,R)
 
 def Bmat(r):
-    nr = linalg.norm(r)
-    R = skewfromvect(r)
-    return eye(3) - (1-cos(nr))/(nr*nr)*R + (nr-sin(nr))/(nr*nr*nr)*dot(R,R)
+    return Amat(r)
 
 def Ctensor(r):
     nr = linalg.norm(r)
-    nr2 = nr*nr
-    nr3 = nr2*nr
-    nr4 = nr3*nr
-    nr5 = nr4*nr
+    c, d, e = LieKernels.coefficients(nr, 'cde')
     R = skewfromvect(r)
-    C1 = -(nr-sin(nr))/nr3 * dot(Eps,R)
-    C2 = -(2*cos(nr)+nr*sin(nr)-2)/nr4 * TensorProd(r,R)
-    C3 = (3*sin(nr)-nr*cos(nr) - 2*nr)/nr5 * TensorProd(r,dot(R,R))
+    C1 = -c * dot(Eps,R)
+    C2 = d * TensorProd(r,R)
+    C3 = e * TensorProd(r,dot(R,R))
     return C1+C2+C3
 
 def Cterm(r,rd):
     nr = linalg.norm(r)
-    nr2 = nr*nr
-    nr3 = nr2*nr
-    nr4 = nr3*nr
-    nr5 = nr4*nr
-    C1 = (nr-sin(nr))/nr3 * cross(rd,cross(r,rd))
-    C2 = -(2*cos(nr)+nr*sin(nr)-2)/nr4 * dot(r,rd)*cross(r,rd)
-    C3 = (3*sin(nr)-nr*cos(nr) - 2*nr)/nr5 * dot(r,rd)*cross(r,cross(r,rd))
+    c, d, e = LieKernels.coefficients(nr, 'cde')
+    C1 = c * cross(rd,cross(r,rd))
+    C2 = d * dot(r,rd)*cross(r,rd)
+    C3 = e * dot(r,rd)*cross(r,cross(r,rd))
     return C1+C2+C3
+
+
+def Ctermbatch(rs,rds):
+    """Ctermbatch is the array counterpart of Cterm for rs and rds of
+    shape (N,3).
+    """
+    return LieKernels.Cterm(rs, rds)
    
 
 def omega(r,rd):
     return dot(Amat(r),rd)
 
 def alpha(r,rd,rdd):
-    return dot(Bmat(r),rdd) + dot(rd,tensordot(Ctensor(r),rd,([2],[0])))
+    return dot(Bmat(r),rdd) + Cterm(r,rd)
 
 def tau(r,rd,rdd,I):
     omega0 = omega(r,rd)
@@ -244,27 +330,26 @@ def tau(r,rd,rdd,I):
 
 
 def InterpolateSO3(R0,R1,omega0,omega1,T):
+    return InterpolateSO3FromVect(logvect(dot(R0.T,R1)),omega0,omega1,T)
 
-    r1 = logvect(dot(R0.T,R1))
-    u = linalg.solve(Amat(r1),omega1*T)
 
+def InterpolateSO3Quat(q0,q1,omega0,omega1,T):
+    """InterpolateSO3Quat is InterpolateSO3 for the orientations given as
+    quaternions, without building rotation matrices.
+    """
+    return InterpolateSO3FromVect(quatlog(quatmult(quatconj(q0),q1)),omega0,omega1,T)
+
+
+def InterpolateSO3FromVect(r1,omega0,omega1,T):
+    """InterpolateSO3FromVect returns the trajectory r(t) in so(3) of
+    InterpolateSO3, given r1 = logvect(dot(R0.T,R1)).
+    """
+    u = linalg.solve(Amat(r1),omega1*T)
     c = omega0*T
-    M = array([[1,0,0,1,0,0],
-               [0,1,0,0,1,0],
-               [0,0,1,0,0,1],
-               [3,0,0,2,0,0],
-               [0,3,0,0,2,0],
-               [0,0,3,0,0,2]])
-    y = array([r1[0]-c[0],
-               r1[1]-c[1],
-               r1[2]-c[2],
-               u[0]-c[0],
-               u[1]-c[1],
-               u[2]-c[2]])
-
-    x = linalg.solve(M,y)
-    a = x[:3]
-    b = x[3:]
+    ## r(t) = a (t/T)^3 + b (t/T)^2 + c t/T with a + b = r1 - c and
+    ## 3a + 2b = u - c, solved in closed form
+    a = (u - c) - 2*(r1 - c)
+    b = 3*(r1 - c) - (u - c)
     T2 = T*T
     T3 = T2*T
     polylist = []
@@ -273,11 +358,103 @@ def InterpolateSO3(R0,R1,omega0,omega1,T):
         polylist.append(Trajectory.Polynomial([0,c[i]/T,b[i]/T2,a[i]/T3]))
     chunk = Trajectory.Chunk(T,polylist)
     return Trajectory.PiecewisePolynomialTrajectory([chunk])
-    
+
+
+def InterpolateSO3Batch(R0s,R1s,omega0s,omega1s,Ts):
+    """InterpolateSO3Batch is the array counterpart of InterpolateSO3 for
+    N tuples (R0, R1, omega0, omega1, T) (T may be a scalar). It returns
+    the (N,3,4) coefficients of the trajectories in so(3) (see
+    InterpolateSO3Coefficients).
+    """
+    R0s = asarray(R0s, dtype=float)
+    r1s = LieKernels.logvect(einsum('nji,njk->nik', R0s, R1s))
+    return InterpolateSO3Coefficients(r1s,omega0s,omega1s,Ts)
+
+
+def InterpolateSO3QuatBatch(q0s,q1s,omega0s,omega1s,Ts):
+    """InterpolateSO3QuatBatch is InterpolateSO3Batch for the orientations
+    given as (N,4) arrays of quaternions.
+    """
+    return InterpolateSO3Coefficients(quatlog(quatmult(quatconj(q0s),q1s)),
+                                      omega0s,omega1s,Ts)
+
+
+def InterpolateSO3Coefficients(r1s,omega0s,omega1s,Ts):
+    """InterpolateSO3Coefficients returns the (N,3,4) weak-term-first
+    coefficients of the N trajectories of InterpolateSO3FromVect, with one
+    batched solve for the Amat systems. The i-th trajectory is
+    PolyTraj.PolyTraj(coefficients[i:i+1], [0, Ts[i]]).
+    """
+    r1s = asarray(r1s, dtype=float)
+    Ts = asarray(Ts, dtype=float)*ones(len(r1s))
+    us = linalg.solve(LieKernels.Amat(r1s),
+                      (asarray(omega1s, dtype=float)*Ts[:,None])[:,:,None])[:,:,0]
+    cs = asarray(omega0s, dtype=float)*Ts[:,None]
+    a = (us - cs) - 2*(r1s - cs)
+    b = 3*(r1s - cs) - (us - cs)
+    coefficients = zeros((len(r1s), 3, 4))
+    coefficients[:,:,1] = cs/Ts[:,None]
+    coefficients[:,:,2] = b/(Ts*Ts)[:,None]
+    coefficients[:,:,3] = a/(Ts*Ts*Ts)[:,None]
+    return coefficients
 
 
 def EvalRotation(R0,traj,t):
     return(dot(R0,expmat(traj.Eval(t))))
+
+
+def EvalRotationBatch(R0,traj,svect):
+    """EvalRotationBatch is the array counterpart of EvalRotation. It
+    returns the (N,3,3) rotation matrices at every time in svect.
+    """
+    r, rd, rdd = EvalTrajBatch(traj, svect)
+    return einsum('ij,njk->nik', R0, expmatbatch(r))
+
+
+def SpeedBound(traj):
+    """SpeedBound returns an upper bound on the norm of the derivative of
+    a PiecewisePolynomialTrajectory, computed from its coefficients.
+    For a trajectory r in so(3), it also bounds the angular velocity
+    since the norm of Amat(r) never exceeds one.
+    """
+    starts, coeffs = TrajCoefficients(traj)
+    durations = diff(append(starts, traj.duration))
+    degree = coeffs.shape[2] - 1
+    bound = zeros(coeffs.shape[:2])
+    for k in range(1, degree + 1):
+        bound += k*abs(coeffs[:,:,k])*(durations**(k - 1))[:,None]
+    return max(linalg.norm(bound, axis=1))
+
+
+def TrajCoefficients(traj):
+    """TrajCoefficients returns the cumulated chunk durations of a
+    PiecewisePolynomialTrajectory (or a PolyTraj) and its polynomial
+    coefficients (weak-term-first, zero-padded to the highest degree) as
+    an array of shape (nchunks, ndof, degree + 1).
+    """
+    if not isinstance(traj, PolyTraj.PolyTraj):
+        traj = PolyTraj.PolyTraj.FromTOPP(traj)
+    return traj.breakpoints[:-1], traj.coefficients
+
+
+EvalCoefficients = PolyTraj.EvalCoefficients
+
+
+def EvalTrajBatch(traj, svect, coefficients=None):
+    """EvalTrajBatch evaluates a PiecewisePolynomialTrajectory and its
+    first two derivatives at every time in svect. coefficients is the
+    output of TrajCoefficients, if already available.
+    """
+    if coefficients is None:
+        coefficients = TrajCoefficients(traj)
+    starts, coeffs = coefficients
+    svect = asarray(svect, dtype=float)
+    svect = where(svect == 0, 1e-10, svect)
+    indices = clip(searchsorted(starts, svect, 'left') - 1, 0, len(starts) - 1)
+    x = svect - starts[indices]
+    c = coeffs[indices]
+    return (EvalCoefficients(c, x), EvalCoefficients(c, x, 1),
+            EvalCoefficients(c, x, 2))
     
 
 def TensorProd(a,A):
@@ -301,50 +478,162 @@ def ComputeSO3Torques(rtraj, I = None, dt=0.01):
     return tvect,array(tauvect)
     
 
+def SO3ConstraintTerms(r, rd, rdd, I = None):
+    """SO3ConstraintTerms returns the (N,3) arrays at and bt such that the
+    torques along a path are at*sdd + bt*sd^2, given r, rd and rdd of
+    shape (N,3) sampled on the discretization grid.
+    """
+    Ard, alphas = LieKernels.omegaalpha(r, rd, rdd)
+    if I is None:
+        at = Ard
+        bt = alphas
+    else:
+        IT = transpose(I)
+        at = dot(Ard, IT)
+        bt = dot(alphas, IT) + cross(Ard, dot(Ard, IT))
+    return at, bt
+
+
 def ComputeSO3Constraints(rtraj, taumax, discrtimestep, I = None):
     ndiscrsteps = int((rtraj.duration + 1e-10) / discrtimestep) + 1
     a = zeros((ndiscrsteps,6))
     b = zeros((ndiscrsteps,6))
     c = zeros((ndiscrsteps,6))
-    for i in range(ndiscrsteps):
-        t = i * discrtimestep
-        r = rtraj.Eval(t)
-        rd = rtraj.Evald(t)
-        rdd = rtraj.Evaldd(t)
-        nr = linalg.norm(r)
-        nr2 = nr*nr
-        nr3 = nr2*nr
-        nr4 = nr3*nr
-        nr5 = nr4*nr
-        R = skewfromvect(r)
-
-        snr = sin(nr)
-        cnr = cos(nr)
-        rcrd = cross(r,rd)
-        rdrd = dot(r,rd)
-        
-        Amat =  eye(3) - (1-cnr)/nr2*R + (nr-snr)/nr3*dot(R,R)
-        C1 = (nr-snr)/nr3 * cross(rd,rcrd)
-        C2 = -(2*cnr+nr*snr-2)/nr4 * rdrd*rcrd
-        C3 = (3*snr-nr*cnr - 2*nr)/nr5 * rdrd*cross(r,rcrd)
-        C = C1+C2+C3
-
-        Ard = dot(Amat,rd)
-        if I is None:            
-            at = Ard
-            bt = dot(Amat,rdd) + C
-        else:
-            at = dot(I,Ard)
-            bt = dot(I,dot(Amat,rdd)) + dot(I,C) + cross(Ard,dot(I,Ard))
-        
-        a[i,:3] = at
-        a[i,3:] = -at
-        b[i,:3] = bt
-        b[i,3:] = -bt
-        c[i,:3] = -taumax
-        c[i,3:] = -taumax
+    tvect = arange(ndiscrsteps) * discrtimestep
+    r, rd, rdd = EvalTrajBatch(rtraj, tvect)
+    at, bt = SO3ConstraintTerms(r, rd, rdd, I)
+    a[:,:3] = at
+    a[:,3:] = -at
+    b[:,:3] = bt
+    b[:,3:] = -bt
+    c[:,:3] = -taumax
+    c[:,3:] = -taumax
     return a, b, c
 
+def quatfromrotation(R):
+    """quatfromrotation returns the unit quaternion [w,x,y,z] of the
+    rotation matrix R, with w >= 0.
+    """
+    t = trace(R)
+    if t > 0:
+        s = 2*sqrt(1 + t)
+        q = array([s/4, (R[2,1]-R[1,2])/s, (R[0,2]-R[2,0])/s, (R[1,0]-R[0,1])/s])
+    elif (R[0,0] >= R[1,1]) and (R[0,0] >= R[2,2]):
+        s = 2*sqrt(1 + R[0,0] - R[1,1] - R[2,2])
+        q = array([(R[2,1]-R[1,2])/s, s/4, (R[0,1]+R[1,0])/s, (R[0,2]+R[2,0])/s])
+    elif R[1,1] >= R[2,2]:
+        s = 2*sqrt(1 - R[0,0] + R[1,1] - R[2,2])
+        q = array([(R[0,2]-R[2,0])/s, (R[0,1]+R[1,0])/s, s/4, (R[1,2]+R[2,1])/s])
+    else:
+        s = 2*sqrt(1 - R[0,0] - R[1,1] + R[2,2])
+        q = array([(R[1,0]-R[0,1])/s, (R[0,2]+R[2,0])/s, (R[1,2]+R[2,1])/s, s/4])
+    if q[0] < 0:
+        q = -q
+    return q
+
+def quatfromrotationbatch(Rs):
+    """quatfromrotationbatch is the array counterpart of quatfromrotation
+    for (N,3,3) rotation matrices.
+    """
+    Rs = asarray(Rs, dtype=float)
+    a00, a11, a22 = Rs[:,0,0], Rs[:,1,1], Rs[:,2,2]
+    a01, a02, a10, a12, a20, a21 = Rs[:,0,1], Rs[:,0,2], Rs[:,1,0], Rs[:,1,2], Rs[:,2,0], Rs[:,2,1]
+    ## row k is 4*q[k]*q; the row of the largest q[k] is divided by 4*q[k]
+    K = array([[1 + a00 + a11 + a22, a21 - a12, a02 - a20, a10 - a01],
+               [a21 - a12, 1 + a00 - a11 - a22, a01 + a10, a02 + a20],
+               [a02 - a20, a01 + a10, 1 - a00 + a11 - a22, a12 + a21],
+               [a10 - a01, a02 + a20, a12 + a21, 1 - a00 - a11 + a22]]).transpose(2, 0, 1)
+    n = arange(len(Rs))
+    k = argmax(K[:,[0,1,2,3],[0,1,2,3]], axis=1)
+    q = K[n,k]/(2*sqrt(K[n,k,k]))[:,None]
+    return where((q[:,0] < 0)[:,None], -q, q)
+
+## The quaternion functions below work on quaternions [w,x,y,z] (and
+## rotation vectors) stored along the last axis, so that they apply to
+## single ones as well as to (N,4) and (N,3) arrays.
+def rotationfromquat(q):
+    """rotationfromquat returns the rotation matrix of the unit
+    quaternion q (an array of shape (...,3,3) for q of shape (...,4)).
+    """
+    q = asarray(q, dtype=float)
+    w, x, y, z = q[...,0], q[...,1], q[...,2], q[...,3]
+    R = empty(q.shape[:-1] + (3,3))
+    R[...,0,0] = 1 - 2*(y*y + z*z)
+    R[...,0,1] = 2*(x*y - w*z)
+    R[...,0,2] = 2*(x*z + w*y)
+    R[...,1,0] = 2*(x*y + w*z)
+    R[...,1,1] = 1 - 2*(x*x + z*z)
+    R[...,1,2] = 2*(y*z - w*x)
+    R[...,2,0] = 2*(x*z - w*y)
+    R[...,2,1] = 2*(y*z + w*x)
+    R[...,2,2] = 1 - 2*(x*x + y*y)
+    return R
+
+def quatmult(q0, q1):
+    """quatmult returns the quaternion product q0*q1, i.e. the quaternion
+    of dot(rotationfromquat(q0), rotationfromquat(q1)).
+    """
+    q0 = asarray(q0, dtype=float)
+    q1 = asarray(q1, dtype=float)
+    w0 = q0[...,0:1]
+    w1 = q1[...,0:1]
+    v0 = q0[...,1:]
+    v1 = q1[...,1:]
+    w = w0*w1 - sum(v0*v1, axis=-1)[...,None]
+    return concatenate([w, w0*v1 + w1*v0 + cross(v0, v1)], axis=-1)
+
+def quatconj(q):
+    q = array(q, dtype=float)
+    q[...,1:] *= -1
+    return q
+
+def quatcanonical(q):
+    """quatcanonical returns q or -q, whichever has w >= 0.
+    """
+    q = asarray(q, dtype=float)
+    return where(q[...,0:1] < 0, -q, q)
+
+def quatexp(r):
+    """quatexp returns the unit quaternion of expmat(r),
+    [cos(nr/2), sin(nr/2)/nr*r].
+    """
+    r = asarray(r, dtype=float)
+    nr = sqrt(sum(r*r, axis=-1))[...,None]
+    small = (nr < 1e-4)
+    k = where(small, 0.5 - nr*nr/48, sin(nr/2)/where(small, 1, nr))
+    return concatenate([cos(nr/2), k*r], axis=-1)
+
+def quatlog(q):
+    """quatlog returns the rotation vector (of norm in [0,pi]) of the
+    unit quaternion q, i.e. logvect(rotationfromquat(q)).
+    """
+    q = quatcanonical(q)
+    w = q[...,0:1]
+    v = q[...,1:]
+    nv = sqrt(sum(v*v, axis=-1))[...,None]
+    small = (nv < 1e-8)
+    ## 2*atan2(nv, w)/nv tends to 2/w, w being then close to 1
+    k = where(small, 2/where(small, w, 1), 2*arctan2(nv, w)/where(small, 1, nv))
+    return k*v
+
+def quatangle(q0, q1):
+    """quatangle returns the angle (in [0,pi]) of the rotation between
+    the unit quaternions q0 and q1, norm(logvect(dot(R0.T,R1))). It uses
+    the chords between q0 and +-q1, which, unlike arccos of the inner
+    product, stays accurate at small angles.
+    """
+    q0 = asarray(q0, dtype=float)
+    q1 = asarray(q1, dtype=float)
+    if q0.ndim == 1 and q1.ndim == 1:
+        ## single pair (e.g. the planners' Distance)
+        if dot(q0, q1) < 0:
+            q1 = -q1
+        dminus = q0 - q1
+        dplus = q0 + q1
+        return 4*math.atan2(math.sqrt(dot(dminus, dminus)), math.sqrt(dot(dplus, dplus)))
+    q1 = where((sum(q0*q1, axis=-1) < 0)[...,None], -q1, q1)
+    return 4*arctan2(sqrt(sum((q0 - q1)**2, axis=-1)), sqrt(sum((q0 + q1)**2, axis=-1)))
+
 def RandomQuat():
     s = random.rand()
     sigma1 = sqrt(1-s)